@@ -0,0 +1,1253 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: classGraph.py
+# Project: wikidata2
+# Description: Compact graph of class relations (subclass of) used by ClassRelationsBuilder.
+#              Class ids are interned to integer nodes, ancestors and successors of nodes are stored
+#              in compressed sparse row layout (offsets into one array('I') of nodes). New relations
+#              are appended to buffers of edges and merged into rows when the graph is read, so building
+#              of the graph does not create any per-class objects.
+#              Rows keep order in which relations were added and contain each relation only once,
+#              so the graph is exported to the same json dump as dictionary of class relations.
+#              Transitive closures of relations are computed once per node by Closure: cycles are condensed
+#              by Tarjan's algorithm and closures of acyclic nodes are composed from closures of their
+#              ancestors (or successors) level by level, so they keep breadth-first order of the search
+#              they replace. Nodes with the same relations share one closure.
+#              Paths from root classes to classes are enumerated by Paths, paths of nodes outside cycles
+#              do not depend on the path they are reached by, so they are enumerated only once.
+#              Graph is saved to json dump or to binary dump which is loaded through mmap without parsing:
+#                header (magic, byte order, numbers of nodes, classes, relations, size of ids and closure)
+#                offsets of class ids (uint64), UTF-8 class ids (sorted, nodes are numbered in this order),
+#                nodes are classes (uint8), classes in order of addition (uint32),
+#                ancestors and successors (offsets of rows as uint64, nodes as uint32),
+#                optional transitive closure of ancestors (offsets, nodes, node which is not a class or 2^32-1)
+#              each section is aligned to 8 bytes.
+#              Binary dump can be published to node-local directory (e.g. /dev/shm) once, all processes
+#              on the node then map the same pages (see get_shared_dump()).
+#              Run as script to convert json dump to binary dump or back.
+
+import argparse
+import fcntl  # lock of shared dump
+import hashlib  # name of shared dump
+import json  # keys of json dump
+import mmap  # binary dump
+import os  # filesystem
+import shutil  # copy of shared dump
+import struct  # binary dump header
+import sys  # byte order, stderr
+import traceback  # for printing exceptions
+from array import array  # adjacency, edge buffers
+from bisect import bisect_left  # lookup of class ids in binary dump
+from collections import Counter  # sizes of rows
+from itertools import accumulate, chain, compress, filterfalse, repeat  # merging of edges, graphs
+from operator import and_, lshift, not_, or_, rshift, sub  # edge keys, sizes of rows
+
+import compressedFiles  # compressed json dumps
+
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# maximal number of buffered edges of one direction
+MERGE_BATCH_SIZE = 2 * 1024 * 1024
+# magic bytes at the beginning of the binary dump
+MAGIC = b"WDCLSG1\0"
+# header: magic, byte order (b/l), padding, numbers of nodes, classes, ancestor relations, successor relations,
+#         size of class ids, size of transitive closure (0 = closure is not saved)
+HEADER = struct.Struct("=8sc7xQQQQQQ")
+# node of closure without missing class
+NO_NODE = 0xFFFFFFFF
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Converts class relations dump from json to binary format or from binary format to json."
+    )
+    argparser.add_argument(
+        "-i", "--input", help="Class relations dump (json or binary).", required=True
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        help="Output dump (binary for json input, json for binary input).",
+        required=True,
+    )
+    argparser.add_argument(
+        "-t",
+        "--closure",
+        help="Save transitive closure of ancestors to binary dump.",
+        default=False,
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--compression",
+        help="Compression of json output (default: OUTPUT_COMPRESSION from env_variables.cfg).",
+        choices=sorted(compressedFiles.COMPRESSION_SUFFIXES),
+        default=None,
+    )
+    return argparser.parse_args()
+
+
+def is_binary_dump(path):
+    """
+    :param path: path to the dump
+    :raise IOError if fails to read file
+    :return: True if file is binary class relations dump
+    """
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def get_shared_dump(dump_path, shared_dir, closure=True):
+    """
+    Publishes class relations dump as binary dump to node-local directory shared by processes.
+    The first process converts (json) or copies (binary) the dump, other processes wait for it and use
+    the published dump. Published dump is identified by path, size and modification time of the dump.
+    :param dump_path: path to json or binary dump
+    :param shared_dir: node-local directory (e.g. in /dev/shm)
+    :param closure: save transitive closure of ancestors when json dump is converted
+    :raise IOError if fails to read dump or to write published dump
+    :return: path to published binary dump
+    """
+    stat = os.stat(dump_path)
+    name = hashlib.sha1(
+        f"{os.path.abspath(dump_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest()
+    shared_path = os.path.join(shared_dir, f"classes_{name[:16]}.bin")
+    if os.path.exists(shared_path):
+        return shared_path
+
+    os.makedirs(shared_dir, exist_ok=True)
+    with open(shared_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # other processes wait until dump is published
+        if not os.path.exists(shared_path):
+            temp_path = f"{shared_path}.{os.getpid()}.temp"
+            try:
+                if is_binary_dump(dump_path):
+                    shutil.copyfile(dump_path, temp_path)
+                else:
+                    with compressedFiles.open_file(dump_path, "r") as file:
+                        graph = ClassGraph.from_dict(json.load(file))
+                    with open(temp_path, "wb") as file:
+                        graph.write_binary(file, closure)
+                os.replace(temp_path, shared_path)  # dump appears at once
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    return shared_path
+
+
+class IdTable:
+    """
+    Sorted class ids of nodes stored in binary dump (sequence of strings).
+    """
+
+    def __init__(self, offsets, data):
+        """
+        :param offsets: offsets of ids in data (id of node n is data[offsets[n]:offsets[n + 1]])
+        :param data: UTF-8 encoded ids
+        """
+        self.offsets = offsets
+        self.data = data
+
+    def __getitem__(self, node):
+        return str(self.data[self.offsets[node] : self.offsets[node + 1]], "utf-8")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+
+class NodeTable:
+    """
+    Mapping of class ids to nodes of binary dump (binary search in sorted ids).
+    """
+
+    def __init__(self, ids):
+        """
+        :param ids: IdTable
+        """
+        self.ids = ids
+
+    def get(self, class_id, default=None):
+        node = bisect_left(self.ids, class_id)
+        if node < len(self.ids) and self.ids[node] == class_id:
+            return node
+        return default
+
+    def __getitem__(self, class_id):
+        node = self.get(class_id)
+        if node is None:
+            raise KeyError(class_id)
+        return node
+
+    def __contains__(self, class_id):
+        return self.get(class_id) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+
+class Adjacency:
+    """
+    Relations of one direction (ancestors or successors) of all nodes.
+    Rows are stored in compressed sparse row layout, new edges are buffered until next read.
+    """
+
+    def __init__(self):
+        self.offsets = array("Q", [0])  # row of node n is targets[offsets[n]:offsets[n + 1]]
+        self.targets = array("I")
+        self.pending_sources = array("I")  # buffered edges
+        self.pending_targets = array("I")
+        self.changes = 0  # number of modifications of rows (closures of older rows are invalid)
+
+    def add(self, source, target):
+        """
+        Adds edge (duplicate edges are removed when edges are merged to rows).
+        :param source: node the edge starts in
+        :param target: node the edge ends in
+        """
+        self.pending_sources.append(source)
+        self.pending_targets.append(target)
+        if len(self.pending_sources) >= MERGE_BATCH_SIZE:  # bound memory used by merge
+            self.merge()
+
+    def extend(self, sources, targets):
+        """
+        Adds edges (duplicate edges are removed when edges are merged to rows).
+        :param sources: array of nodes the edges start in
+        :param targets: array of nodes the edges end in
+        """
+        self.pending_sources.extend(sources)
+        self.pending_targets.extend(targets)
+        if len(self.pending_sources) >= MERGE_BATCH_SIZE:
+            self.merge()
+
+    def thaw(self):
+        """
+        Copies rows mapped from binary dump to memory, so they can be modified.
+        """
+        if not isinstance(self.targets, array):
+            self.offsets = array("Q", bytes(self.offsets))
+            self.targets = array("I", bytes(self.targets))
+
+    def clear(self, node):
+        """
+        Removes all edges of node.
+        :param node: node to clear
+        """
+        self.merge()
+        self.thaw()
+        self.changes += 1
+        if node + 1 < len(self.offsets):
+            start, end = self.offsets[node], self.offsets[node + 1]
+            del self.targets[start:end]
+            for i in range(node + 1, len(self.offsets)):
+                self.offsets[i] -= end - start
+
+    def get(self, node):
+        """
+        :param node: node of the row
+        :return: targets of edges of node (array of nodes in order of addition)
+        """
+        if self.pending_sources:
+            self.merge()
+        if node + 1 >= len(self.offsets):
+            return array("I")
+        return self.targets[self.offsets[node] : self.offsets[node + 1]]
+
+    def sources(self):
+        """
+        :return: source nodes of merged edges (array parallel to targets)
+        """
+        row_sizes = map(sub, self.offsets[1:], self.offsets[:-1])
+        return array("I", chain.from_iterable(map(repeat, range(len(self.offsets) - 1), row_sizes)))
+
+    def __len__(self):
+        """
+        :return: number of edges (including buffered edges which may be duplicate)
+        """
+        return len(self.targets) + len(self.pending_targets)
+
+    def merge(self, node_count=0):
+        """
+        Merges buffered edges to rows, edges of each row keep order of addition without duplicates.
+        :param node_count: minimal number of rows
+        """
+        if not self.pending_sources and node_count < len(self.offsets):
+            return
+        self.thaw()
+        self.changes += 1
+        sources, targets = self.pending_sources, self.pending_targets
+        self.pending_sources = array("I")
+        self.pending_targets = array("I")
+        row_count = max(len(self.offsets) - 1, node_count, max(sources, default=-1) + 1)
+
+        old_offsets, old_targets = self.offsets, self.targets
+        old_rows = len(old_offsets) - 1
+        touched = sorted(set(sources))
+        if not old_targets or len(touched) * 4 > row_count:
+            # all edges are sorted to rows at once (sort is stable, so old edges of row precede
+            # buffered edges, which keep order of addition) and the first occurrence of edge is kept
+            if old_targets:
+                sources = self.sources() + sources
+                targets = old_targets + targets
+            keys = array("Q", map(or_, map(lshift, sources, repeat(32)), targets))
+            order = sorted(range(len(sources)), key=sources.__getitem__)
+            if len(set(keys)) == len(keys):  # without duplicate edges
+                counts = Counter(sources)
+                self.targets = array("I", map(targets.__getitem__, order))
+            else:
+                edges = dict.fromkeys(map(keys.__getitem__, order))
+                counts = Counter(map(rshift, edges, repeat(32)))
+                self.targets = array("I", map(and_, edges, repeat(0xFFFFFFFF)))
+            self.offsets = array(
+                "Q", accumulate(map(counts.get, range(row_count), repeat(0)), initial=0)
+            )
+            return
+
+        # buffered edges sorted to rows (sort is stable, so edges keep order of addition)
+        counts = Counter(sources)
+        bucket_offsets = array(
+            "Q", accumulate(map(counts.get, range(row_count), repeat(0)), initial=0)
+        )
+        del counts
+        buckets = array(
+            "I", map(targets.__getitem__, sorted(range(len(sources)), key=sources.__getitem__))
+        )
+        new_rows = len(touched) - bisect_left(touched, old_rows)  # touched rows of new nodes
+        unique = new_rows and len(
+            set(map(or_, map(lshift, sources, repeat(32)), targets))
+        ) == len(sources)
+        if unique:  # rows of new nodes are copied from buckets at once
+            del touched[len(touched) - new_rows :]
+        offsets = array("Q", [0])
+        merged = array("I")
+
+        def copy_rows(first, last):
+            # rows without buffered edges are copied at once
+            end = min(last, old_rows)
+            if first < end:
+                shift = len(merged) - old_offsets[first]
+                merged.extend(old_targets[old_offsets[first] : old_offsets[end]])
+                offsets.extend(map(shift.__add__, old_offsets[first + 1 : end + 1]))
+            if max(first, end) < last:
+                offsets.extend(array("Q", [len(merged)]) * (last - max(first, end)))
+
+        next_row = 0
+        for node in touched:
+            copy_rows(next_row, node)
+            row = old_targets[old_offsets[node] : old_offsets[node + 1]] if node < old_rows else ()
+            bucket = buckets[bucket_offsets[node] : bucket_offsets[node + 1]]
+            merged.extend(dict.fromkeys(chain(row, bucket)))
+            offsets.append(len(merged))
+            next_row = node + 1
+        if unique:
+            copy_rows(next_row, old_rows)
+            shift = len(merged) - bucket_offsets[old_rows]
+            merged.extend(buckets[bucket_offsets[old_rows] :])
+            offsets.extend(map(shift.__add__, bucket_offsets[old_rows + 1 :]))
+        else:
+            copy_rows(next_row, row_count)
+        self.offsets = offsets
+        self.targets = merged
+
+
+class ClassGraph:
+    """
+    Graph of class relations with interned class ids.
+    Classes are nodes with their own relations record (as keys of class relations dictionary),
+    nodes referenced only as ancestors or successors of other classes are not classes.
+    """
+
+    def __init__(self):
+        self.ids = []  # node -> class id
+        self.nodes = {}  # class id -> node
+        self.is_class = bytearray()  # node has relations record
+        self.class_order = array("I")  # classes in order of addition
+        self.ancestors = Adjacency()
+        self.successors = Adjacency()
+        self.changes = 0  # number of added or removed classes
+        self.closures = {}  # relations name -> Closure
+        self.paths = None  # Paths of the last closure of ancestors
+        self.stored_closure = None  # closure of ancestors loaded from binary dump
+        self.stored_version = None  # changes of the graph when stored closure was loaded
+        self.data = None  # memory mapped binary dump
+
+    @classmethod
+    def from_dict(cls, classes):
+        """
+        Creates graph from dictionary of class relations (json dump).
+        :param classes: dictionary {class id: {"ancestors": [...], "successors": [...]}}
+        :return: ClassGraph instance
+        """
+        graph = cls()
+        graph.merge_dict(classes)
+        return graph
+
+    def merge_dict(self, classes):
+        """
+        Adds relations from dictionary of class relations (json dump) to the graph.
+        :param classes: dictionary {class id: {"ancestors": [...], "successors": [...]}}
+        """
+        for class_id, relations in classes.items():
+            node = self.add_class(class_id)
+            for ancestor_id in relations["ancestors"]:
+                self.ancestors.add(node, self.get_node(ancestor_id))
+            for successor_id in relations["successors"]:
+                self.successors.add(node, self.get_node(successor_id))
+
+    def merge_graph(self, graph):
+        """
+        Adds classes and relations of other graph in the same order as merge_dict() of its dump would.
+        :param graph: ClassGraph
+        """
+        self.thaw()
+        # ids are interned at once, new nodes keep order of the other graph
+        new_ids = list(filterfalse(self.nodes.__contains__, graph.ids))
+        self.nodes.update(zip(new_ids, range(len(self.ids), len(self.ids) + len(new_ids))))
+        self.ids.extend(new_ids)
+        self.is_class.extend(bytes(len(new_ids)))
+        nodes = array("I", map(self.nodes.__getitem__, graph.ids))  # node of other graph -> node
+        new_classes = array(
+            "I", filterfalse(self.is_class.__getitem__, map(nodes.__getitem__, graph.class_order))
+        )
+        if new_classes:
+            for node in new_classes:
+                self.is_class[node] = 1
+            self.class_order.extend(new_classes)
+            self.changes += 1
+        for relations, other in (
+            (self.ancestors, graph.ancestors),
+            (self.successors, graph.successors),
+        ):
+            # rows of other graph precede its buffered edges, so they are merged in the same order
+            row_sizes = map(sub, other.offsets[1:], other.offsets[:-1])
+            relations.extend(
+                array(
+                    "I",
+                    chain(
+                        chain.from_iterable(map(repeat, nodes, row_sizes)),
+                        map(nodes.__getitem__, other.pending_sources),
+                    ),
+                ),
+                array("I", map(nodes.__getitem__, chain(other.targets, other.pending_targets))),
+            )
+
+    def __getstate__(self):
+        # graph is sent between processes without lookup table of nodes and caches,
+        # buffered relations are sent as they are and merged by the receiving process
+        self.thaw()
+        state = self.__dict__.copy()
+        for key in ("nodes", "closures", "paths", "stored_closure", "stored_version", "data"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.nodes = dict(zip(self.ids, range(len(self.ids))))
+        self.closures = {}
+        self.paths = None
+        self.stored_closure = None
+        self.stored_version = None
+        self.data = None
+
+    def get_node(self, class_id):
+        """
+        Returns node of class id, new node is created if class id is not interned yet.
+        :param class_id: id of the class
+        :return: node
+        """
+        node = self.nodes.get(class_id)
+        if node is None:
+            self.thaw()
+            node = self.nodes[class_id] = len(self.ids)
+            self.ids.append(class_id)
+            self.is_class.append(0)
+        return node
+
+    def find_class(self, class_id):
+        """
+        :param class_id: id of the class
+        :raise KeyError if class is not in the graph
+        :return: node of the class
+        """
+        node = self.nodes[class_id]
+        if not self.is_class[node]:
+            raise KeyError(class_id)
+        return node
+
+    def add_class(self, class_id):
+        """
+        Adds class to the graph (existing class is kept).
+        :param class_id: id of the class
+        :return: node of the class
+        """
+        return self.add_class_node(self.get_node(class_id))
+
+    def add_class_node(self, node):
+        """
+        Makes interned node a class (existing class is kept).
+        :param node: node of the class
+        :return: node of the class
+        """
+        if not self.is_class[node]:
+            self.thaw()
+            self.is_class[node] = 1
+            self.class_order.append(node)
+            self.changes += 1
+        return node
+
+    def remove_class(self, class_id):
+        """
+        Removes class and its relations (references from other classes are kept).
+        :param class_id: id of the class
+        """
+        node = self.nodes.get(class_id)
+        if node is not None and self.is_class[node]:
+            self.thaw()
+            self.is_class[node] = 0
+            self.class_order.remove(node)
+            self.changes += 1
+            self.ancestors.clear(node)
+            self.successors.clear(node)
+
+    def add_ancestor(self, class_id, ancestor_id):
+        """
+        Adds ancestor of class (class is created if it does not exist).
+        """
+        self.ancestors.add(self.add_class(class_id), self.get_node(ancestor_id))
+
+    def add_successor(self, class_id, successor_id):
+        """
+        Adds successor of class (class is created if it does not exist).
+        """
+        self.successors.add(self.add_class(class_id), self.get_node(successor_id))
+
+    def get_ancestors(self, class_id):
+        """
+        :param class_id: id of the class
+        :raise KeyError if class is not in the graph
+        :return: list of ids of ancestors
+        """
+        ids = self.ids
+        return [ids[node] for node in self.ancestors.get(self.find_class(class_id))]
+
+    def get_successors(self, class_id):
+        """
+        :param class_id: id of the class
+        :raise KeyError if class is not in the graph
+        :return: list of ids of successors
+        """
+        ids = self.ids
+        return [ids[node] for node in self.successors.get(self.find_class(class_id))]
+
+    def get_closure(self, name):
+        """
+        Returns transitive closure of relations, closure is reused while the graph is not modified.
+        :param name: relations to follow ("ancestors" or "successors")
+        :return: Closure instance
+        """
+        self.merge()
+        relations = getattr(self, name)
+        version = (self.changes, relations.changes)
+        closure = self.closures.get(name)
+        if closure is None or closure.version != version:
+            stored = None
+            if name == "ancestors" and version == self.stored_version:
+                stored = self.stored_closure
+            closure = self.closures[name] = Closure(self, relations, stored)
+        return closure
+
+    def get_paths(self, max_paths=None, max_depth=None):
+        """
+        Returns paths from root classes, paths are reused while the graph is not modified.
+        :param max_paths: maximal number of paths of each node (None = unlimited)
+        :param max_depth: maximal number of classes in path (None = unlimited)
+        :return: Paths instance
+        """
+        closure = self.get_closure("ancestors")
+        paths = self.paths
+        if (
+            paths is None
+            or paths.closure is not closure
+            or (paths.max_paths, paths.max_depth) != (max_paths, max_depth)
+        ):
+            paths = self.paths = Paths(self, max_paths, max_depth)
+        return paths
+
+    def get_reachable(self, roots, name="successors"):
+        """
+        Finds nodes reachable from each of given nodes in single pass shared by all of them:
+          - strongly connected components of nodes reachable from any root are found by Tarjan's algorithm
+          - bit masks of roots are propagated from components to their related components
+            in topological order (reverse order in which the components are finished)
+        :param roots: nodes to start from (without duplicates)
+        :param name: relations to follow ("ancestors" or "successors")
+        :return: list of arrays of nodes reachable from each root (without the root itself) ordered by nodes
+        """
+        self.merge()
+        relations = getattr(self, name)
+        offsets, targets = relations.offsets, relations.targets
+
+        def get_row(node):
+            if node + 1 >= len(offsets):
+                return ()
+            return targets[offsets[node] : offsets[node + 1]]
+
+        component_of = {}  # node -> index of its strongly connected component
+        components = []  # components in order of finishing (related components first)
+        index = {}  # order of discovery
+        low = {}  # lowest index reachable from the node
+        stack = []  # nodes of unfinished components
+        on_stack = set()
+        for root in roots:
+            if root in index:  # reached from previous root
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(get_row(root)))]
+            while work:
+                node, related = work[-1]
+                for child in related:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(get_row(child))))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:  # node is root of component
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component_of[member] = len(components)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+        del index, low
+
+        masks = [0] * len(components)  # component -> bit mask of roots reaching it
+        for bit, root in enumerate(roots):
+            masks[component_of[root]] |= 1 << bit
+        for position in reversed(range(len(components))):
+            mask = masks[position]
+            for member in components[position]:
+                for child in get_row(member):
+                    masks[component_of[child]] |= mask
+
+        reachable = [array("I") for _ in roots]
+        for node in sorted(component_of):
+            mask = masks[component_of[node]]
+            while mask:
+                bit = (mask & -mask).bit_length() - 1
+                mask &= mask - 1
+                if node != roots[bit]:
+                    reachable[bit].append(node)
+        return reachable
+
+    def classes(self):
+        """
+        :return: nodes of classes in order of addition
+        """
+        return self.class_order
+
+    def complete_relations(self):
+        """
+        Adds missing inverse relations (each class is successor of its ancestors and ancestor of its successors).
+        Nodes referenced by classes become classes.
+        All edges are inverted at once, only inverse edges missing in the graph are added.
+        :return: number of added relations
+        """
+        self.merge()
+        self.thaw()
+        edge_count = len(self.ancestors) + len(self.successors)
+        rank = dict(zip(self.class_order, range(len(self.class_order))))  # class -> order of addition
+        inverse_edges = []
+        referenced = []  # (rank of class, relations, edge, node) of referenced nodes
+        # relations added here are inverse relations of the original ones, so original rows are read
+        for index, (relations, inverse) in enumerate(
+            ((self.ancestors, self.successors), (self.successors, self.ancestors))
+        ):
+            # edges sorted by order of classes (sort is stable, so edges of row keep their order)
+            classes = relations.sources()
+            keys = array("I", map(rank.__getitem__, classes))
+            order = sorted(range(len(classes)), key=keys.__getitem__)
+            del keys
+            sources = array("I", map(relations.targets.__getitem__, order))
+            targets = array("I", map(classes.__getitem__, order))
+            del classes, order
+            referenced.extend(
+                (rank[targets[edge]], index, edge, sources[edge])
+                for edge in compress(
+                    range(len(sources)), map(not_, map(self.is_class.__getitem__, sources))
+                )
+            )
+            if inverse.targets:  # inverse edges already in the graph are skipped
+                existing = set(
+                    map(or_, map(lshift, inverse.sources(), repeat(32)), inverse.targets)
+                )
+                missing = bytes(
+                    map(
+                        not_,
+                        map(
+                            existing.__contains__,
+                            map(or_, map(lshift, sources, repeat(32)), targets),
+                        ),
+                    )
+                )
+                del existing
+                sources = array("I", compress(sources, missing))
+                targets = array("I", compress(targets, missing))
+            inverse_edges.append((inverse, sources, targets))
+
+        # referenced nodes become classes in the same order as they were encountered
+        new_classes = array("I", dict.fromkeys(node for *_, node in sorted(referenced)))
+        if new_classes:
+            for node in new_classes:
+                self.is_class[node] = 1
+            self.class_order.extend(new_classes)
+            self.changes += 1
+        for inverse, sources, targets in inverse_edges:
+            inverse.extend(sources, targets)
+        self.merge()
+        return len(self.ancestors) + len(self.successors) - edge_count
+
+    def thaw(self):
+        """
+        Copies graph mapped from binary dump to memory, so it can be modified.
+        """
+        if isinstance(self.nodes, dict):
+            return
+        self.ids = list(self.ids)
+        self.nodes = dict(zip(self.ids, range(len(self.ids))))
+        self.is_class = bytearray(self.is_class)
+        self.class_order = array("I", bytes(self.class_order))
+        self.ancestors.thaw()
+        self.successors.thaw()
+
+    def merge(self):
+        """
+        Merges buffered relations to rows of all nodes.
+        """
+        self.ancestors.merge(len(self.ids))
+        self.successors.merge(len(self.ids))
+
+    def __contains__(self, class_id):
+        node = self.nodes.get(class_id)
+        return node is not None and bool(self.is_class[node])
+
+    def __len__(self):
+        return len(self.class_order)
+
+    def to_dict(self):
+        """
+        :return: dictionary of class relations {class id: {"ancestors": [...], "successors": [...]}}
+        """
+        ids = self.ids
+        return {
+            ids[node]: {
+                "successors": [ids[n] for n in self.successors.get(node)],
+                "ancestors": [ids[n] for n in self.ancestors.get(node)],
+            }
+            for node in self.class_order
+        }
+
+    def write_json(self, file):
+        """
+        Writes class relations in the same format as json.dump(self.to_dict(), file, indent=4, sort_keys=True),
+        but without creating the dictionary.
+        :param file: output file
+        :raise IOError if fails to write to file
+        """
+        if not self.class_order:
+            file.write("{}")
+            return
+        self.merge()
+        ids = self.ids
+
+        def write_list(name, nodes, last):
+            if len(nodes):
+                file.write(f'        "{name}": [\n')
+                file.write(
+                    ",\n".join("            " + json.dumps(ids[n]) for n in nodes) + "\n"
+                )
+                file.write("        ]" + ("\n" if last else ",\n"))
+            else:
+                file.write(f'        "{name}": []' + ("\n" if last else ",\n"))
+
+        file.write("{\n")
+        nodes = sorted(self.class_order, key=ids.__getitem__)
+        for i, node in enumerate(nodes):
+            file.write("    " + json.dumps(ids[node]) + ": {\n")
+            write_list("ancestors", self.ancestors.get(node), False)
+            write_list("successors", self.successors.get(node), True)
+            file.write("    }\n" if i + 1 == len(nodes) else "    },\n")
+        file.write("}")
+
+    def write_binary(self, file, closure=False):
+        """
+        Writes graph to binary dump (see description of this file).
+        :param file: file opened in binary mode (dump is not compressed to be memory mapped)
+        :param closure: save transitive closure of ancestors
+        :raise IOError if fails to write to file
+        """
+        self.merge()
+        ids = self.ids
+        order = sorted(range(len(ids)), key=ids.__getitem__)  # nodes of dump
+        position = array("I", bytes(4 * len(order)))  # node -> node of dump
+        for new_node, node in enumerate(order):
+            position[node] = new_node
+        encoded_ids = [ids[node].encode("utf-8") for node in order]
+
+        def write_section(data):
+            data = bytes(data)
+            file.write(data)
+            file.write(bytes(-len(data) % 8))
+
+        def get_rows(get_row):
+            offsets = array("Q", [0])
+            targets = array("I")
+            for node in order:
+                targets.extend(map(position.__getitem__, get_row(node)))
+                offsets.append(len(targets))
+            return offsets, targets
+
+        sections = [
+            array("Q", accumulate(map(len, encoded_ids), initial=0)),
+            b"".join(encoded_ids),
+            bytes(map(self.is_class.__getitem__, order)),
+            array("I", map(position.__getitem__, self.class_order)),
+            *get_rows(self.ancestors.get),
+            *get_rows(self.successors.get),
+        ]
+        closure_size = 0
+        if closure and order:
+            ancestor_closure = self.get_closure("ancestors")
+            missing = array("I")
+
+            def get_closure_row(node):
+                if not self.is_class[node]:
+                    missing.append(position[node])
+                    return ()
+                reached, missing_node = ancestor_closure.find(node)
+                missing.append(NO_NODE if missing_node is None else position[missing_node])
+                return reached
+
+            closure_offsets, closure_targets = get_rows(get_closure_row)
+            sections.extend((closure_offsets, closure_targets, missing))
+            closure_size = len(closure_targets)
+
+        file.write(
+            HEADER.pack(
+                MAGIC,
+                b"l" if sys.byteorder == "little" else b"b",
+                len(order),
+                len(self.class_order),
+                len(sections[5]),
+                len(sections[7]),
+                len(sections[1]),
+                closure_size,
+            )
+        )
+        for section in sections:
+            write_section(section)
+
+    @classmethod
+    def from_binary(cls, file):
+        """
+        Maps graph from binary dump, the graph is copied to memory when it is modified.
+        :param file: file opened in binary mode (file can be closed after loading)
+        :raise ValueError if file is not binary dump or has different byte order
+        :raise IOError if dump is truncated
+        :return: ClassGraph instance
+        """
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(data) < HEADER.size or data[: len(MAGIC)] != MAGIC:
+            raise ValueError("File is not binary class relations dump!")
+        (
+            _,
+            byte_order,
+            node_count,
+            class_count,
+            ancestor_count,
+            successor_count,
+            ids_size,
+            closure_size,
+        ) = HEADER.unpack_from(data)
+        if byte_order != (b"l" if sys.byteorder == "little" else b"b"):
+            raise ValueError("Byte order of class relations dump differs from this machine!")
+
+        view = memoryview(data)
+        position = HEADER.size
+
+        def read_section(fmt, count):
+            nonlocal position
+            size = count * struct.calcsize(fmt)
+            if position + size > len(data):
+                raise IOError("Class relations dump is truncated!")
+            section = view[position : position + size].cast(fmt)
+            position += size + -size % 8
+            return section
+
+        graph = cls()
+        graph.data = data
+        graph.ids = IdTable(read_section("Q", node_count + 1), read_section("B", ids_size))
+        graph.nodes = NodeTable(graph.ids)
+        graph.is_class = read_section("B", node_count)
+        graph.class_order = read_section("I", class_count)
+        for relations, count in ((graph.ancestors, ancestor_count), (graph.successors, successor_count)):
+            relations.offsets = read_section("Q", node_count + 1)
+            relations.targets = read_section("I", count)
+        if closure_size:
+            graph.stored_closure = (
+                read_section("Q", node_count + 1),
+                read_section("I", closure_size),
+                read_section("I", node_count),
+            )
+            graph.stored_version = (graph.changes, graph.ancestors.changes)
+        return graph
+
+
+class Closure:
+    """
+    Transitive closure of relations of one direction of the graph (all ancestors or all successors of nodes).
+    Closure of node is list of nodes reachable from it in breadth-first order of relations without the node
+    itself. Closures are computed on demand and kept with offsets of ends of breadth-first levels:
+      - strongly connected components of unknown nodes are found by Tarjan's algorithm,
+        components are closed in reverse topological order (reachable components first)
+      - level k + 1 of closure of node outside a cycle is formed by levels k of closures of its related
+        nodes in order of relations without already reached nodes, which is the order of breadth-first search
+      - closures of nodes in cycles are found by breadth-first search
+    Reaching a node that is not a class makes the closure invalid (as relations of such node are not known).
+    """
+
+    def __init__(self, graph, relations, stored=None):
+        """
+        :param graph: ClassGraph with merged relations (graph must not be modified while closure is used)
+        :param relations: relations to follow (graph.ancestors or graph.successors)
+        :param stored: closure loaded from binary dump (offsets, nodes, missing nodes) or None
+        """
+        self.graph = graph
+        self.stored = stored
+        self.offsets = relations.offsets
+        self.targets = relations.targets
+        self.version = (graph.changes, relations.changes)
+        # node -> (reachable nodes, ends of levels) or reached node which is not a class
+        self.closures = {}
+        self.interned = {}  # relations of node -> closure shared by nodes with the same relations
+        self.components = {}  # node in cycle -> root node of its strongly connected component
+
+    def get(self, node):
+        """
+        :param node: node of the class
+        :raise KeyError if node or any of reachable nodes is not a class
+        :return: array of reachable nodes in breadth-first order
+        """
+        reached, missing = self.find(node)
+        if missing is not None:
+            raise KeyError(self.graph.ids[missing])
+        return reached
+
+    def find(self, node):
+        """
+        :param node: node of the class
+        :return: tuple (array of reachable nodes in breadth-first order, None)
+                 or (empty array, reached node which is not a class)
+        """
+        if self.stored is not None:
+            offsets, nodes, missing = self.stored
+            if missing[node] != NO_NODE:
+                return (), missing[node]
+            return nodes[offsets[node] : offsets[node + 1]], None
+        closure = self.closures.get(node)
+        if closure is None:
+            self.close(node)
+            closure = self.closures[node]
+        if type(closure) is int:
+            return (), closure
+        return closure[0], None
+
+    def get_component(self, node):
+        """
+        :param node: node
+        :return: root node of strongly connected component of node in cycle, None if node is not in cycle
+        """
+        if node not in self.closures:
+            self.close(node)
+        return self.components.get(node)
+
+    def get_row(self, node):
+        """
+        :param node: node
+        :return: array of directly related nodes
+        """
+        if node + 1 >= len(self.offsets):
+            return array("I")
+        return self.targets[self.offsets[node] : self.offsets[node + 1]]
+
+    def close(self, root):
+        """
+        Computes closures of node and of all nodes reachable from it (iterative Tarjan's algorithm).
+        :param root: node
+        """
+        closures = self.closures
+        index = {root: 0}  # order of discovery
+        low = {root: 0}  # lowest index reachable from the node
+        stack = [root]  # nodes of unfinished components
+        on_stack = {root}
+        work = [(root, iter(self.get_row(root)))]
+        while work:
+            node, related = work[-1]
+            for child in related:
+                if child in closures:  # closed in previous search
+                    continue
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(self.get_row(child))))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:  # node is root of component
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) == 1 and node not in self.get_row(node):
+                        closures[node] = self.compose(node)
+                    else:
+                        for member in component:
+                            self.components[member] = node
+                        for member in component:
+                            closures[member] = self.search(member)
+
+    def compose(self, node):
+        """
+        Composes closure of node outside a cycle from closures of its related nodes.
+        :param node: node with closed related nodes
+        :return: closure (reachable nodes, ends of levels) or reached node which is not a class
+        """
+        if not self.graph.is_class[node]:
+            return node
+        row = self.get_row(node)
+        key = tuple(row)
+        closure = self.interned.get(key)
+        if closure is not None:
+            return closure
+
+        related = []
+        for child in row:
+            child_closure = self.closures[child]
+            if type(child_closure) is int:
+                closure = child_closure
+                break
+            related.append(child_closure)
+        else:
+            reached = dict.fromkeys(row)
+            ends = array("I", [len(reached)])
+            level = 0
+            while True:
+                parts = [
+                    nodes[child_ends[level - 1] if level else 0 : child_ends[level]]
+                    for nodes, child_ends in related
+                    if level < len(child_ends)
+                ]
+                if not parts:
+                    break
+                reached.update(dict.fromkeys(chain.from_iterable(parts)))
+                if len(reached) == ends[-1]:  # no new node, next levels are reached too
+                    break
+                ends.append(len(reached))
+                level += 1
+            if not row:
+                ends = array("I")
+            closure = (array("I", reached), ends)
+        self.interned[key] = closure
+        return closure
+
+    def search(self, node):
+        """
+        Finds closure of node in cycle by breadth-first search.
+        :param node: node
+        :return: closure (reachable nodes, ends of levels) or reached node which is not a class
+        """
+        is_class = self.graph.is_class
+        reached = {node: None}
+        level = [node]
+        ends = array("I")
+        while level:
+            next_level = []
+            for current in level:
+                if not is_class[current]:
+                    return current
+                for child in self.get_row(current):
+                    if child not in reached:
+                        reached[child] = None
+                        next_level.append(child)
+            if next_level:
+                ends.append(len(reached) - 1)
+            level = next_level
+        del reached[node]
+        return array("I", reached), ends
+
+
+class Paths:
+    """
+    Paths from root classes to classes following ancestors, path is string of class ids joined by "->".
+    Path ends at a root class, at a node that is not a class, at a class already on the path (cycle)
+    or when it reaches maximal depth. Paths of node outside cycles (and of node in cycle reached from outside
+    of its cycle) do not depend on the rest of the path, so they are kept and reused, paths inside cycles
+    are enumerated with set of classes on the path like the recursive enumeration they replace.
+    Paths are not streamed, paths of each node are built and kept in memory (paths of entities are sorted
+    and deduplicated anyway and enumeration without cached paths of shared ancestors takes exponential time).
+    Number of paths grows combinatorially in dense graphs, so it can be limited:
+      - max_paths keeps only first paths (in sorted order) of each node, the limit is applied to every node
+        on the path as paths of node are built from kept paths of its ancestors, so kept paths of node are
+        not necessarily the first paths of all its paths, this bounds memory to max_paths paths per node
+      - max_depth limits number of classes in path (longer paths start at their ancestor at maximal depth)
+    Paths can be counted by count() before they are built to estimate their memory.
+    """
+
+    def __init__(self, graph, max_paths=None, max_depth=None):
+        """
+        :param graph: ClassGraph (graph must not be modified while paths are used)
+        :param max_paths: maximal number of paths of each node, applied to all nodes on paths (None = unlimited)
+        :param max_depth: maximal number of classes in path (None = unlimited)
+        """
+        self.graph = graph
+        self.closure = graph.get_closure("ancestors")  # cycles and relations
+        self.version = self.closure.version
+        self.max_paths = max_paths
+        self.max_depth = max_depth
+        self.paths = {}  # (node, depth) -> tuple of paths
+        self.counts = {}  # (node, depth) -> number of paths
+
+    def get(self, node):
+        """
+        :param node: node
+        :return: tuple of paths to node (not sorted, paths inside cycles can be repeated)
+        """
+        return self.enumerate(node, self.max_depth, set(), self.collect)
+
+    def count(self, node):
+        """
+        Counts paths to node without enumerating them (limit of paths is not applied).
+        :param node: node
+        :return: number of paths to node
+        """
+        return self.enumerate(node, self.max_depth, set(), self.add)
+
+    def collect(self, node, parts):
+        """
+        Joins paths of ancestors of node to paths of the node.
+        :param node: node
+        :param parts: list of tuples of paths of ancestors
+        :return: tuple of paths
+        """
+        suffix = "->" + self.graph.ids[node]
+        paths = [path + suffix for part in parts for path in part]
+        if self.max_paths is not None and len(paths) > self.max_paths:
+            paths = sorted(set(paths))[: self.max_paths]
+        return tuple(paths)
+
+    def add(self, node, parts):
+        """
+        Sums numbers of paths of ancestors of node.
+        :param node: node
+        :param parts: list of numbers of paths of ancestors
+        :return: number of paths
+        """
+        return sum(parts)
+
+    def enumerate(self, node, depth, closed, join):
+        """
+        Returns paths (or number of paths) to node (recursively).
+        :param node: node
+        :param depth: maximal number of classes in path (None = unlimited)
+        :param closed: set of nodes of the same cycle on the path, used for cyclic dependency check
+        :param join: self.collect for paths or self.add for numbers of paths
+        :return: tuple of paths or number of paths
+        """
+        cache = self.paths if join == self.collect else self.counts
+        key = (node, depth)
+        if not closed:  # paths don't depend on rest of the path
+            result = cache.get(key)
+            if result is not None:
+                return result
+
+        graph = self.graph
+        ancestors = self.closure.get_row(node)
+        # class data are not parsed / class is root class / cyclic dependency / maximal depth
+        if not graph.is_class[node] or not len(ancestors) or node in closed or depth == 1:
+            result = (graph.ids[node],) if join == self.collect else 1
+        else:
+            component = self.closure.get_component(node)
+            if component is not None:
+                closed.add(node)
+            next_depth = depth - 1 if depth else None
+            parts = []
+            for ancestor in ancestors:
+                if component is not None and self.closure.get_component(ancestor) == component:
+                    parts.append(self.enumerate(ancestor, next_depth, closed, join))
+                else:  # ancestor outside of cycle of node
+                    parts.append(self.enumerate(ancestor, next_depth, set(), join))
+            if component is not None:
+                closed.remove(node)
+            result = join(node, parts)
+
+        if not closed:
+            cache[key] = result
+        return result
+
+
+def main():
+    args = get_args()
+
+    try:
+        if is_binary_dump(args.input):
+            with open(args.input, "rb") as file:
+                graph = ClassGraph.from_binary(file)
+            with compressedFiles.open_file(args.output, "w", args.compression) as file:
+                graph.write_json(file)
+        else:
+            with compressedFiles.open_file(args.input, "r") as file:
+                graph = ClassGraph.from_dict(json.load(file))
+            with open(args.output, "wb") as file:
+                graph.write_binary(file, args.closure)
+    except Exception:
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to convert class relations dump! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
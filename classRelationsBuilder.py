@@ -5,12 +5,28 @@
 # Description: Creates wikidata class relations and generates transitive closure and new type definitions.
 
 import argparse
+import functools  # merging of loaded parts
+import heapq  # k-way merge of sorted expanded instances
 import json
+import multiprocessing  # parallel loading of distributed dumps
 import os  # filesystem
 import sys  # stdin, stderr
-
+import tempfile  # spilled runs of expanded instances
+import traceback  # for printing exceptions
+from array import array  # rows of expanded instances
+from itertools import chain, repeat  # paths of all classes, arguments of workers, rows
+
+import classGraph  # interned graph of class relations
+import compressedFiles  # compressed input and output files
+import externalSort  # size of sorted runs
+import instanceStore  # compact instance - class relations
 import parseJson2  # for WikidataClassManipulator
 
+# number of rows read from spilled run of expanded instances at once
+RUN_READ_SIZE = 64 * 1024
+# number of spilled runs of expanded instances merged at once (bounds number of open files)
+MAX_MERGED_RUNS = 64
+
 # get script name
 SCRIPT_NAME = os.path.basename(sys.argv[0])
 
@@ -46,14 +62,44 @@ def get_args():
     argparser.add_argument(
         "-a", "--subclasses", help="File where list of subclasses will be saved."
     )
+    argparser.add_argument(
+        "--top-classes",
+        help="File with ids of top level classes (one per line, e.g. types_suggestions/top_level_classes)."
+        " List of subclasses ('-a') is generated only for these classes.",
+    )
+    argparser.add_argument(
+        "--instance-counts",
+        help="Add number of instances of each subclass to list of subclasses ('-a')."
+        " Instance relations must be loaded (see '-i' and '-f').",
+        default=False,
+        action="store_true",
+    )
     argparser.add_argument(
         "-c", "--class-relations-dump", help="Class relations dump file."
     )
+    argparser.add_argument(
+        "-b",
+        "--binary-dump",
+        help="Class relations dump in binary format with transitive closure (see classGraph.py)."
+        " It is loaded instead of '-c' dump and it is memory mapped, so it is shared by all processes.",
+    )
+    argparser.add_argument(
+        "--shared-graph",
+        help="Node-local directory (e.g. in /dev/shm) where class relations dump ('-b' or '-c') is published"
+        " as binary dump by the first process and memory mapped by all processes on the node.",
+    )
     argparser.add_argument(
         "-d",
         "--dump-directory",
         help="Directory with distributed class relations dump.",
     )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes loading and merging parts of distributed dumps (default=1).",
+        type=int,
+        default=1,
+    )
     argparser.add_argument(
         "-i",
         "--instance-relations-dump",
@@ -83,6 +129,21 @@ def get_args():
         default=False,
         action="store_true",
     )
+    argparser.add_argument(
+        "--max-paths",
+        help="Maximal number of full paths to each class (default: unlimited)."
+        " Only first paths in sorted order are kept. The limit is applied to every class on the"
+        " paths, so paths of class are built from kept paths of its parents only.",
+        type=int,
+        default=None,
+    )
+    argparser.add_argument(
+        "--max-path-depth",
+        help="Maximal number of classes in full path (default: unlimited)."
+        " Longer paths start at their ancestor in maximal depth.",
+        type=int,
+        default=None,
+    )
     argparser.add_argument(
         "-l",
         "--replace-types",
@@ -101,34 +162,258 @@ def get_args():
         type=int,
         default=1,
     )
+    argparser.add_argument(
+        "-m",
+        "--merge-expanded-instances",
+        help="Files with sorted expanded instances (see '-e') which are merged to '-e' file"
+        " instead of expanding instances.",
+        nargs="+",
+    )
+    argparser.add_argument(
+        "--run-size",
+        help="Number of expanded instance rows sorted in memory at once (default=%(default)s).",
+        type=int,
+        default=externalSort.DEFAULT_RUN_SIZE,
+    )
+    argparser.add_argument(
+        "--temp-dir",
+        help="Directory for temporary files (default: directory of expanded instances file).",
+    )
+    argparser.add_argument(
+        "--compression",
+        help="Compression of output files (default: OUTPUT_COMPRESSION from env_variables.cfg)."
+        " Compressed input files are detected automatically.",
+        choices=sorted(compressedFiles.COMPRESSION_SUFFIXES),
+        default=None,
+    )
     return argparser.parse_args()
 
 
+def load_class_relations_part(path):
+    """
+    Loads part of distributed class relations dump (used by worker processes).
+    :param path: path to json dump
+    :raise IOError if fails to read from file
+    :return: ClassGraph instance
+    """
+    with compressedFiles.open_file(path, "r") as file:
+        return classGraph.ClassGraph.from_dict(json.load(file))
+
+
+def merge_class_relations_parts(first, second):
+    """
+    Merges two consecutive parts of distributed class relations dump (used by worker processes).
+    :param first: ClassGraph of the first part
+    :param second: ClassGraph of the second part
+    :return: merged ClassGraph
+    """
+    first.merge_graph(second)
+    return first
+
+
+def load_instances_part(path):
+    """
+    Loads part of distributed instance relations dump (used by worker processes).
+    :param path: path to instance dump
+    :raise IOError if fails to read from file
+    :raise ValueError if file is not instance dump
+    :return: InstanceStore instance with sorted unique instances
+    """
+    store = instanceStore.InstanceStore()
+    with compressedFiles.open_file(path, "rb") as file:
+        store.load(file)
+    store.deduplicate()
+    return store
+
+
+def merge_instances_parts(first, second):
+    """
+    Merges two parts of distributed instance relations dump (used by worker processes).
+    :param first: InstanceStore of the first part
+    :param second: InstanceStore of the second part
+    :return: merged InstanceStore
+    """
+    first.merge(second)
+    return first
+
+
+def load_parts(paths, load, merge):
+    """
+    Loads consecutive parts and merges them in order (used by worker processes).
+    :param paths: paths to parts
+    :param load: function loading part from path
+    :param merge: function merging two loaded parts
+    :return: merged part
+    """
+    return functools.reduce(merge, map(load, paths))
+
+
+def reduce_parts(paths, load, merge, jobs):
+    """
+    Loads consecutive chunks of parts in process pool and merges loaded chunks pairwise
+    in reduction tree, so parts are merged in the same order as they are given.
+    :param paths: paths to parts
+    :param load: function loading part from path
+    :param merge: function merging two loaded parts
+    :param jobs: number of processes
+    :return: merged part
+    """
+    jobs = min(jobs, len(paths))
+    chunks = [paths[i * len(paths) // jobs : (i + 1) * len(paths) // jobs] for i in range(jobs)]
+    with multiprocessing.Pool(jobs) as pool:
+        parts = pool.starmap(load_parts, zip(chunks, repeat(load), repeat(merge)), chunksize=1)
+        while len(parts) > 1:
+            merged = pool.starmap(merge, zip(parts[0::2], parts[1::2]), chunksize=1)
+            if len(parts) % 2:
+                merged.append(parts[-1])
+            parts = merged
+    return parts[0]
+
+
+def sort_expanded_rows(numbers, ranks):
+    """
+    Sorts rows of expanded instances by instance and class (sorts are stable).
+    :param numbers: array of numeric ids of instances (see parseJson2.encode_entity_id())
+    :param ranks: array of ranks of classes in sorted order of their ids
+    :return: tuple (sorted numbers, sorted ranks)
+    """
+    order = sorted(range(len(ranks)), key=ranks.__getitem__)
+    order.sort(key=numbers.__getitem__)
+    return array("Q", map(numbers.__getitem__, order)), array("I", map(ranks.__getitem__, order))
+
+
+def write_expanded_run(numbers, ranks, temp_dir=None):
+    """
+    Spills sorted rows of expanded instances to temporary files.
+    :param numbers: array of numeric ids of instances
+    :param ranks: array of ranks of classes
+    :param temp_dir: directory for temporary files (None = system default)
+    :raise IOError if fails to write to file
+    :return: tuple (file with numbers, file with ranks)
+    """
+    files = (tempfile.TemporaryFile(dir=temp_dir), tempfile.TemporaryFile(dir=temp_dir))
+    for data, file in zip((numbers, ranks), files):
+        data.tofile(file)
+        file.seek(0)
+    return files
+
+
+def read_expanded_run(files):
+    """
+    Reads rows of expanded instances spilled by write_expanded_run().
+    :param files: tuple (file with numbers, file with ranks)
+    :raise IOError if fails to read from file
+    :return: generator of rows (numeric id of instance, rank of class)
+    """
+    while True:
+        batch = (array("Q"), array("I"))
+        for data, file in zip(batch, files):
+            try:
+                data.fromfile(file, RUN_READ_SIZE)
+            except EOFError:  # the last batch
+                pass
+        if not batch[0]:
+            return
+        yield from zip(*batch)
+
+
+def add_expanded_run(runs, run, temp_dir=None):
+    """
+    Adds spilled run of expanded instances, when there are too many runs of the same level,
+    they are merged to single run of the next level (each row is merged once per level).
+    :param runs: list of spilled runs (level, files), runs are closed when they are merged
+    :param run: files of spilled run (see write_expanded_run())
+    :param temp_dir: directory for temporary files (None = system default)
+    :raise IOError if fails to read or write temporary files
+    """
+    runs.append((0, run))
+    while len(runs) >= MAX_MERGED_RUNS and all(
+        level == runs[-1][0] for level, _ in runs[-MAX_MERGED_RUNS:]
+    ):
+        level = runs[-1][0]
+        merged = [files for _, files in runs[-MAX_MERGED_RUNS:]]
+        del runs[-MAX_MERGED_RUNS:]
+        files = (tempfile.TemporaryFile(dir=temp_dir), tempfile.TemporaryFile(dir=temp_dir))
+        runs.append((level + 1, files))
+        numbers, ranks = array("Q"), array("I")
+        for number, rank in heapq.merge(*map(read_expanded_run, merged)):
+            numbers.append(number)
+            ranks.append(rank)
+            if len(numbers) >= RUN_READ_SIZE:
+                numbers.tofile(files[0])
+                ranks.tofile(files[1])
+                numbers, ranks = array("Q"), array("I")
+        for data, file in zip((numbers, ranks), files):
+            data.tofile(file)
+            file.seek(0)
+        for run_files in merged:
+            for file in run_files:
+                file.close()
+
+
+def get_expanded_row_key(line):
+    """
+    :param line: row of expanded instances (instance id, class id or path)
+    :raise ValueError if instance id is not wikidata entity id
+    :return: sort key of row (numeric id of instance, class id or path)
+    """
+    instance_id, class_id = line.rstrip("\n").split("\t", 1)
+    return parseJson2.encode_entity_id(instance_id), class_id
+
+
+def merge_expanded_instances(paths, output_file):
+    """
+    Merges files with sorted expanded instances by k-way merge (see ClassRelationsBuilder.expand_instances()).
+    :param paths: paths to files with sorted expanded instances
+    :param output_file: file where merged expanded instances will be written
+    :raise IOError if fails to read or write file
+    :raise ValueError if any instance id is not wikidata entity id
+    """
+    output_file = parseJson2.TsvWriter.wrap(output_file)
+    files = [compressedFiles.open_file(path, "r") for path in paths]
+    try:
+        for line in heapq.merge(*files, key=get_expanded_row_key):
+            output_file.write(line)
+    finally:
+        for file in files:
+            file.close()
+    output_file.flush()
+
+
 class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
     """
     Builds class relation graph and replaces type of entities by class paths.
     """
 
-    def __init__(self, classes=None, instances=None):
+    def __init__(self, classes=None, instances=None, max_paths=None, max_path_depth=None):
         """
         Initializes class dictionary
         :param classes: dictionary with existing class relations
         :param instances: dictionary with existing instance - class relations
+        :param max_paths: maximal number of full paths to each class, applied to every class on the paths
+                          (None = unlimited)
+        :param max_path_depth: maximal number of classes in full path (None = unlimited)
         """
-        self.classes = classes if classes else {}  # dictionary with class relations
+        # graph of class relations
+        self.graph = (
+            classGraph.ClassGraph.from_dict(classes) if classes else classGraph.ClassGraph()
+        )
+        # instance - class relations
         self.instances = (
-            instances if instances else {}
-        )  # dictionary with instance - class relations
+            instanceStore.InstanceStore.from_dict(instances)
+            if instances
+            else instanceStore.InstanceStore()
+        )
+        # limits of full paths
+        self.max_paths = max_paths
+        self.max_path_depth = max_path_depth
 
     def add_class(self, class_id):
         """
         Adds new class to dictionary.
         :class_id: id of the class
         """
-        if class_id not in self.classes:
-            self.classes[class_id] = {}
-            self.classes[class_id]["successors"] = []
-            self.classes[class_id]["ancestors"] = []
+        self.graph.add_class(class_id)
 
     def add_ancestor(self, class_id, ancestor_id):
         """
@@ -136,11 +421,8 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         :class_id: id of class where ancestor will be added to
         :ancestor_id: ancestor class id
         """
-        if class_id not in self.classes:  # create new class item in dictionary
-            self.add_class(class_id)
-        # add ancestor class to list of ancestors
-        if ancestor_id not in self.classes[class_id]["ancestors"]:
-            self.classes[class_id]["ancestors"].append(ancestor_id)
+        # class is created if it doesn't exist, duplicate relations are removed by graph
+        self.graph.add_ancestor(class_id, ancestor_id)
 
     def add_successor(self, class_id, successor_id):
         """
@@ -148,35 +430,31 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         :class_id: id of class where successor will be added to
         :successor_id: successor class id
         """
-        if class_id not in self.classes:  # create new class item in dictionary
-            self.add_class(class_id)
-        # add successor class to list of successors
-        if successor_id not in self.classes[class_id]["successors"]:
-            self.classes[class_id]["successors"].append(successor_id)
+        # class is created if it doesn't exist, duplicate relations are removed by graph
+        self.graph.add_successor(class_id, successor_id)
 
     def clear_successors(self, class_id):
         """
         Removes all successors of the class.
         :class_id: id of class where successors will be removed
         """
-        if class_id in self.classes:
-            self.classes[class_id]["successors"] = []
+        if class_id in self.graph:
+            self.graph.successors.clear(self.graph.find_class(class_id))
 
     def clear_ancestors(self, class_id):
         """
         Removes all ancestors of the class.
         :class_id: id of class where ancestors will be removed
         """
-        if class_id in self.classes:
-            self.classes[class_id]["ancestors"] = []
+        if class_id in self.graph:
+            self.graph.ancestors.clear(self.graph.find_class(class_id))
 
     def remove_class(self, class_id):
         """
         Removes class from dictionary.
         :class_id: id of class to remove
         """
-        if class_id in self.classes:
-            self.classes.pop(class_id)
+        self.graph.remove_class(class_id)
 
     def add_instance(self, instance_id, class_ids):
         """
@@ -186,18 +464,15 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         """
         ids = class_ids.split("|")
         for class_id in ids:
-            if class_id not in self.instances:
-                self.instances[class_id] = []
-            if instance_id not in self.instances[class_id]:
-                self.instances[class_id].append(instance_id)
+            # duplicates are removed before instances are saved or read
+            self.instances.add(instance_id, class_id)
 
     def remove_instance_class(self, class_id):
         """
         Removes class and all its instances.
         :param class_id: id of class to remove
         """
-        if class_id in self.instances:
-            self.instances.pop(class_id)
+        self.instances.remove_class(class_id)
 
     def remove_instance(self, instance_id, class_id):
         """
@@ -205,33 +480,47 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         :param instance_id: id of instance to remove
         :param class_id: id of class instance is related to
         """
-        if class_id in self.instances and instance_id in self.instances[class_id]:
-            self.instances[class_id].remove(instance_id)
+        self.instances.remove(instance_id, class_id)
 
     def save_instances(self, dump_file):
         """
-        Writes instance relations to json file.
-        :param dump_file: file where instances will be written to
+        Writes instance relations to binary file (see instanceStore.py).
+        :param dump_file: file opened in binary mode where instances will be written to
+        :raise IOError if fails to write to file
+        """
+        self.instances.save(dump_file)
+
+    def save_instance_shards(self, dump_files):
+        """
+        Writes instance relations sharded by instance ids to binary files (see instanceStore.py).
+        :param dump_files: files opened in binary mode, one per shard
         :raise IOError if fails to write to file
         """
-        json.dump(self.instances, dump_file, indent=4, sort_keys=True)
+        if len(dump_files) == 1:
+            self.instances.save(dump_files[0])
+            return
+        for store, dump_file in zip(self.instances.split(len(dump_files)), dump_files):
+            store.save(dump_file)
 
     def load_instances(self, dump_file):
         """
         Loads instances from dump file.
-        :param dump_file: file with instance dump
+        :param dump_file: file with instance dump (binary or json) opened in binary mode
         :raise IOError if fails to read from file
+        :raise ValueError if file is not instance dump
         """
-        self.instances = json.loads(dump_file.read())
+        self.instances = instanceStore.InstanceStore()
+        self.instances.load(dump_file)
 
     def merge_instances(self, instances):
         """
         Merges instance relations given in argument to currently used instance relations
-        :param instances: instances to merge
+        :param instances: instances to merge (InstanceStore or dictionary)
         """
-        for class_id in instances:
-            for instance_id in instances[class_id]:
-                self.add_instance(instance_id, class_id)
+        if isinstance(instances, instanceStore.InstanceStore):
+            self.instances.merge(instances)
+        else:
+            self.instances.merge_dict(instances)
 
     def save_dump(self, dump_file):
         """
@@ -239,7 +528,25 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         :param dump_file: file where dump will be written to
         :raise IOError if fails to write to file
         """
-        json.dump(self.classes, dump_file, indent=4, sort_keys=True)
+        # the same format as json.dump(classes, dump_file, indent=4, sort_keys=True)
+        self.graph.write_json(dump_file)
+
+    def save_binary_dump(self, dump_file):
+        """
+        Writes class relations with transitive closure of ancestors to binary dump (see classGraph.py).
+        :param dump_file: file opened in binary mode where dump will be written to
+        :raise IOError if fails to write to file
+        """
+        self.graph.write_binary(dump_file, closure=True)
+
+    def load_binary_dump(self, dump_file):
+        """
+        Maps class relations from binary dump (see classGraph.py).
+        :param dump_file: file opened in binary mode
+        :raise ValueError if file is not binary dump
+        :raise IOError if dump is truncated
+        """
+        self.graph = classGraph.ClassGraph.from_binary(dump_file)
 
     def load_dump(self, dump_file):
         """
@@ -247,74 +554,71 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         :param dump_file: dump_file descriptor
         :raise IOError if fails to read from file
         """
-        self.classes = json.loads(dump_file.read())
+        self.graph = classGraph.ClassGraph.from_dict(json.loads(dump_file.read()))
 
     def merge_class_relations(self, classes):
         """
         Merges class relations given in argument to currently used class relations
         :param classes: class relations to merge
         """
-        for key in classes.keys():
-            if key in self.classes:
-                for class_id in classes[key]["ancestors"]:
-                    self.add_ancestor(key, class_id)
-                for class_id in classes[key]["successors"]:
-                    self.add_successor(key, class_id)
-            else:
-                self.classes[key] = classes[key]
+        self.graph.merge_dict(classes)
 
-    def load_distributed_dump(self, dump_folder, instances=False):
+    def load_distributed_dump(self, dump_folder, instances=False, jobs=1):
         """
         Loads class relations from files in given folder
         :param dump_folder: path to folder where dump files are stored
         :param instances: tels if loaded data should be stored as instance relations or class relations
+        :param jobs: number of processes loading and merging files (see reduce_parts())
         :raise IOError if fails to read from file
         :raise OSError if directory can't be read
+        :raise ValueError if file is not instance dump
         """
-        folder = os.scandir(dump_folder)
-        for file in folder:
-            if file.is_file():
-                tmp_file = open(file.path, "r")
-                dump_part = json.load(tmp_file)
-                tmp_file.close()
-                if instances:
-                    self.merge_instances(dump_part)
-                else:
-                    self.merge_class_relations(dump_part)
+        paths = [file.path for file in os.scandir(dump_folder) if file.is_file()]
+        if jobs > 1 and len(paths) > 1:
+            if instances:
+                self.merge_instances(
+                    reduce_parts(paths, load_instances_part, merge_instances_parts, jobs)
+                )
+            else:
+                self.graph.merge_graph(
+                    reduce_parts(
+                        paths, load_class_relations_part, merge_class_relations_parts, jobs
+                    )
+                )
+            return
+
+        for path in paths:
+            if instances:
+                tmp_file = compressedFiles.open_file(path, "rb")
+                self.instances.load(tmp_file)
+            else:
+                tmp_file = compressedFiles.open_file(path, "r")
+                self.merge_class_relations(json.load(tmp_file))
+            tmp_file.close()
 
-    def get_path_to_class(self, current_class, closed_nodes):
+    def get_path_to_class(self, current_class):
         """
-        Returns path from root class to current class (recursively)
-        :param current_class: class for which path is returned
-        :param closed_nodes: classes that are successors of current class, used for cyclic dependency check
-        :return: list of all paths to current class from root entity
+        Returns paths from root classes to current class.
+        :param current_class: class for which paths are returned
+        :return: tuple of all paths to current class from root entity
         """
+        graph = self.graph
+        if current_class not in graph.nodes:  # class data are not parsed
+            return (current_class,)
+        paths = graph.get_paths(self.max_paths, self.max_path_depth)
+        return paths.get(graph.nodes[current_class])
 
-        # class data are not parsed / class is root class or have no ancestors
-        if (
-            current_class not in self.classes
-            or len(self.classes[current_class]["ancestors"]) <= 0
-        ):
-            return [current_class]
-        # class is its successor with cyclic dependency to itself
-        if current_class in closed_nodes:
-            return [current_class]
-
-        closed_nodes.append(current_class)  # append current class to closed
-
-        all_paths = []  # all paths to this class
-        for ancestor in self.classes[current_class]["ancestors"]:
-            paths_to_ancestor = self.get_path_to_class(
-                ancestor, closed_nodes
-            )  # get all paths to ancestor
-            for (
-                path
-            ) in paths_to_ancestor:  # append path to paths and add current class to end
-                all_paths.append(path + "->" + current_class)
-
-        closed_nodes.pop()  # pop current class from the list before return
-
-        return all_paths
+    def count_full_paths(self, classes):
+        """
+        Counts paths from root classes to classes without generating them (limit of paths is not applied).
+        :param classes: list of classes
+        :return: number of paths (including duplicate paths of classes in cycles)
+        """
+        graph = self.graph
+        paths = graph.get_paths(self.max_paths, self.max_path_depth)
+        return sum(
+            paths.count(graph.nodes[c]) if c in graph.nodes else 1 for c in classes
+        )
 
     def get_full_paths(self, classes):
         """
@@ -322,27 +626,8 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         :param classes: list of classes for which tc with full paths will be generated
         :return: list of all paths from root class to direct types of entity sorted by classes in path
         """
-
-        # list of paths
-        paths = []
-
-        # get all paths to each type
-        for c in classes:
-            paths.extend(self.get_path_to_class(c, []))
-
-        # sort by path
-        paths.sort()
-
-        # remove duplicates
-        if len(paths) > 1:
-            i = 1
-            while i < len(paths):
-                if paths[i] == paths[i - 1]:
-                    paths.pop(i)
-                else:
-                    i += 1
-
-        return paths
+        # sort by path and remove duplicates
+        return sorted(set(chain.from_iterable(map(self.get_path_to_class, classes))))
 
     def get_all_tcs(self, classes):
         """
@@ -350,18 +635,15 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         :param classes: list of classes for which tc will be generated
         :return list of all transitive closures of given classes
         """
-        all_tcs = []
+        all_tcs = {}  # ordered set of classes
         for class_id in classes:
             try:
                 tc = self.get_all_ancestors(class_id)
             except KeyError:  # class id is not listed in known class relations
                 tc = []
-            if class_id not in all_tcs:
-                all_tcs.append(class_id)
-            for cid in tc:
-                if cid not in all_tcs:
-                    all_tcs.append(cid)
-        return all_tcs
+            all_tcs.setdefault(class_id)
+            all_tcs.update(dict.fromkeys(tc))
+        return list(all_tcs)
 
     def replace_types_of_entities(
         self, entities, output_file=None, fi=1, full_path=False
@@ -379,6 +661,8 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
             raise RuntimeError(
                 "If entities are read from file instead of list, output file must be set!"
             )
+        if output_file:
+            output_file = parseJson2.TsvWriter.wrap(output_file)
         for entity in entities:
             if (
                 type(entity) == str
@@ -395,58 +679,43 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
                 entity[fi] = types
             if output_file:
                 self.write_entity_to_tsv(entity, output_file)
+        if output_file:
+            output_file.flush()
 
     def complete_relations(self):
         """
-        Loops through all classes and adds missing successor and ancestor relations.
+        Adds missing successor and ancestor relations of all classes.
+        :return: number of added relations
         """
-        # create copy of the key list to prevent
-        # RuntimeError: dictionary changed size during iteration
-        for class_id in list(self.classes.keys()):
-            # add this class as successor of all its ancestors
-            for ancestor in self.classes[class_id]["ancestors"]:
-                self.add_successor(ancestor, class_id)
-            # add this class as ancestor of all its successors
-            for successor in self.classes[class_id]["successors"]:
-                self.add_ancestor(successor, class_id)
+        return self.graph.complete_relations()
 
     def get_all_successors(self, class_id):
         """
         Generates list of all successors of the class.
         :param class_id: id of class for which successor list will be generated
-        :raise KeyError if class_id isn't listed in relations in self.classes
+        :raise KeyError if class_id isn't listed in relations in self.graph
         """
-        successors = [class_id]  # add starting class id
-
-        i = 0
-        while i < len(successors):
-            for subclass in self.classes[successors[i]]["successors"]:
-                if subclass not in successors:  # detect cyclic dependency
-                    successors.append(subclass)
-            i += 1
-
-        successors.pop(0)  # remove class id from successor list
-
-        return successors
+        return self.get_all_related(class_id, "successors")
 
     def get_all_ancestors(self, class_id):
         """
         Generates list of all ancestors of the class.
         :param class_id: id of class for which ancestor list will be generated
-        :raise KeyError if class_id isn't listed in relations in self.classes
+        :raise KeyError if class_id isn't listed in relations in self.graph
         """
-        ancestors = [class_id]  # add starting class id
-
-        i = 0
-        while i < len(ancestors):
-            for superclass in self.classes[ancestors[i]]["ancestors"]:
-                if superclass not in ancestors:
-                    ancestors.append(superclass)
-            i += 1
+        return self.get_all_related(class_id, "ancestors")
 
-        ancestors.pop(0)  # remove class id from ancestor list
-
-        return ancestors
+    def get_all_related(self, class_id, relations):
+        """
+        Generates list of all classes reachable from the class in breadth-first order.
+        Closures are computed once for the whole graph and reused (see classGraph.Closure).
+        :param class_id: id of the starting class
+        :param relations: relations to follow ("ancestors" or "successors")
+        :raise KeyError if any of reached classes isn't listed in relations
+        """
+        graph = self.graph
+        node = graph.find_class(class_id)
+        return [graph.ids[n] for n in graph.get_closure(relations).get(node)]
 
     def get_superclass_tc(self, output_file):
         """
@@ -455,50 +724,129 @@ class ClassRelationsBuilder(parseJson2.WikidataDumpManipulator):
         subclass\tsuperclass\n
         :param output_file: output file
         """
-        for class_id in self.classes:
+        output_file = parseJson2.TsvWriter.wrap(output_file)
+        for node in self.graph.classes():
+            class_id = self.graph.ids[node]
             tc = self.get_all_ancestors(class_id)
             for record in tc:
                 self.write_entity_to_tsv([class_id, record], output_file)
+        output_file.flush()
 
-    def get_subclass_list(self, output_file):
+    def get_subclass_list(self, output_file, top_classes=None, instance_counts=False):
         """
-        Generates list of all subclasses for each class.
+        Generates list of all subclasses for each class or for each of given top level classes.
         Fields are separated by tab, each line contains only one relation in format:
         superclass\tsubclass\n
+        or with number of instances of subclass:
+        superclass\tsubclass\tinstances\n
         :param output_file: output file
+        :param top_classes: ids of top level classes (None = all classes), their subclasses are found
+                            by single pass over the graph (see classGraph.ClassGraph.get_reachable())
+        :param instance_counts: tells if number of instances of subclass should be added
+        :raise KeyError if any of top level classes isn't listed in relations in self.graph
         """
-        for class_id in self.classes:
-            lst = self.get_all_successors(class_id)
-            for record in lst:
-                self.write_entity_to_tsv([class_id, record], output_file)
+        output_file = parseJson2.TsvWriter.wrap(output_file)
+        graph = self.graph
+        if top_classes is None:
+            subclass_lists = (
+                (graph.ids[node], self.get_all_successors(graph.ids[node]))
+                for node in graph.classes()
+            )
+        else:
+            top_classes = list(dict.fromkeys(top_classes))
+            roots = [graph.find_class(class_id) for class_id in top_classes]
+            subclass_lists = zip(
+                top_classes,
+                (map(graph.ids.__getitem__, nodes) for nodes in graph.get_reachable(roots)),
+            )
+        for class_id, subclasses in subclass_lists:
+            for subclass_id in subclasses:
+                if instance_counts:
+                    record = [
+                        class_id, subclass_id, str(self.instances.count_instances(subclass_id))
+                    ]
+                else:
+                    record = [class_id, subclass_id]
+                self.write_entity_to_tsv(record, output_file)
+        output_file.flush()
 
     def save_tsv(self, output_file):
         """
         Outputs class relations in format subclass-superclass to tsv file.
         :param output_file: tsv file where relations will be saved to
         """
-        for class_id in self.classes:
-            for ancestor in self.classes[class_id]["ancestors"]:
+        output_file = parseJson2.TsvWriter.wrap(output_file)
+        for node in self.graph.classes():
+            class_id = self.graph.ids[node]
+            for ancestor in self.graph.get_ancestors(class_id):
                 self.write_entity_to_tsv([class_id, ancestor], output_file)
+        output_file.flush()
 
-    def expand_instances(self, output_file, full_path=False):
+    def expand_instances(
+        self, output_file, full_path=False, run_size=externalSort.DEFAULT_RUN_SIZE, temp_dir=None
+    ):
         """
         Expands instances type to transitive closure of its class.
+        Rows are written sorted by numeric ids of instances (see parseJson2.encode_entity_id()) and by classes.
+        Rows are kept as arrays of instance numbers and ranks of classes and sorted in memory bounded runs,
+        runs which do not fit into memory are spilled to temporary files and merged by k-way merge.
         :param output_file: tsv file where expanded instances will be written
         :param full_path: tells if classes only or full paths to each class should be used
+        :param run_size: number of rows sorted in memory at once
+        :param temp_dir: directory for temporary files (None = system default)
+        :raise IOError if fails to write to file or temporary files
         """
-        for class_id in self.instances:
+        output_file = parseJson2.TsvWriter.wrap(output_file)
+
+        def get_classes(class_id):
             try:
                 if full_path:
                     tc = self.get_full_paths([class_id])
                 else:
                     tc = self.get_all_ancestors(class_id)
             except KeyError:
-                tc = []  # class_id is not in relations (self.classes)!
-            for instance_id in self.instances[class_id]:
-                for cid in tc:
-                    self.write_entity_to_tsv([instance_id, cid], output_file)
-                self.write_entity_to_tsv([instance_id, class_id], output_file)
+                tc = []  # class_id is not in relations (self.graph)!
+            return list(chain(tc, (class_id,)))
+
+        # classes (or paths) of rows are sorted by their ranks
+        names = sorted(set(chain.from_iterable(map(get_classes, self.instances.classes))))
+        rank = dict(zip(names, range(len(names))))
+        numbers, ranks = array("Q"), array("I")
+        runs = []
+        try:
+            for class_id, instances in self.instances.items():
+                class_ranks = array("I", map(rank.__getitem__, get_classes(class_id)))
+                step = max(1, run_size // len(class_ranks))  # instances of class fitting into run
+                for start in range(0, len(instances), step):
+                    part = instances[start : start + step]
+                    numbers.extend(
+                        chain.from_iterable(map(repeat, part, repeat(len(class_ranks))))
+                    )
+                    ranks.extend(class_ranks * len(part))
+                    if len(numbers) >= run_size:
+                        numbers, ranks = sort_expanded_rows(numbers, ranks)
+                        run = write_expanded_run(numbers, ranks, temp_dir)
+                        add_expanded_run(runs, run, temp_dir)
+                        numbers, ranks = array("Q"), array("I")
+            numbers, ranks = sort_expanded_rows(numbers, ranks)
+            if runs:
+                runs.append((0, write_expanded_run(numbers, ranks, temp_dir)))
+                numbers, ranks = array("Q"), array("I")
+                rows = heapq.merge(*(read_expanded_run(files) for _, files in runs))
+            else:  # everything fits into memory
+                rows = zip(numbers, ranks)
+
+            previous_number = instance_id = None
+            for number, class_rank in rows:
+                if number != previous_number:
+                    instance_id = parseJson2.decode_entity_id(number)
+                    previous_number = number
+                self.write_entity_to_tsv([instance_id, names[class_rank]], output_file)
+        finally:
+            for _, files in runs:
+                for file in files:
+                    file.close()
+        output_file.flush()
 
 
 def main():
@@ -512,36 +860,79 @@ def main():
         )
         return 1
 
+    if args.merge_expanded_instances and not args.expanded_instances:
+        sys.stderr.write("'--merge-expanded-instances' option is set, but output file is not set!\n")
+        sys.stderr.write("Use '--help' to see '-e' option!\n")
+        return 1
+
+    if args.shared_graph and not args.binary_dump and not args.class_relations_dump:
+        sys.stderr.write("'--shared-graph' option is set, but class relations dump is not set!\n")
+        sys.stderr.write("Use '--help' to see '-c' and '-b' options!\n")
+        return 1
+
     if (
         args.save_dump
         and not args.instance_relations_dump
         and not args.class_relations_dump
+        and not args.binary_dump
     ):
         sys.stderr.write("'-s' option is set, but nothing to save!\n")
-        sys.stderr.write("Use '--help' to see '-c' and '-i' options!")
+        sys.stderr.write("Use '--help' to see '-c', '-b' and '-i' options!")
         return 1
 
     # init
     error_code = 0  # error code to return
-    crb = ClassRelationsBuilder()
+    crb = ClassRelationsBuilder(
+        max_paths=args.max_paths, max_path_depth=args.max_path_depth
+    )
 
     # load distributed dump
     if args.dump_directory:
         if args.verbose:
             print("Loading class dump from directory.")
         try:
-            crb.load_distributed_dump(args.dump_directory)
+            crb.load_distributed_dump(args.dump_directory, jobs=args.jobs)
         except IOError or OSError:
             sys.stderr.write("Cannot load class relations from given directory!\n")
             return 1
 
+    # load binary dump from file
+    binary_dump = args.binary_dump
+    if args.shared_graph and not args.dump_directory:
+        if args.verbose:
+            print("Publishing class dump to shared directory.")
+        try:
+            binary_dump = classGraph.get_shared_dump(
+                args.binary_dump or args.class_relations_dump, args.shared_graph
+            )
+        except (IOError, ValueError):
+            sys.stderr.write(
+                SCRIPT_NAME
+                + ": Failed to publish class relations dump! Handled error:\n"
+                + str(traceback.format_exc())
+                + "\n"
+            )
+            return 1
+    if binary_dump:
+        if not args.dump_directory:
+            if args.verbose:
+                print("Loading binary class dump from file.")
+            try:
+                with open(binary_dump, "rb") as file:
+                    crb.load_binary_dump(file)
+            except (IOError, ValueError):
+                sys.stderr.write(
+                    f"Failed to read binary class relations dump file ({binary_dump})!\n"
+                )
+                return 1
+
     # load dump from file
     if args.class_relations_dump:
-        if not args.dump_directory:
+        if not args.dump_directory and not binary_dump:
             if args.verbose:
                 print("Loading class dump from file.")
             try:
-                file = open(args.class_relations_dump, "r")
+                file = compressedFiles.open_file(args.class_relations_dump, "r")
                 crb.load_dump(file)
                 file.close()
             except IOError:
@@ -556,7 +947,9 @@ def main():
         if args.verbose:
             print("Loading instances from directory.")
         try:
-            crb.load_distributed_dump(args.instances_directory, instances=True)
+            crb.load_distributed_dump(
+                args.instances_directory, instances=True, jobs=args.jobs
+            )
         except IOError or OSError:
             sys.stderr.write("Can't load instances from given directory!\n")
             return 1
@@ -567,7 +960,7 @@ def main():
             if args.verbose:
                 print("Loading instances from file.")
             try:
-                file = open(args.instance_relations_dump, "r")
+                file = compressedFiles.open_file(args.instance_relations_dump, "rb")
                 crb.load_instances(file)
                 file.close()
             except IOError:
@@ -578,17 +971,52 @@ def main():
     if args.complete_relations:
         if args.verbose:
             print("Completing class relations.")
-        # TODO check speed and optimize or use closure.py for superclass tc
-        #      maybe simplify data model (too many memory jumps!)
-        crb.complete_relations()
+        class_count = len(crb.graph)
+        relation_count = crb.complete_relations()
+        if args.verbose:
+            print(
+                f"Added {relation_count} relations and {len(crb.graph) - class_count} classes "
+                f"referenced by {class_count} classes."
+            )
+
+    # merge sorted expanded instances
+    if args.merge_expanded_instances:
+        if args.verbose:
+            print("Merging expanded instances and storing them to file.")
+        try:
+            output = parseJson2.TsvWriter.open(
+                args.expanded_instances, "w", compression=args.compression
+            )
+            merge_expanded_instances(args.merge_expanded_instances, output)
+            output.close()
+        except (IOError, ValueError):
+            sys.stderr.write(
+                SCRIPT_NAME
+                + ": Failed to merge expanded instances! Handled error:\n"
+                + str(traceback.format_exc())
+                + "\n"
+            )
+            error_code = 1
 
     # expand instances
-    if args.expanded_instances:
+    elif args.expanded_instances:
         if args.verbose:
             print("Expanding instances and storing them to file.")
+            if args.full_path:
+                print(
+                    "Number of full paths to classes of instances: "
+                    f"{crb.count_full_paths(list(crb.instances.classes))}"
+                )
         try:
-            output = open(args.expanded_instances, "w")
-            crb.expand_instances(output, args.full_path)
+            output = parseJson2.TsvWriter.open(
+                args.expanded_instances, "w", compression=args.compression
+            )
+            crb.expand_instances(
+                output,
+                args.full_path,
+                args.run_size,
+                args.temp_dir or os.path.dirname(os.path.abspath(args.expanded_instances)),
+            )
             output.close()
         except IOError:
             sys.stderr.write("Failed to write expanded instances to output!")
@@ -599,38 +1027,45 @@ def main():
         if args.verbose:
             print("Generating transitive closure and storing in to file.")
         try:
-            output = open(args.superclass_tc, "w")
+            output = parseJson2.TsvWriter.open(
+                args.superclass_tc, "w", compression=args.compression
+            )
             crb.get_superclass_tc(output)
             output.close()
         except IOError:
             sys.stderr.write("Failed to generate tc tsv file!\n")
             error_code = 1
 
-    # generate list of all subclasses
-    # TODO
-    #   This is not optimal - too many repetitive node passages
-    #   Happens when:
-    #   - multiple nodes have common successors
-    #   - node is successor of another processed node
-    #   Better approach - define list of top level nodes and expand only their successors, not all nodes in graph
+    # generate list of subclasses (of all classes or of top level classes only)
     if args.subclasses:
         if args.verbose:
             print("Generating list of subclasses and storing it to file.")
         try:
-            output = open(args.subclasses, "w")
-            crb.get_subclass_list(output)
+            top_classes = None
+            if args.top_classes:
+                with compressedFiles.open_file(args.top_classes, "r") as file:
+                    top_classes = [line.strip() for line in file if line.strip()]
+            output = parseJson2.TsvWriter.open(
+                args.subclasses, "w", compression=args.compression
+            )
+            crb.get_subclass_list(output, top_classes, args.instance_counts)
             output.close()
         except IOError:
             sys.stderr.write("Failed to generate file with list of subclasses!\n")
             error_code = 1
+        except KeyError as e:
+            sys.stderr.write(f"Top level class {e} is not listed in class relations!\n")
+            error_code = 1
 
     # replace types of entities with transitive closure
     if args.replace_types:
         if args.verbose:
             print("Replacing types of entities with tc.")
         try:
-            output = open(args.entities_output_file, "w")
-            input_entities = open(args.replace_types, "r")
+            output = parseJson2.TsvWriter.open(
+                args.entities_output_file, "w", compression=args.compression
+            )
+            input_entities = compressedFiles.open_file(args.replace_types, "r")
             crb.replace_types_of_entities(
                 input_entities, output, args.field_index, args.full_path
             )
@@ -650,7 +1085,9 @@ def main():
         if args.verbose:
             print("Storing classes to tsv file.")
         try:
-            output = open(args.tsv, "w")
+            output = parseJson2.TsvWriter.open(
+                args.tsv, "w", compression=args.compression
+            )
             crb.save_tsv(output)
             output.close()
         except IOError:
@@ -663,18 +1100,32 @@ def main():
             if args.verbose:
                 print("Saving class dump to file.")
             try:
-                file = open(args.class_relations_dump, "w")
+                file = compressedFiles.open_file(
+                    args.class_relations_dump, "w", args.compression
+                )
                 crb.save_dump(file)
                 file.close()
             except IOError:
                 sys.stderr.write("Failed to write class relations to file!\n")
                 error_code = 1
 
+        if args.binary_dump:
+            if args.verbose:
+                print("Saving binary class dump to file.")
+            try:
+                with open(args.binary_dump, "wb") as file:
+                    crb.save_binary_dump(file)
+            except IOError:
+                sys.stderr.write("Failed to write binary class relations dump to file!\n")
+                error_code = 1
+
         if args.instance_relations_dump:
             if args.verbose:
                 print("Saving instances to file.")
             try:
-                file = open(args.instance_relations_dump, "w")
+                file = compressedFiles.open_file(
+                    args.instance_relations_dump, "wb", args.compression
+                )
                 crb.save_instances(file)
                 file.close()
             except IOError:
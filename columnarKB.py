@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: columnarKB.py
+# Project: wikidata2
+# Description: Stores per-type KB tables in columnar format and loads selected columns only.
+#              Parquet is used if pyarrow is available, otherwise each column is stored in its own file
+#              (directory with schema.json, one value per line, list lengths of multi-value columns
+#              stored as binary array). Schema is taken from .fields files (see merge_KB/*/*.fields)
+#              or from merge_KB/HEAD.
+
+import argparse
+import json  # schema of column directory
+import os  # filesystem
+import re  # parsing of schema definitions
+import sys  # stdout, stderr, exit
+import traceback  # for printing exceptions
+from array import array  # lengths of list columns
+
+import compressedFiles  # compressed input files
+
+try:
+    import pyarrow  # arrow tables
+    import pyarrow.parquet  # parquet files
+except ImportError:
+    pyarrow = None  # column per file layout is used instead
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# name of the file with schema in column directory
+SCHEMA_FILE = "schema.json"
+# separator of values in multi-value fields of tsv
+VALUE_SEPARATOR = "|"
+# number of rows written to parquet file at once
+PARQUET_BATCH_SIZE = 65536
+# size of buffer of each column file (all columns are written at once)
+COLUMN_BUFFER_SIZE = 1024 * 1024
+# suffix of multi-value fields in .fields files
+MULTIPLE_VALUES_SUFFIX = " (MULTIPLE VALUES)"
+# generic part of schema in HEAD file
+HEAD_GENERIC_TYPE = "__generic__"
+# type of entities without type specific fields
+GENERAL_TYPE = "general"
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Converts KB in tsv format to columnar format and reads selected columns from it."
+    )
+    argparser.add_argument(
+        "-f",
+        "--input-file",
+        help="KB in tsv format to convert (may be compressed).",
+    )
+    argparser.add_argument(
+        "-s",
+        "--fields",
+        help="File with definition of KB fields (.fields file, one field per line).",
+    )
+    argparser.add_argument(
+        "--head",
+        help="HEAD file with definition of KB fields, used if '--fields' is not set. Requires '--type'.",
+    )
+    argparser.add_argument(
+        "--type",
+        help="Type of entities in KB (e.g. person, person+artist) for schema from HEAD file.",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        help="Where columnar KB will be stored (file for parquet, directory otherwise).",
+    )
+    argparser.add_argument(
+        "--format",
+        help="Columnar format (default: parquet if pyarrow is available, columns otherwise).",
+        choices=["auto", "parquet", "columns"],
+        default="auto",
+    )
+    argparser.add_argument(
+        "-r",
+        "--read",
+        help="Columnar KB to read, selected columns are printed in tsv format.",
+    )
+    argparser.add_argument(
+        "-c",
+        "--columns",
+        help="Names of columns to read (default: ID NAME).",
+        nargs="+",
+        default=["ID", "NAME"],
+    )
+    return argparser.parse_args()
+
+
+def load_fields(fields_file):
+    """
+    Loads schema from .fields file.
+    :param fields_file: path to the file with one field name per line
+    :raise IOError if fails to read from file
+    :return: list of (field name, multiple values flag) tuples
+    """
+    fields = []
+    with open(fields_file, "r", encoding="utf-8") as file:
+        for line in file:
+            name = line.rstrip("\n")
+            if not name:
+                continue
+            if name.endswith(MULTIPLE_VALUES_SUFFIX):
+                fields.append((name[: -len(MULTIPLE_VALUES_SUFFIX)], True))
+            else:
+                fields.append((name, False))
+    return fields
+
+
+def load_head_fields(head_file, entity_type):
+    """
+    Loads schema of given type from HEAD file.
+    Schema consists of generic fields followed by fields of each type in compound type (e.g. person+artist),
+    general entities have generic fields only.
+    :param head_file: path to the HEAD file
+    :param entity_type: type of entities
+    :raise IOError if fails to read from file
+    :raise ValueError if type is not defined in HEAD file
+    :return: list of (field name, multiple values flag) tuples
+    """
+    definitions = {}
+    with open(head_file, "r", encoding="utf-8") as file:
+        for line in file:
+            match = re.match(r"<([^>]+)>(.*)$", line.rstrip("\n"))
+            if match:
+                definitions[match.group(1)] = (
+                    match.group(2).split("\t") if match.group(2) else []
+                )
+
+    fields = []
+    type_names = [HEAD_GENERIC_TYPE]
+    if entity_type != GENERAL_TYPE:
+        type_names += entity_type.split("+")
+    for type_name in type_names:
+        if type_name not in definitions:
+            raise ValueError(f"Type '{type_name}' is not defined in {head_file}!")
+        for field in definitions[type_name]:
+            match = re.match(r"(?:\{([^\[}]*)(?:\[[^]]*\])?\})?(.*)$", field)
+            flags = match.group(1) or ""
+            fields.append((match.group(2), "m" in flags))
+    return fields
+
+
+class ColumnarWriter:
+    """
+    Writes KB rows to columnar file.
+    """
+
+    def __init__(self, path, fields, output_format="auto"):
+        """
+        Opens columnar output.
+        :param path: parquet file or directory where columns will be stored
+        :param fields: schema as list of (field name, multiple values flag) tuples
+        :param output_format: auto/parquet/columns
+        :raise ValueError if parquet is requested but pyarrow is not available
+        :raise IOError if fails to create output
+        """
+        if output_format == "auto":
+            output_format = "parquet" if pyarrow is not None else "columns"
+        if output_format == "parquet" and pyarrow is None:
+            raise ValueError("Parquet output requires pyarrow!")
+        self.path = path
+        self.fields = fields
+        self.format = output_format
+        self.rows = 0
+
+        if self.format == "parquet":
+            self.schema = pyarrow.schema(
+                [
+                    (name, pyarrow.list_(pyarrow.string()) if multiple else pyarrow.string())
+                    for name, multiple in fields
+                ]
+            )
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+            self.batch = [[] for _ in fields]
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.column_files = [
+                open(
+                    os.path.join(path, self.get_column_file(i)),
+                    "w",
+                    encoding="utf-8",
+                    buffering=COLUMN_BUFFER_SIZE,
+                )
+                for i in range(len(fields))
+            ]
+            self.lengths = [array("I") if multiple else None for _, multiple in fields]
+
+    @staticmethod
+    def get_column_file(index):
+        """
+        Returns name of the file with values of column.
+        :param index: index of the column
+        :return: file name
+        """
+        return f"c{index:03d}.txt"
+
+    @staticmethod
+    def get_lengths_file(index):
+        """
+        Returns name of the file with numbers of values in rows of multi-value column.
+        :param index: index of the column
+        :return: file name
+        """
+        return f"c{index:03d}.len"
+
+    def write_row(self, row):
+        """
+        Writes one KB row.
+        :param row: list of tsv fields (multi-value fields are separated by '|'),
+                    missing fields at the end of the row are considered empty
+        :raise ValueError if row has more fields than schema
+        :raise IOError if fails to write to output
+        """
+        if len(row) > len(self.fields):
+            raise ValueError(
+                f"Row {self.rows} has {len(row)} fields, schema has {len(self.fields)}!"
+            )
+        for i, (name, multiple) in enumerate(self.fields):
+            value = row[i] if i < len(row) else ""
+            if multiple:
+                values = value.split(VALUE_SEPARATOR) if value else []
+                if self.format == "parquet":
+                    self.batch[i].append(values)
+                else:
+                    self.lengths[i].append(len(values))
+                    if values:
+                        self.column_files[i].write("\n".join(values) + "\n")
+            elif self.format == "parquet":
+                self.batch[i].append(value)
+            else:
+                self.column_files[i].write(value + "\n")
+        self.rows += 1
+        if self.format == "parquet" and len(self.batch[0]) >= PARQUET_BATCH_SIZE:
+            self.write_batch()
+
+    def write_tsv(self, file):
+        """
+        Converts KB in tsv format.
+        :param file: opened tsv file
+        :raise ValueError if row has more fields than schema
+        :raise IOError if fails to read or write
+        """
+        for line in file:
+            self.write_row(line.rstrip("\n").split("\t"))
+
+    def write_batch(self):
+        """
+        Writes collected rows to parquet file.
+        """
+        if self.batch and self.batch[0]:
+            self.writer.write_table(
+                pyarrow.Table.from_arrays(
+                    [
+                        pyarrow.array(column, type=self.schema.field(i).type)
+                        for i, column in enumerate(self.batch)
+                    ],
+                    schema=self.schema,
+                )
+            )
+            self.batch = [[] for _ in self.fields]
+
+    def close(self):
+        """
+        Writes remaining data and schema and closes output.
+        :raise IOError if fails to write to output
+        """
+        if self.format == "parquet":
+            self.write_batch()
+            self.writer.close()
+            return
+
+        for file in self.column_files:
+            file.close()
+        for i, lengths in enumerate(self.lengths):
+            if lengths is not None:
+                with open(os.path.join(self.path, self.get_lengths_file(i)), "wb") as file:
+                    lengths.tofile(file)
+        schema = {
+            "format": "columns",
+            "rows": self.rows,
+            "fields": [
+                {"name": name, "multiple": multiple} for name, multiple in self.fields
+            ],
+        }
+        with open(os.path.join(self.path, SCHEMA_FILE), "w", encoding="utf-8") as file:
+            json.dump(schema, file, indent=4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+class ColumnarReader:
+    """
+    Reads selected columns of columnar KB.
+    """
+
+    def __init__(self, path):
+        """
+        Opens columnar KB and loads its schema.
+        :param path: parquet file or directory with columns
+        :raise IOError if fails to read schema
+        :raise ValueError if parquet file is given but pyarrow is not available
+        """
+        self.path = path
+        if os.path.isdir(path):
+            self.format = "columns"
+            with open(os.path.join(path, SCHEMA_FILE), "r", encoding="utf-8") as file:
+                schema = json.load(file)
+            self.rows = schema["rows"]
+            self.fields = [(field["name"], field["multiple"]) for field in schema["fields"]]
+        else:
+            if pyarrow is None:
+                raise ValueError("Reading of parquet files requires pyarrow!")
+            self.format = "parquet"
+            self.parquet_file = pyarrow.parquet.ParquetFile(path)
+            self.rows = self.parquet_file.metadata.num_rows
+            self.fields = [
+                (field.name, pyarrow.types.is_list(field.type))
+                for field in self.parquet_file.schema_arrow
+            ]
+        self.field_indexes = {name: i for i, (name, _) in enumerate(self.fields)}
+
+    def read_column(self, name):
+        """
+        Loads values of one column.
+        :param name: name of the column
+        :raise KeyError if column does not exist
+        :raise IOError if fails to read column
+        :return: list of values (lists of values for multi-value columns)
+        """
+        return self.read_columns([name])[name]
+
+    def read_columns(self, names):
+        """
+        Loads values of selected columns, other columns are not read at all.
+        :param names: names of columns
+        :raise KeyError if column does not exist
+        :raise IOError if fails to read columns
+        :return: dictionary column name -> list of values
+        """
+        for name in names:
+            if name not in self.field_indexes:
+                raise KeyError(f"Column '{name}' does not exist in {self.path}!")
+
+        if self.format == "parquet":
+            table = self.parquet_file.read(columns=list(names))
+            return {name: table.column(name).to_pylist() for name in names}
+
+        columns = {}
+        for name in names:
+            index = self.field_indexes[name]
+            with open(
+                os.path.join(self.path, ColumnarWriter.get_column_file(index)),
+                "r",
+                encoding="utf-8",
+                newline="\n",
+            ) as file:
+                values = file.read().split("\n")
+            values.pop()  # empty string after last newline
+            if self.fields[index][1]:
+                lengths = array("I")
+                with open(
+                    os.path.join(self.path, ColumnarWriter.get_lengths_file(index)), "rb"
+                ) as file:
+                    lengths.frombytes(file.read())
+                lists = []
+                start = 0
+                for length in lengths:
+                    lists.append(values[start : start + length])
+                    start += length
+                values = lists
+            columns[name] = values
+        return columns
+
+    def iter_rows(self, names):
+        """
+        Iterates over rows of selected columns.
+        :param names: names of columns
+        :return: generator of tuples with values in order of names
+        """
+        columns = self.read_columns(names)
+        return zip(*(columns[name] for name in names))
+
+
+def main():
+    args = get_args()
+
+    if args.read:
+        try:
+            reader = ColumnarReader(args.read)
+            multiple = [
+                reader.fields[reader.field_indexes[name]][1]
+                for name in args.columns
+                if name in reader.field_indexes
+            ]
+            for row in reader.iter_rows(args.columns):
+                sys.stdout.write(
+                    "\t".join(
+                        VALUE_SEPARATOR.join(value) if multiple[i] else value
+                        for i, value in enumerate(row)
+                    )
+                    + "\n"
+                )
+        except (IOError, KeyError, ValueError):
+            sys.stderr.write(
+                SCRIPT_NAME
+                + ": Failed to read columnar KB! Handled error:\n"
+                + str(traceback.format_exc())
+                + "\n"
+            )
+            return 1
+        return 0
+
+    if not args.input_file or not args.output:
+        sys.stderr.write("Input file and output must be set for conversion!\n")
+        sys.stderr.write("Use '--help' to see '-f' and '-o' options!\n")
+        return 1
+    if not args.fields and not (args.head and args.type):
+        sys.stderr.write("Schema of KB is not set!\n")
+        sys.stderr.write("Use '--help' to see '-s', '--head' and '--type' options!\n")
+        return 1
+
+    try:
+        if args.fields:
+            fields = load_fields(args.fields)
+        else:
+            fields = load_head_fields(args.head, args.type)
+        input_file = compressedFiles.open_file(args.input_file, "r")
+        with ColumnarWriter(args.output, fields, args.format) as writer:
+            writer.write_tsv(input_file)
+        input_file.close()
+    except (IOError, ValueError):
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to convert KB to columnar format! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
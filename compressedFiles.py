@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: compressedFiles.py
+# Project: wikidata2
+# Description: Opens compressed (gzip, zstd) and uncompressed files transparently.
+#              Compression of input files is detected by magic bytes, output compression is selected
+#              by argument or by OUTPUT_COMPRESSION environment variable (see env_variables.cfg).
+
+import argparse
+import gzip  # gzip compression
+import io  # stream wrappers
+import os  # environment
+import shutil  # find zstd binary
+import subprocess  # zstd compression without zstandard module
+
+try:
+    import zstandard  # zstd compression inside of the process
+except ImportError:
+    zstandard = None  # zstd command line tool is used instead
+
+# suffix of file name for each compression
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+# magic bytes at the beginning of compressed files
+COMPRESSION_MAGIC = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+# compression levels (fast levels - data are compressed on the fly)
+COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+# size of buffers of opened files
+BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def get_default_compression():
+    """
+    Returns compression selected by OUTPUT_COMPRESSION environment variable.
+    :raise ValueError if compression is not supported
+    :return: name of compression (none/gzip/zstd)
+    """
+    compression = os.environ.get("OUTPUT_COMPRESSION") or "none"
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unsupported compression '{compression}'!")
+    return compression
+
+
+def get_compression_suffix(compression=None):
+    """
+    Returns suffix of file name for given compression.
+    :param compression: name of compression (None = default compression)
+    :return: suffix of file name (empty string for uncompressed files)
+    """
+    if compression is None:
+        compression = get_default_compression()
+    return COMPRESSION_SUFFIXES[compression]
+
+
+def detect_compression(path):
+    """
+    Detects compression of file by magic bytes at its beginning.
+    :param path: path to the file
+    :raise IOError if fails to read from file
+    :return: name of compression (none/gzip/zstd)
+    """
+    with open(path, "rb") as file:
+        head = file.read(4)
+    for compression, magic in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return "none"
+
+
+class ProcessPipe(io.RawIOBase):
+    """
+    Raw stream connected to (de)compression process.
+    Closing of the stream waits until the process finishes.
+    """
+
+    def __init__(self, args, path, writing):
+        """
+        Starts the process.
+        :param args: command line of the process (reads stdin, writes stdout)
+        :param path: path to the file, which is connected to other end of the process
+        :param writing: tells if stream is used for writing or reading
+        :raise IOError if fails to open file or start the process
+        """
+        super().__init__()
+        self.name = path
+        self.writing = writing
+        if writing:
+            self.file = open(path, "wb")
+            self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=self.file)
+            self.pipe = self.process.stdin
+        else:
+            self.file = open(path, "rb")
+            self.process = subprocess.Popen(args, stdin=self.file, stdout=subprocess.PIPE)
+            self.pipe = self.process.stdout
+
+    def readable(self):
+        return not self.writing
+
+    def writable(self):
+        return self.writing
+
+    def readinto(self, buffer):
+        return self.pipe.readinto(buffer)
+
+    def write(self, data):
+        self.pipe.write(data)
+        return len(data)
+
+    def close(self):
+        """
+        Closes the pipe and waits for the process.
+        :raise IOError if compression process fails
+        """
+        if self.closed:
+            return
+        self.pipe.close()
+        return_code = self.process.wait()
+        self.file.close()
+        super().close()
+        # reading process is killed by SIGPIPE if the file is not read to the end
+        if self.writing and return_code != 0:
+            raise IOError(f"Compression of {self.name} failed ({return_code})!")
+
+
+def open_zstd(path, writing):
+    """
+    Opens zstd compressed file as binary stream.
+    Uses zstandard module if available, otherwise zstd command line tool (multi-threaded).
+    :param path: path to the file
+    :param writing: tells if file is opened for writing or reading
+    :raise IOError if fails to open the file or zstd is not available
+    :return: binary stream
+    """
+    if zstandard is not None:
+        if writing:
+            compressor = zstandard.ZstdCompressor(
+                level=COMPRESSION_LEVELS["zstd"], threads=-1
+            )
+            return io.BufferedWriter(
+                compressor.stream_writer(open(path, "wb")), BUFFER_SIZE
+            )
+        # concatenated files consist of multiple frames
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(
+                open(path, "rb"), read_across_frames=True
+            ),
+            BUFFER_SIZE,
+        )
+
+    if not shutil.which("zstd"):
+        raise IOError("Neither zstandard module nor zstd tool is available!")
+    if writing:
+        args = ["zstd", "-q", "-T0", f"-{COMPRESSION_LEVELS['zstd']}", "-c"]
+        return io.BufferedWriter(ProcessPipe(args, path, True), BUFFER_SIZE)
+    return io.BufferedReader(ProcessPipe(["zstd", "-q", "-d", "-c"], path, False), BUFFER_SIZE)
+
+
+def open_file(path, mode="r", compression=None):
+    """
+    Opens file, compression of read files is detected automatically.
+    :param path: path to the file
+    :param mode: r/w/a, with b for binary mode (append is not supported for compressed files)
+    :param compression: compression of written file (None = default compression, see get_default_compression())
+    :raise IOError if fails to open the file
+    :raise ValueError if mode or compression is not supported
+    :return: opened file (text files use utf-8 encoding)
+    """
+    binary = "b" in mode
+    writing = "w" in mode or "a" in mode
+    if "+" in mode:
+        raise ValueError("Files can't be opened for reading and writing at once!")
+
+    if writing:
+        if compression is None:
+            compression = get_default_compression()
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unsupported compression '{compression}'!")
+        if compression != "none" and "a" in mode:
+            raise ValueError("Compressed files can't be appended!")
+    else:
+        compression = detect_compression(path)
+
+    if compression == "none":
+        if binary:
+            return open(path, mode, buffering=BUFFER_SIZE)
+        return open(path, mode, buffering=BUFFER_SIZE, encoding="utf-8")
+
+    if compression == "gzip":
+        stream = gzip.open(
+            path,
+            "wb" if writing else "rb",
+            compresslevel=COMPRESSION_LEVELS["gzip"],
+        )
+    else:
+        stream = open_zstd(path, writing)
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+class FileType(argparse.FileType):
+    """
+    Argparse file type, which opens compressed input files transparently.
+    Standard input and output ('-') are opened by argparse.FileType.
+    """
+
+    def __call__(self, string):
+        if string == "-":
+            return super().__call__(string)
+        try:
+            return open_file(string, self._mode)
+        except (IOError, ValueError) as e:
+            raise argparse.ArgumentTypeError(f"can't open '{string}': {e}")
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: crosswalkIndex.py
+# Project: wikidata2
+# Description: Compiles external identifiers of entities (VIAF, GND, ISNI, ...) collected by parser
+#              (see --external-ids of parseWikidataDump.py) to index (scheme, external id) -> entity ids
+#              and looks identifiers up in it.
+#              Index contains sorted keys (property id of scheme and external id), offsets of keys in UTF-8
+#              blob and offsets into array of numeric entity ids (uint64). File is memory mapped and searched
+#              by binary search, so resolving external identifier is a single index probe.
+#              Input is split to runs sorted in parallel processes, runs are merged by k-way merge.
+
+import argparse
+import heapq  # k-way merge of runs
+import mmap  # memory mapped index
+import os  # filesystem
+import shutil  # concatenation of temporary files
+import struct  # file header
+import sys  # stdout, stderr, exit, byte order
+import tempfile  # temporary files
+import traceback  # for printing exceptions
+from array import array  # offsets and entity ids
+from itertools import islice  # reading of runs
+from multiprocessing import Pool  # parallel sorting of runs
+
+import compressedFiles  # compressed input files
+import externalSort  # sorted runs
+import parseJson2  # entity id encoding
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# magic bytes at the beginning of the index
+MAGIC = b"WDXWALK1"
+# header: magic, byte order (b/l), padding, number of keys, number of entity ids
+HEADER = struct.Struct("=8sc7xQQ")
+# external identifier properties collected by default and names of their schemes
+DEFAULT_PROPERTIES = {
+    "P214": "viaf",
+    "P227": "gnd",
+    "P213": "isni",
+    "P244": "lccn",
+    "P268": "bnf",
+    "P269": "idref",
+    "P691": "nkc",
+    "P1006": "nta",
+    "P245": "ulan",
+    "P1566": "geonames",
+    "P496": "orcid",
+    "P646": "freebase",
+    "P2163": "fast",
+}
+# separator of scheme and external id in keys
+KEY_SEPARATOR = "\t"
+# number of offsets/ids written at once
+ARRAY_BATCH_SIZE = 1024 * 1024
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Compiles external identifiers to crosswalk index and looks them up."
+    )
+    argparser.add_argument(
+        "-f",
+        "--input-files",
+        help="Files with external identifiers collected by parser (property, external id and entity id"
+        " on each line, may be compressed).",
+        nargs="+",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output-file",
+        help="Output index.",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes sorting runs (default=%(default)s).",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    argparser.add_argument(
+        "--temp-dir",
+        help="Directory for temporary files (default: directory of output file).",
+    )
+    argparser.add_argument(
+        "--run-size",
+        help="Number of identifiers sorted in memory by one process (default=%(default)s).",
+        type=int,
+        default=externalSort.DEFAULT_RUN_SIZE,
+    )
+    argparser.add_argument(
+        "-r",
+        "--read",
+        help="Index to query, matching entity ids are printed.",
+    )
+    argparser.add_argument(
+        "-q",
+        "--query",
+        help="Identifiers to look up in SCHEME:ID format, scheme is property id or name (e.g. viaf:113230702).",
+        nargs="+",
+        default=[],
+    )
+    return argparser.parse_args()
+
+
+def get_scheme_property(scheme):
+    """
+    Converts name of scheme to property id.
+    :param scheme: property id (e.g. P214) or name of scheme (e.g. viaf)
+    :raise ValueError if scheme is unknown
+    :return: property id
+    """
+    if parseJson2.ENTITY_ID_REGEXP.fullmatch(scheme) and scheme[0] == "P":
+        return scheme
+    for property_id, name in DEFAULT_PROPERTIES.items():
+        if name == scheme.lower():
+            return property_id
+    raise ValueError(f"Unknown identifier scheme '{scheme}'!")
+
+
+def normalize_external_id(property_id, value):
+    """
+    Normalises external identifier, so different notations of one identifier are equal.
+    :param property_id: property of the identifier
+    :param value: external identifier
+    :return: normalised identifier
+    """
+    value = value.strip()
+    if property_id == "P213":  # ISNI is written with or without spaces
+        value = value.replace(" ", "")
+    return value
+
+
+def get_key(property_id, value):
+    """
+    Returns key of identifier in index.
+    :param property_id: property of the identifier
+    :param value: normalised external identifier
+    :return: UTF-8 encoded key
+    """
+    return (property_id + KEY_SEPARATOR + value).encode("utf-8")
+
+
+def get_record_key(record):
+    """
+    Returns sort key of identifier record.
+    :param record: (property id, external id, numeric entity id) tuple of strings
+    :return: (key, numeric entity id) tuple
+    """
+    return get_key(record[0], record[1]), int(record[2])
+
+
+def read_records(file):
+    """
+    Reads identifiers collected by parser.
+    Lines with invalid entity ids or empty identifiers are skipped.
+    :param file: opened file with property, external id and entity id on each line
+    :raise IOError if fails to read from file
+    :return: generator of (property id, external id, numeric entity id) tuples of strings
+    """
+    for line in file:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) != 3:
+            continue
+        value = normalize_external_id(fields[0], fields[1])
+        try:
+            number = parseJson2.encode_entity_id(fields[2])
+        except ValueError:
+            continue
+        if value:
+            yield fields[0], value, str(number)
+
+
+def sort_run(records, temp_dir):
+    """
+    Sorts run of records and writes it to temporary file (runs in worker process).
+    :param records: list of records
+    :param temp_dir: directory for temporary files
+    :return: path to the run file
+    """
+    records.sort(key=get_record_key)
+    return externalSort.write_run(records, temp_dir)
+
+
+def compile_index(
+    input_paths,
+    output_path,
+    jobs=1,
+    run_size=externalSort.DEFAULT_RUN_SIZE,
+    temp_dir=None,
+):
+    """
+    Compiles crosswalk index.
+    Runs of identifiers are sorted in parallel processes and merged.
+    :param input_paths: paths to files with identifiers collected by parser (may be compressed)
+    :param output_path: path to the index
+    :param jobs: number of processes sorting runs
+    :param run_size: number of identifiers sorted in memory by one process
+    :param temp_dir: directory for temporary files (None = directory of output file)
+    :raise IOError if fails to read or write
+    :return: (number of keys, number of entity ids)
+    """
+    if temp_dir is None:
+        temp_dir = os.path.dirname(os.path.abspath(output_path))
+
+    def runs():
+        for path in input_paths:
+            with compressedFiles.open_file(path, "r") as file:
+                records = read_records(file)
+                while True:
+                    run = list(islice(records, run_size))
+                    if not run:
+                        break
+                    yield run
+
+    run_paths = []
+    key_offsets = array("Q", [0])
+    value_offsets = array("Q", [0])
+    values = array("Q")
+    key_count = value_count = key_offset = 0
+    blob = tempfile.TemporaryFile(dir=temp_dir)
+    key_offsets_file = tempfile.TemporaryFile(dir=temp_dir)
+    value_offsets_file = tempfile.TemporaryFile(dir=temp_dir)
+    values_file = tempfile.TemporaryFile(dir=temp_dir)
+    try:
+        with Pool(max(1, jobs)) as pool:
+            pending = []
+            for run in runs():
+                pending.append(pool.apply_async(sort_run, (run, temp_dir)))
+                # bound number of runs kept in memory
+                while len(pending) > jobs:
+                    run_paths.append(pending.pop(0).get())
+            run_paths.extend(result.get() for result in pending)
+
+        previous_key = previous_value = None
+        for record in heapq.merge(
+            *(externalSort.read_run(path) for path in run_paths), key=get_record_key
+        ):
+            key, value = get_record_key(record)
+            if key != previous_key:
+                if previous_key is not None:
+                    key_offsets.append(key_offset)
+                    value_offsets.append(value_count)
+                key_offset += blob.write(key)
+                previous_key = key
+                key_count += 1
+            elif value == previous_value:  # duplicate statement
+                continue
+            values.append(value)
+            previous_value = value
+            value_count += 1
+            for data, data_file in (
+                (key_offsets, key_offsets_file),
+                (value_offsets, value_offsets_file),
+                (values, values_file),
+            ):
+                if len(data) >= ARRAY_BATCH_SIZE:
+                    data.tofile(data_file)
+                    del data[:]
+        if previous_key is not None:
+            key_offsets.append(key_offset)
+            value_offsets.append(value_count)
+        for data, data_file in (
+            (key_offsets, key_offsets_file),
+            (value_offsets, value_offsets_file),
+            (values, values_file),
+        ):
+            data.tofile(data_file)
+
+        with open(output_path, "wb") as output:
+            output.write(
+                HEADER.pack(
+                    MAGIC,
+                    b"l" if sys.byteorder == "little" else b"b",
+                    key_count,
+                    value_count,
+                )
+            )
+            for temp_file in (key_offsets_file, value_offsets_file, values_file, blob):
+                temp_file.seek(0)
+                shutil.copyfileobj(temp_file, output, compressedFiles.BUFFER_SIZE)
+    finally:
+        for temp_file in (blob, key_offsets_file, value_offsets_file, values_file):
+            temp_file.close()
+        for path in run_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return key_count, value_count
+
+
+class CrosswalkIndex:
+    """
+    Read-only index of external identifiers stored in memory mapped file.
+    """
+
+    def __init__(self, path):
+        """
+        Maps index to memory.
+        :param path: path to the index
+        :raise IOError if fails to open file
+        :raise ValueError if file is not crosswalk index or has different byte order
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, self.count, value_count = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not crosswalk index!")
+        if byte_order != (b"l" if sys.byteorder == "little" else b"b"):
+            raise ValueError(f"Byte order of {path} differs from byte order of this machine!")
+
+        self.view = memoryview(self.mmap)
+        key_offsets_start = HEADER.size
+        value_offsets_start = key_offsets_start + (self.count + 1) * 8
+        values_start = value_offsets_start + (self.count + 1) * 8
+        self.blob_start = values_start + value_count * 8
+        self.key_offsets = self.view[key_offsets_start:value_offsets_start].cast("Q")
+        self.value_offsets = self.view[value_offsets_start:values_start].cast("Q")
+        self.values = self.view[values_start : self.blob_start].cast("Q")
+
+    def get_key(self, index):
+        """
+        :param index: index of the key
+        :return: UTF-8 encoded key
+        """
+        return self.mmap[
+            self.blob_start + self.key_offsets[index] : self.blob_start + self.key_offsets[index + 1]
+        ]
+
+    def find(self, key):
+        """
+        Finds key in index.
+        :param key: UTF-8 encoded key
+        :return: index of the key, None if key is not in index
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.get_key(low) == key:
+            return low
+        return None
+
+    def lookup(self, scheme, external_id):
+        """
+        Finds entities with external identifier.
+        :param scheme: property id (e.g. P214) or name of scheme (e.g. viaf)
+        :param external_id: external identifier
+        :raise ValueError if scheme is unknown
+        :return: list of entity ids (usually one)
+        """
+        property_id = get_scheme_property(scheme)
+        index = self.find(get_key(property_id, normalize_external_id(property_id, external_id)))
+        if index is None:
+            return []
+        return [
+            parseJson2.decode_entity_id(number)
+            for number in self.values[self.value_offsets[index] : self.value_offsets[index + 1]]
+        ]
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """
+        Unmaps the index.
+        """
+        for view in (self.key_offsets, self.value_offsets, self.values):
+            view.release()
+        self.view.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def main():
+    args = get_args()
+
+    if args.read:
+        try:
+            with CrosswalkIndex(args.read) as index:
+                for query in args.query:
+                    scheme, _, external_id = query.partition(":")
+                    for entity_id in index.lookup(scheme, external_id):
+                        sys.stdout.write(f"{query}\t{entity_id}\n")
+        except (IOError, ValueError):
+            sys.stderr.write(
+                SCRIPT_NAME
+                + ": Failed to query crosswalk index! Handled error:\n"
+                + str(traceback.format_exc())
+                + "\n"
+            )
+            return 1
+        return 0
+
+    if not args.input_files or not args.output_file:
+        sys.stderr.write("Input files and output file must be set for compilation!\n")
+        sys.stderr.write("Use '--help' to see '-f' and '-o' options!\n")
+        return 1
+
+    try:
+        key_count, value_count = compile_index(
+            args.input_files, args.output_file, args.jobs, args.run_size, args.temp_dir
+        )
+    except IOError:
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to compile crosswalk index! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+    print(f"External identifiers: {key_count}, entity ids: {value_count}")
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
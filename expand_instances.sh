@@ -29,16 +29,23 @@ export tag="${4}"
 
 . "${project_folder}/wikidata_lib.sh"
 
+# suffix of compressed intermediate files (see OUTPUT_COMPRESSION in env_variables.cfg)
+compression_suffix=`getCompressionSuffix`
+
 # create folder where classes will be stored
 classes_dir=`getProjectTempClassesDir "${dump_name}" "${lang}" "${tag}" "${project_folder}"`
 recreate_dir "${classes_dir}"
 
 # concatenate class relations
 echo "Starting class relations concatenation"
-fpath_full_classes="${classes_dir}/classes_full.json"
+fpath_full_classes="${classes_dir}/classes_full.json${compression_suffix}"
+# binary dump is memory mapped by all expanding processes (see classGraph.py)
+fpath_class_graph="${classes_dir}/classes_full.bin"
+# node-local copy of binary dump shared by all expanding processes of the node
+shared_graph_dir="/dev/shm/${USER}_wikidata_classes"
 concatenation_start=`timestamp`
 python3 "$project_folder"/classRelationsBuilder.py -s -r -d `getLocalProcessingClassesDir "${dump_name}" "${lang}" "${tag}"` \
- -c "${fpath_full_classes}"
+ -c "${fpath_full_classes}" -b "${fpath_class_graph}" -j `nproc` --compression "${OUTPUT_COMPRESSION}"
 concatenation_end=`timestamp`
 
 
@@ -55,11 +62,9 @@ parallel-ssh -h "$project_folder"/config/hosts.list -p 100 -t 0 -i \
 "[ -d \"${local_instances_dir}\" ] && [ -w \"${local_instances_dir}\" ] || \
 { echo \"Instances not found (${local_instances_dir}).\" >&2; exit 1; }
 cd \"${local_instances_dir}\"
-ls | awk -F'_' '{ if(\$1==\"instances\") print }' | awk -F'.' '{ if(\$4==\"json\") print }' | parallel -j6 \
-  \"$project_folder/classRelationsBuilder.py -i {} -e {.}.tsv \
-    -c "${fpath_full_classes}"
-    sort {.}.tsv > {.}.tsv_sorted
-    mv {.}.tsv_sorted {.}.tsv\"
+ls | awk -F'_' '{ if(\$1==\"instances\") print }' | awk -F'.' '{ if(\$4==\"bin\") print }' | sed 's/\.bin.*\$//' | parallel -j100% \
+  \"$project_folder/classRelationsBuilder.py -i {}.bin${compression_suffix} -e {}.tsv --compression none \
+    -b "${fpath_class_graph}" --shared-graph "${shared_graph_dir}"\"
 "
 expansion_end=`timestamp`
 
@@ -73,12 +78,16 @@ parallel-ssh -h "$project_folder"/config/hosts.list -p 100 -t 0 -i \
 "[ -d \"${local_expanded_instances_dir}\" ] && [ -w \"${local_expanded_instances_dir}\" ] || \
 { echo \"Expanded instances not found (${local_expanded_instances_dir}).\" >&2; exit 1; }
 cd \"${local_expanded_instances_dir}\"
-ls | awk -F'_' '{ if(\$1==\"expanded\" && \$2==\"instances\") print }' | awk -F'.' '{ if(\$4==\"tsv\") print }' | parallel -j6 \
-    $project_folder/classRelationsBuilder.py -l {} -o {.}.processed.tsv \
-    -c \"${fpath_full_classes}\"
+ls | awk -F'_' '{ if(\$1==\"expanded\" && \$2==\"instances\") print }' | awk -F'.' '{ if(\$4==\"tsv\") print }' | sed 's/\.tsv.*\$//' | parallel -j100% \
+    $project_folder/classRelationsBuilder.py -l {}.tsv${compression_suffix} -o {}.processed.tsv${compression_suffix} \
+    --compression ${OUTPUT_COMPRESSION} \
+    -b \"${fpath_class_graph}\" --shared-graph \"${shared_graph_dir}\"
 "
 kb_expansion_end=`timestamp`
 
+# remove shared class relations dumps
+parallel-ssh -h "$project_folder"/config/hosts.list -p 100 -t 0 -i "rm -rf \"${shared_graph_dir}\""
+
 # create folder where instances will be stored
 master_instances_dir=`getMasterInstancesDir "${dump_name}" "${lang}" "${tag}"`
 recreate_dir "${master_instances_dir}"
@@ -156,14 +165,15 @@ mkdir -p "${tmp_expanded_instances_dir}"
 # parallel name substitution (on localhost only) (expanded instance kb)
 echo "Starting name substitution"
 kb_substitution_start=`timestamp`
-ls "${master_expanded_instances_dir}" | parallel -j6 \
+ls "${master_expanded_instances_dir}" | sed 's/\.tsv.*$//' | parallel -j6 \
 eval "
-if [ \"{}\" != \"dict.tsv\" ] ; then
+if [ \"{}\" != \"dict\" ] ; then
   echo \"Substituting names of {}\"; \
   \"$project_folder\"/substituteNames.py \
-  -d \"${proj_tmp_dicts_dir}/dict.tsv\" \
-  -f \"${master_expanded_instances_dir}/{}\" \
-  -o \"${master_expanded_instances_dir}/{.}.name_substituted.tsv\" \
+  -d \"${proj_tmp_dicts_dir}/dict.bin\" \
+  -f \"${master_expanded_instances_dir}/{}.tsv${compression_suffix}\" \
+  -o \"${master_expanded_instances_dir}/{}.name_substituted.tsv\" \
+  --compression none \
   -e 0 8 9 10 11 \
   --remove-missing
 fi
@@ -174,8 +184,9 @@ kb_substitution_end=`timestamp`
 echo "Concatenating collected data to final result"
 final_start=`timestamp`
 cd "${master_instances_dir}" || { echo "Failed to concatenate instances!" >&2; exit 1; }
-sort -m `ls` > instances_all.tsv
-mv instances_all.tsv "${tmp_instances_dir}/"
+# expanded instances are sorted by instance id, so they are only merged
+python3 "$project_folder"/classRelationsBuilder.py -m `ls` -e "${tmp_instances_dir}/instances_all.tsv" \
+ --compression none || { echo "Failed to concatenate instances!" >&2; exit 1; }
 cd "$project_folder" || { echo "Failed to change folder to $project_folder!"; exit 1; }
 final_end=`timestamp`
 
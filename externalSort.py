@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: externalSort.py
+# Project: wikidata2
+# Description: Sorts records which do not fit into memory.
+#              Records are sorted in memory bounded runs, runs are spilled to temporary tsv files
+#              and merged by k-way merge.
+
+import heapq  # k-way merge of runs
+import os  # filesystem
+import tempfile  # temporary run files
+
+# default number of records sorted in memory at once
+DEFAULT_RUN_SIZE = 2000000
+# size of buffers of run files
+RUN_BUFFER_SIZE = 1024 * 1024
+
+
+def write_run(records, temp_dir=None):
+    """
+    Writes sorted records to temporary run file.
+    :param records: sorted records (tuples or lists of strings without newlines)
+    :param temp_dir: directory for temporary files (None = system default)
+    :raise IOError if fails to write to file
+    :return: path to the run file
+    """
+    fd, path = tempfile.mkstemp(prefix="run_", suffix=".tsv", dir=temp_dir)
+    with open(fd, "w", encoding="utf-8", buffering=RUN_BUFFER_SIZE) as file:
+        file.writelines("\t".join(record) + "\n" for record in records)
+    return path
+
+
+def read_run(path, fields=None):
+    """
+    Reads records from run file.
+    :param path: path to the run file
+    :param fields: number of fields of records, the last field may contain tabs (None = no field contains tabs)
+    :raise IOError if fails to read from file
+    :return: generator of records (tuples of strings)
+    """
+    max_split = fields - 1 if fields else -1
+    with open(path, "r", encoding="utf-8", buffering=RUN_BUFFER_SIZE) as file:
+        for line in file:
+            yield tuple(line[:-1].split("\t", max_split))
+
+
+def external_sort(
+    records, key=None, run_size=DEFAULT_RUN_SIZE, temp_dir=None, fields=None
+):
+    """
+    Sorts records, only run_size records are kept in memory at once.
+    Sort is stable, equal records keep their input order.
+    :param records: iterable of records (tuples or lists of strings without newlines, see fields)
+    :param key: key function of sort (None = records are compared directly)
+    :param run_size: number of records sorted in memory at once
+    :param temp_dir: directory for temporary files (None = system default)
+    :param fields: number of fields of records, the last field may contain tabs (None = no field contains tabs)
+    :raise IOError if fails to write or read temporary files
+    :return: generator of sorted records (records spilled to disk are returned as tuples)
+    """
+    run_paths = []
+    try:
+        run = []
+        for record in records:
+            run.append(record)
+            if len(run) >= run_size:
+                run.sort(key=key)
+                run_paths.append(write_run(run, temp_dir))
+                run = []
+        run.sort(key=key)
+
+        if not run_paths:  # everything fits into memory
+            yield from run
+            return
+        if run:
+            run_paths.append(write_run(run, temp_dir))
+            run = []
+        # merge keeps order of runs for equal keys (runs are created in input order)
+        yield from heapq.merge(*(read_run(path, fields) for path in run_paths), key=key)
+    finally:
+        for path in run_paths:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: geoIndex.py
+# Project: wikidata2
+# Description: Builds spatial index over geographical KB (LATITUDE and LONGITUDE columns) and queries it.
+#              Index is regular latitude/longitude grid stored in compressed sparse row layout: offsets
+#              of cells into arrays of coordinates (float64) and KB row ids (uint32) sorted by cell.
+#              Index is stored next to the tsv file and memory mapped, queries return KB row ids
+#              (0-based index of row, lines of KB header are not counted).
+
+import argparse
+import mmap  # memory mapped index
+import os  # filesystem
+import struct  # file header
+import sys  # stdout, stderr, exit, byte order
+import traceback  # for printing exceptions
+from array import array  # coordinates, row ids and cell offsets
+from heapq import nsmallest  # k nearest neighbours
+from math import asin, cos, degrees, floor, isfinite, pi, radians, sin, sqrt
+
+import compressedFiles  # compressed input files
+import kbStore  # reading of KB header
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# magic bytes at the beginning of the index
+MAGIC = b"WDGEOI1\0"
+# header: magic, byte order (b/l), padding, cell size in degrees, number of KB rows, number of points,
+#         number of latitude cells, number of longitude cells
+HEADER = struct.Struct("=8sc7xdQQQQ")
+# suffix of index file (index of places.tsv is places.tsv.geoidx)
+INDEX_SUFFIX = ".geoidx"
+# default columns of geographical KB with coordinates (see merge_KB/HEAD)
+LATITUDE_COLUMN = 12
+LONGITUDE_COLUMN = 13
+# default size of grid cell in degrees
+DEFAULT_CELL_SIZE = 0.5
+# mean radius of the Earth in kilometres
+EARTH_RADIUS = 6371.0088
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Builds spatial index over geographical KB and queries it."
+    )
+    argparser.add_argument(
+        "-f",
+        "--input-file",
+        help="Geographical KB in tsv format (may be compressed).",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output-file",
+        help=f"Output index (default: input file with {INDEX_SUFFIX} suffix).",
+    )
+    argparser.add_argument(
+        "--cell-size",
+        help="Size of grid cell in degrees (default=%(default)s).",
+        type=float,
+        default=DEFAULT_CELL_SIZE,
+    )
+    argparser.add_argument(
+        "--latitude-column",
+        help="0-based index of column with latitude (default=%(default)s).",
+        type=int,
+        default=LATITUDE_COLUMN,
+    )
+    argparser.add_argument(
+        "--longitude-column",
+        help="0-based index of column with longitude (default=%(default)s).",
+        type=int,
+        default=LONGITUDE_COLUMN,
+    )
+    argparser.add_argument(
+        "-r",
+        "--read",
+        help="Index to query, matching row ids are printed.",
+    )
+    argparser.add_argument(
+        "--nearest",
+        help="Print rows nearest to the point (with distance in km).",
+        type=float,
+        nargs=2,
+        metavar=("LAT", "LON"),
+    )
+    argparser.add_argument(
+        "-k",
+        help="Number of nearest rows (default=%(default)s).",
+        type=int,
+        default=1,
+    )
+    argparser.add_argument(
+        "--max-distance",
+        help="Maximal distance of nearest rows in km.",
+        type=float,
+    )
+    argparser.add_argument(
+        "--bbox",
+        help="Print rows inside of bounding box (longitude range may cross antimeridian).",
+        type=float,
+        nargs=4,
+        metavar=("MIN_LAT", "MIN_LON", "MAX_LAT", "MAX_LON"),
+    )
+    return argparser.parse_args()
+
+
+def get_index_path(tsv_path):
+    """
+    Returns path to the index of tsv file.
+    :param tsv_path: path to the geographical KB (compression suffix is ignored)
+    :return: path to the index
+    """
+    for suffix in compressedFiles.COMPRESSION_SUFFIXES.values():
+        if suffix and tsv_path.endswith(suffix):
+            tsv_path = tsv_path[: -len(suffix)]
+    return tsv_path + INDEX_SUFFIX
+
+
+def get_distance(lat1, lon1, lat2, lon2):
+    """
+    Computes great-circle distance of two points (haversine formula).
+    :param lat1: latitude of the first point in degrees
+    :param lon1: longitude of the first point in degrees
+    :param lat2: latitude of the second point in degrees
+    :param lon2: longitude of the second point in degrees
+    :return: distance in km
+    """
+    haversine = (
+        sin(radians(lat2 - lat1) / 2) ** 2
+        + cos(radians(lat1)) * cos(radians(lat2)) * sin(radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * asin(min(1.0, sqrt(haversine)))
+
+
+def parse_coordinates(latitude, longitude):
+    """
+    Converts coordinates from KB.
+    :param latitude: latitude string
+    :param longitude: longitude string
+    :return: (latitude, longitude) tuple, None if coordinates are missing or invalid
+    """
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except ValueError:
+        return None
+    if not (isfinite(latitude) and isfinite(longitude)) or abs(latitude) > 90:
+        return None
+    if not -180 <= longitude < 180:  # normalise longitude
+        longitude = (longitude + 180) % 360 - 180
+    return latitude, longitude
+
+
+class Grid:
+    """
+    Mapping of coordinates to cells of regular grid.
+    """
+
+    def __init__(self, cell_size):
+        """
+        :param cell_size: requested size of cell in degrees (rounded down, so the cells cover 180 degrees exactly)
+        :raise ValueError if cell size is not positive
+        """
+        if not cell_size > 0:
+            raise ValueError("Size of grid cell must be positive!")
+        self.lat_cells = max(1, int(-(-180 // cell_size)))
+        self.lon_cells = 2 * self.lat_cells
+        self.cell_size = 180 / self.lat_cells
+
+    def get_lat_cell(self, latitude):
+        return min(self.lat_cells - 1, max(0, floor((latitude + 90) / self.cell_size)))
+
+    def get_lon_cell(self, longitude):
+        return floor((longitude + 180) / self.cell_size) % self.lon_cells
+
+    def get_cell(self, latitude, longitude):
+        """
+        :return: index of cell containing point
+        """
+        return self.get_lat_cell(latitude) * self.lon_cells + self.get_lon_cell(longitude)
+
+
+def build_index(
+    file,
+    output_path,
+    cell_size=DEFAULT_CELL_SIZE,
+    latitude_column=LATITUDE_COLUMN,
+    longitude_column=LONGITUDE_COLUMN,
+):
+    """
+    Builds spatial index of geographical KB.
+    Rows without valid coordinates are not indexed.
+    :param file: opened geographical KB in tsv format
+    :param output_path: path to the index
+    :param cell_size: size of grid cell in degrees
+    :param latitude_column: index of column with latitude
+    :param longitude_column: index of column with longitude
+    :raise IOError if fails to read or write
+    :raise ValueError if cell size is not positive
+    :return: (number of rows, number of indexed points)
+    """
+    grid = Grid(cell_size)
+    _, rows = kbStore.read_kb(file)
+    latitudes = array("d")
+    longitudes = array("d")
+    row_ids = array("I")
+    cells = array("I")
+    row_count = 0
+    for row_id, (_, line) in enumerate(rows):
+        row_count += 1
+        fields = line.split("\t")
+        if max(latitude_column, longitude_column) >= len(fields):
+            continue
+        coordinates = parse_coordinates(fields[latitude_column], fields[longitude_column])
+        if coordinates is None:
+            continue
+        latitudes.append(coordinates[0])
+        longitudes.append(coordinates[1])
+        row_ids.append(row_id)
+        cells.append(grid.get_cell(*coordinates))
+
+    # counting sort of points by cell (rows keep their order inside of cell)
+    cell_count = grid.lat_cells * grid.lon_cells
+    offsets = array("Q", bytes(8 * (cell_count + 1)))
+    for cell in cells:
+        offsets[cell + 1] += 1
+    for cell in range(cell_count):
+        offsets[cell + 1] += offsets[cell]
+    positions = offsets[:-1]
+    order = array("Q", bytes(8 * len(cells)))
+    for point, cell in enumerate(cells):
+        order[positions[cell]] = point
+        positions[cell] += 1
+    del cells, positions
+
+    with open(output_path, "wb") as output:
+        output.write(
+            HEADER.pack(
+                MAGIC,
+                b"l" if sys.byteorder == "little" else b"b",
+                cell_size,
+                row_count,
+                len(order),
+                grid.lat_cells,
+                grid.lon_cells,
+            )
+        )
+        offsets.tofile(output)
+        array("d", (latitudes[point] for point in order)).tofile(output)
+        array("d", (longitudes[point] for point in order)).tofile(output)
+        array("I", (row_ids[point] for point in order)).tofile(output)
+    return row_count, len(order)
+
+
+class GeoIndex:
+    """
+    Read-only spatial index stored in memory mapped file.
+    """
+
+    def __init__(self, path):
+        """
+        Maps index to memory.
+        :param path: path to the index
+        :raise IOError if fails to open file
+        :raise ValueError if file is not spatial index or has different byte order
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, cell_size, self.rows, self.count, lat_cells, lon_cells = (
+            HEADER.unpack_from(self.mmap)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not spatial index!")
+        if byte_order != (b"l" if sys.byteorder == "little" else b"b"):
+            raise ValueError(f"Byte order of {path} differs from byte order of this machine!")
+        self.grid = Grid(cell_size)
+        if (self.grid.lat_cells, self.grid.lon_cells) != (lat_cells, lon_cells):
+            raise ValueError(f"Grid of {path} is corrupted!")
+
+        self.view = memoryview(self.mmap)
+        start = HEADER.size
+        end = start + (lat_cells * lon_cells + 1) * 8
+        self.offsets = self.view[start:end].cast("Q")
+        start, end = end, end + self.count * 8
+        self.latitudes = self.view[start:end].cast("d")
+        start, end = end, end + self.count * 8
+        self.longitudes = self.view[start:end].cast("d")
+        start, end = end, end + self.count * 4
+        self.row_ids = self.view[start:end].cast("I")
+
+    def get_cell_points(self, lat_cell, lon_cell):
+        """
+        :return: range of points in cell
+        """
+        cell = lat_cell * self.grid.lon_cells + lon_cell
+        return range(self.offsets[cell], self.offsets[cell + 1])
+
+    def get_coordinates(self, point):
+        """
+        :param point: index of point in index (not row id)
+        :return: (latitude, longitude) tuple
+        """
+        return self.latitudes[point], self.longitudes[point]
+
+    def get_box_points(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """
+        Iterates over points in cells overlapping with bounding box (points are not filtered).
+        :param min_latitude: southern boundary
+        :param min_longitude: western boundary (normalised to <-180, 180))
+        :param max_latitude: northern boundary
+        :param max_longitude: eastern boundary (normalised to <-180, 180)), may be less than western boundary
+        :return: generator of points
+        """
+        grid = self.grid
+        first = grid.get_lon_cell(min_longitude)
+        last = grid.get_lon_cell(max_longitude)
+        if first == last and min_longitude > max_longitude:
+            lon_cells = range(grid.lon_cells)  # box crosses antimeridian inside of one cell
+        else:
+            lon_cells = [
+                (first + i) % grid.lon_cells
+                for i in range((last - first) % grid.lon_cells + 1)
+            ]
+        for lat_cell in range(
+            grid.get_lat_cell(min_latitude), grid.get_lat_cell(max_latitude) + 1
+        ):
+            for lon_cell in lon_cells:
+                yield from self.get_cell_points(lat_cell, lon_cell)
+
+    def bbox(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """
+        Finds rows inside of bounding box (boundaries are included).
+        If min_longitude is greater than max_longitude, box crosses antimeridian.
+        :param min_latitude: southern boundary
+        :param min_longitude: western boundary
+        :param max_latitude: northern boundary
+        :param max_longitude: eastern boundary
+        :return: list of row ids
+        """
+        if min_latitude > max_latitude:
+            return []
+        if max_longitude - min_longitude >= 360:
+            # box contains all longitudes, all longitude cells are searched (180 is in cell of -180)
+            min_longitude, max_longitude = -180.0, 180.0
+            max_cell_longitude = 180.0 - self.grid.cell_size
+        else:
+            min_longitude = (min_longitude + 180) % 360 - 180
+            max_longitude = (max_longitude + 180) % 360 - 180
+            max_cell_longitude = max_longitude
+        crosses = min_longitude > max_longitude
+
+        result = []
+        for point in self.get_box_points(
+            min_latitude, min_longitude, max_latitude, max_cell_longitude
+        ):
+            latitude, longitude = self.get_coordinates(point)
+            if not min_latitude <= latitude <= max_latitude:
+                continue
+            if crosses:
+                inside = longitude >= min_longitude or longitude <= max_longitude
+            else:
+                inside = min_longitude <= longitude <= max_longitude
+            if inside:
+                result.append(self.row_ids[point])
+        return result
+
+    def get_circle_points(self, latitude, longitude, radius):
+        """
+        Finds points within distance from the point.
+        Cells overlapping with bounding box of spherical cap are searched.
+        :param latitude: latitude of the point
+        :param longitude: longitude of the point (normalised to <-180, 180))
+        :param radius: distance in km
+        :return: list of (distance, point) tuples
+        """
+        angle = degrees(radius / EARTH_RADIUS)
+        min_latitude = latitude - angle
+        max_latitude = latitude + angle
+        if min_latitude <= -90 or max_latitude >= 90 or angle >= 180:
+            # cap contains pole, all longitudes are searched
+            min_latitude = max(-90.0, min_latitude)
+            max_latitude = min(90.0, max_latitude)
+            min_longitude, max_longitude = -180.0, 180.0 - self.grid.cell_size
+        else:
+            ratio = sin(radians(angle)) / cos(radians(latitude))
+            if ratio >= 1:
+                min_longitude, max_longitude = -180.0, 180.0 - self.grid.cell_size
+            else:
+                delta = degrees(asin(ratio))
+                min_longitude = (longitude - delta + 180) % 360 - 180
+                max_longitude = (longitude + delta + 180) % 360 - 180
+
+        result = []
+        for point in self.get_box_points(
+            min_latitude, min_longitude, max_latitude, max_longitude
+        ):
+            distance = get_distance(latitude, longitude, *self.get_coordinates(point))
+            if distance <= radius:
+                result.append((distance, point))
+        return result
+
+    def within(self, latitude, longitude, radius):
+        """
+        Finds rows within distance from the point.
+        :param latitude: latitude of the point
+        :param longitude: longitude of the point
+        :param radius: distance in km
+        :return: list of (row id, distance in km) tuples sorted by distance
+        """
+        longitude = (longitude + 180) % 360 - 180
+        return [
+            (self.row_ids[point], distance)
+            for distance, point in sorted(
+                self.get_circle_points(latitude, longitude, radius)
+            )
+        ]
+
+    def nearest(self, latitude, longitude, k=1, max_distance=None):
+        """
+        Finds rows nearest to the point.
+        Points within radius are searched, radius is doubled until k points are found.
+        :param latitude: latitude of the point
+        :param longitude: longitude of the point
+        :param k: number of nearest rows
+        :param max_distance: maximal distance in km (None = unlimited)
+        :return: list of (row id, distance in km) tuples sorted by distance
+        """
+        longitude = (longitude + 180) % 360 - 180
+        max_radius = pi * EARTH_RADIUS  # half of the circumference covers whole sphere
+        if max_distance is not None:
+            max_radius = min(max_radius, max_distance)
+        radius = min(max_radius, radians(self.grid.cell_size) * EARTH_RADIUS)
+        while True:
+            points = self.get_circle_points(latitude, longitude, radius)
+            if len(points) >= k or radius >= max_radius:
+                break
+            radius = min(max_radius, radius * 2)
+        return [(self.row_ids[point], distance) for distance, point in nsmallest(k, points)]
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """
+        Unmaps the index.
+        """
+        for view in (self.offsets, self.latitudes, self.longitudes, self.row_ids):
+            view.release()
+        self.view.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def main():
+    args = get_args()
+
+    if args.read:
+        try:
+            with GeoIndex(args.read) as index:
+                if args.nearest:
+                    for row_id, distance in index.nearest(
+                        args.nearest[0], args.nearest[1], args.k, args.max_distance
+                    ):
+                        sys.stdout.write(f"{row_id}\t{distance:.3f}\n")
+                if args.bbox:
+                    for row_id in index.bbox(*args.bbox):
+                        sys.stdout.write(f"{row_id}\n")
+        except (IOError, ValueError):
+            sys.stderr.write(
+                SCRIPT_NAME
+                + ": Failed to query spatial index! Handled error:\n"
+                + str(traceback.format_exc())
+                + "\n"
+            )
+            return 1
+        return 0
+
+    if not args.input_file:
+        sys.stderr.write("Input file must be set for building of index!\n")
+        sys.stderr.write("Use '--help' to see '-f' option!\n")
+        return 1
+
+    try:
+        input_file = compressedFiles.open_file(args.input_file, "r")
+        row_count, point_count = build_index(
+            input_file,
+            args.output_file or get_index_path(args.input_file),
+            args.cell_size,
+            args.latitude_column,
+            args.longitude_column,
+        )
+        input_file.close()
+    except (IOError, ValueError):
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to build spatial index! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+    print(f"Rows: {row_count}, indexed points: {point_count}")
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
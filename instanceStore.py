@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: instanceStore.py
+# Project: wikidata2
+# Description: Compact store of instance - class relations used by ClassRelationsBuilder.
+#              Instances of each class are appended to array('Q') of numeric entity ids (see
+#              parseJson2.encode_entity_id()) without any checks, duplicates are removed at once by sort
+#              and unique before the relations are saved or read, so adding of instance takes constant time
+#              regardless of number of instances of the class.
+#              Relations are saved in binary format:
+#                header (magic, byte order, number of classes)
+#                for each class (sorted by class id): length of class id, number of instances,
+#                                                     UTF-8 class id, sorted instance ids (uint64)
+#              Json dumps of instance relations are still loaded.
+
+import json  # json dumps
+import struct  # binary format
+import sys  # byte order
+from array import array  # numeric instance ids
+
+import parseJson2  # entity id encoding, shards
+
+# magic bytes at the beginning of the binary dump
+MAGIC = b"WDINST1\0"
+# header: magic, byte order (b/l), padding, number of classes
+HEADER = struct.Struct("=8sc7xQ")
+# header of class: length of UTF-8 class id, number of instances
+CLASS_HEADER = struct.Struct("=IQ")
+
+
+class InstanceStore:
+    """
+    Instances of classes stored as arrays of numeric entity ids.
+    """
+
+    def __init__(self):
+        self.classes = {}  # class id -> array of numeric ids of instances
+        self.deduplicated = True  # arrays are sorted and contain each instance once
+
+    @classmethod
+    def from_dict(cls, instances):
+        """
+        Creates store from dictionary of instance relations (json dump).
+        :param instances: dictionary {class id: [instance id, ...]}
+        :raise ValueError if any instance id is not wikidata entity id
+        :return: InstanceStore instance
+        """
+        store = cls()
+        store.merge_dict(instances)
+        return store
+
+    def add(self, instance_id, class_id):
+        """
+        Adds instance of class.
+        :param instance_id: id of instance entity
+        :param class_id: id of class
+        :raise ValueError if instance id is not wikidata entity id
+        """
+        numbers = self.classes.get(class_id)
+        if numbers is None:
+            numbers = self.classes[class_id] = array("Q")
+        numbers.append(parseJson2.encode_entity_id(instance_id))
+        self.deduplicated = False
+
+    def extend(self, class_id, numbers):
+        """
+        Adds instances of class.
+        :param class_id: id of class
+        :param numbers: numeric ids of instances
+        """
+        existing = self.classes.get(class_id)
+        if existing is None:
+            self.classes[class_id] = array("Q", numbers)
+        else:
+            existing.extend(numbers)
+        self.deduplicated = False
+
+    def merge(self, store):
+        """
+        Adds all relations of other store.
+        :param store: InstanceStore instance
+        """
+        for class_id, numbers in store.classes.items():
+            self.extend(class_id, numbers)
+
+    def merge_dict(self, instances):
+        """
+        Adds relations from dictionary of instance relations (json dump).
+        :param instances: dictionary {class id: [instance id, ...]}
+        :raise ValueError if any instance id is not wikidata entity id
+        """
+        for class_id, instance_ids in instances.items():
+            self.extend(class_id, map(parseJson2.encode_entity_id, instance_ids))
+
+    def remove_class(self, class_id):
+        """
+        Removes class and all its instances.
+        :param class_id: id of class
+        """
+        self.classes.pop(class_id, None)
+
+    def remove(self, instance_id, class_id):
+        """
+        Removes instance of class.
+        :param instance_id: id of instance entity
+        :param class_id: id of class
+        """
+        numbers = self.classes.get(class_id)
+        if numbers:
+            try:
+                number = parseJson2.encode_entity_id(instance_id)
+            except ValueError:  # id can't be in the store
+                return
+            self.classes[class_id] = array("Q", (n for n in numbers if n != number))
+
+    def deduplicate(self):
+        """
+        Sorts instances of each class and removes duplicates.
+        """
+        if self.deduplicated:
+            return
+        for class_id, numbers in self.classes.items():
+            self.classes[class_id] = array("Q", sorted(set(numbers)))
+        self.deduplicated = True
+
+    def items(self):
+        """
+        :return: generator of (class id, array of sorted numeric ids of instances) sorted by class id
+        """
+        self.deduplicate()
+        for class_id in sorted(self.classes):
+            yield class_id, self.classes[class_id]
+
+    def get_instances(self, class_id):
+        """
+        :param class_id: id of class
+        :return: list of ids of instances sorted by their numeric ids (empty for unknown class)
+        """
+        self.deduplicate()
+        return list(map(parseJson2.decode_entity_id, self.classes.get(class_id, ())))
+
+    def count_instances(self, class_id):
+        """
+        :param class_id: id of class
+        :return: number of instances of class (zero for unknown class)
+        """
+        self.deduplicate()
+        return len(self.classes.get(class_id, ()))
+
+    def __contains__(self, class_id):
+        return class_id in self.classes
+
+    def __len__(self):
+        return len(self.classes)
+
+    def to_dict(self):
+        """
+        :return: dictionary of instance relations {class id: [instance id, ...]}
+        """
+        return {
+            class_id: list(map(parseJson2.decode_entity_id, numbers))
+            for class_id, numbers in self.items()
+        }
+
+    def split(self, shards):
+        """
+        Partitions instances to shards by their ids in one pass (see parseJson2.get_entity_shard()).
+        :param shards: number of shards
+        :return: list of InstanceStore instances, one per shard
+        """
+        self.deduplicate()
+        stores = [InstanceStore() for _ in range(shards)]
+        for class_id, numbers in self.classes.items():
+            parts = [array("Q") for _ in range(shards)]
+            for number in numbers:
+                shard = parseJson2.get_entity_shard(parseJson2.decode_entity_id(number), shards)
+                parts[shard].append(number)
+            for store, part in zip(stores, parts):
+                if part:
+                    store.classes[class_id] = part
+        return stores
+
+    def save(self, file):
+        """
+        Writes instance relations to binary file.
+        :param file: file opened in binary mode
+        :raise IOError if fails to write to file
+        """
+        classes = [(class_id, numbers) for class_id, numbers in self.items() if numbers]
+
+        file.write(HEADER.pack(MAGIC, b"l" if sys.byteorder == "little" else b"b", len(classes)))
+        for class_id, numbers in classes:
+            encoded_id = class_id.encode("utf-8")
+            file.write(CLASS_HEADER.pack(len(encoded_id), len(numbers)))
+            file.write(encoded_id)
+            numbers.tofile(file)
+
+    def load(self, file):
+        """
+        Adds relations from binary file or json dump.
+        :param file: file opened in binary mode
+        :raise IOError if fails to read from file or file is truncated
+        :raise ValueError if file is not instance relations dump or has different byte order
+        """
+
+        def read(size):
+            data = file.read(size)
+            if len(data) != size:
+                raise IOError("Instance relations dump is truncated!")
+            return data
+
+        head = file.read(HEADER.size)
+        if not head.startswith(MAGIC):  # json dump
+            self.merge_dict(json.loads(head + file.read()))
+            return
+        _, byte_order, class_count = HEADER.unpack(head)
+        if byte_order != (b"l" if sys.byteorder == "little" else b"b"):
+            raise ValueError("Byte order of instance relations dump differs from this machine!")
+        for _ in range(class_count):
+            length, count = CLASS_HEADER.unpack(read(CLASS_HEADER.size))
+            class_id = read(length).decode("utf-8")
+            numbers = array("Q")
+            numbers.frombytes(read(count * 8))
+            self.extend(class_id, numbers)
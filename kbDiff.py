@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: kbDiff.py
+# Project: wikidata2
+# Description: Computes difference between two versions of KB (per-type tsv files or KB.tsv created by mkkb.sh).
+#              Rows of both versions are sorted by entity id by external sort and compared in one streaming
+#              pass, so only sorted runs are kept in memory.
+#              Output contains one change per line:
+#                + <row>                         added row
+#                - <row>                         removed row
+#                ~ <changed columns> <row>       modified row (new version), changed columns are comma
+#                                                separated 0-based indices of columns
+#              Header of KB (VERSION line and HEAD) is not compared.
+
+import argparse
+import os  # filesystem
+import sys  # stdout, stderr, exit
+import traceback  # for printing exceptions
+from itertools import groupby  # rows of one entity
+
+import compressedFiles  # compressed input and output files
+import externalSort  # sorting of rows which do not fit into memory
+import kbStore  # reading of KB header, entity id keys
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# change markers in output
+ADDED = "+"
+REMOVED = "-"
+MODIFIED = "~"
+# sort key of rows with ids which are not wikidata entity ids (sorted after all entities by id string)
+INVALID_ID_KEY = 1 << 64
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Computes difference between two versions of KB."
+    )
+    argparser.add_argument(
+        "-a",
+        "--old-file",
+        help="Old version of KB in tsv format (may be compressed).",
+        required=True,
+    )
+    argparser.add_argument(
+        "-b",
+        "--new-file",
+        help="New version of KB in tsv format (may be compressed).",
+        required=True,
+    )
+    argparser.add_argument(
+        "-o",
+        "--output-file",
+        help="Output file with changes (default: standard output).",
+    )
+    argparser.add_argument(
+        "--compression",
+        help="Compression of output file (default: OUTPUT_COMPRESSION environment variable or none).",
+        choices=list(compressedFiles.COMPRESSION_SUFFIXES),
+    )
+    argparser.add_argument(
+        "--temp-dir",
+        help="Directory for temporary files (default: system default).",
+    )
+    argparser.add_argument(
+        "--run-size",
+        help="Number of rows sorted in memory at once (default=%(default)s).",
+        type=int,
+        default=externalSort.DEFAULT_RUN_SIZE,
+    )
+    return argparser.parse_args()
+
+
+def get_sort_key(record):
+    """
+    Returns sort key of row record.
+    :param record: (numeric id, id, row) tuple of strings
+    :return: (numeric id, id) tuple
+    """
+    return int(record[0]), record[1]
+
+
+def sort_rows(file, run_size=externalSort.DEFAULT_RUN_SIZE, temp_dir=None):
+    """
+    Sorts rows of KB by entity id.
+    :param file: opened KB in tsv format
+    :param run_size: number of rows sorted in memory at once
+    :param temp_dir: directory for temporary files (None = system default)
+    :raise IOError if fails to read or write
+    :return: generator of sorted (numeric id, id, row) tuples
+    """
+    _, rows = kbStore.read_kb(file)
+
+    def records():
+        for entity_id, line in rows:
+            try:
+                key = kbStore.get_row_key(entity_id)
+            except ValueError:
+                key = INVALID_ID_KEY
+            yield str(key), entity_id, line
+
+    return externalSort.external_sort(
+        records(), key=get_sort_key, run_size=run_size, temp_dir=temp_dir, fields=3
+    )
+
+
+def get_changed_columns(old_row, new_row):
+    """
+    Compares fields of two rows.
+    :param old_row: old version of the row (tsv line)
+    :param new_row: new version of the row (tsv line)
+    :return: list of indices of changed columns (added or removed columns at the end are changed too)
+    """
+    old_fields = old_row.split("\t")
+    new_fields = new_row.split("\t")
+    changed = [
+        i
+        for i, (old_value, new_value) in enumerate(zip(old_fields, new_fields))
+        if old_value != new_value
+    ]
+    changed.extend(
+        range(min(len(old_fields), len(new_fields)), max(len(old_fields), len(new_fields)))
+    )
+    return changed
+
+
+def diff_entity(old_rows, new_rows):
+    """
+    Compares rows of one entity id.
+    Rows present in both versions are unchanged, remaining rows are paired in order as modified
+    and unpaired rows are added or removed.
+    :param old_rows: rows of old version
+    :param new_rows: rows of new version
+    :return: generator of changes as (marker, row, changed columns) tuples
+    """
+    if len(old_rows) == 1 and len(new_rows) == 1:  # common case
+        if old_rows[0] != new_rows[0]:
+            yield MODIFIED, new_rows[0], get_changed_columns(old_rows[0], new_rows[0])
+        return
+
+    unmatched = list(new_rows)
+    removed = []
+    for row in old_rows:
+        if row in unmatched:
+            unmatched.remove(row)
+        else:
+            removed.append(row)
+    for old_row, new_row in zip(removed, unmatched):
+        yield MODIFIED, new_row, get_changed_columns(old_row, new_row)
+    for row in removed[len(unmatched) :]:
+        yield REMOVED, row, None
+    for row in unmatched[len(removed) :]:
+        yield ADDED, row, None
+
+
+def diff_kb(old_file, new_file, run_size=externalSort.DEFAULT_RUN_SIZE, temp_dir=None):
+    """
+    Computes difference between two versions of KB.
+    :param old_file: opened old version of KB in tsv format
+    :param new_file: opened new version of KB in tsv format
+    :param run_size: number of rows sorted in memory at once
+    :param temp_dir: directory for temporary files (None = system default)
+    :raise IOError if fails to read or write
+    :return: generator of changes as (marker, row, changed columns) tuples in order of entity ids,
+             changed columns are None for added and removed rows
+    """
+    old_groups = groupby(sort_rows(old_file, run_size, temp_dir), key=get_sort_key)
+    new_groups = groupby(sort_rows(new_file, run_size, temp_dir), key=get_sort_key)
+    old_key, old_group = next(old_groups, (None, None))
+    new_key, new_group = next(new_groups, (None, None))
+
+    while old_key is not None or new_key is not None:
+        if new_key is None or (old_key is not None and old_key < new_key):
+            for record in old_group:
+                yield REMOVED, record[2], None
+            old_key, old_group = next(old_groups, (None, None))
+        elif old_key is None or new_key < old_key:
+            for record in new_group:
+                yield ADDED, record[2], None
+            new_key, new_group = next(new_groups, (None, None))
+        else:
+            yield from diff_entity(
+                [record[2] for record in old_group], [record[2] for record in new_group]
+            )
+            old_key, old_group = next(old_groups, (None, None))
+            new_key, new_group = next(new_groups, (None, None))
+
+
+def main():
+    args = get_args()
+
+    counts = {ADDED: 0, REMOVED: 0, MODIFIED: 0}
+    try:
+        old_file = compressedFiles.open_file(args.old_file, "r")
+        new_file = compressedFiles.open_file(args.new_file, "r")
+        if args.output_file:
+            output = compressedFiles.open_file(args.output_file, "w", args.compression)
+        else:
+            output = sys.stdout
+        for marker, row, changed in diff_kb(
+            old_file, new_file, args.run_size, args.temp_dir
+        ):
+            counts[marker] += 1
+            if changed is None:
+                output.write(marker + "\t" + row + "\n")
+            else:
+                output.write(
+                    marker + "\t" + ",".join(map(str, changed)) + "\t" + row + "\n"
+                )
+        if output is not sys.stdout:
+            output.close()
+        old_file.close()
+        new_file.close()
+    except (IOError, ValueError):
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to compute difference of KBs! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+
+    sys.stderr.write(
+        f"Added: {counts[ADDED]}, removed: {counts[REMOVED]}, modified: {counts[MODIFIED]}\n"
+    )
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: kbStore.py
+# Project: wikidata2
+# Description: Packs KB (KB.tsv created by mkkb.sh) to random-access store and reads rows from it by entity id.
+#              Rows are sorted by numeric entity id and stored in compressed blocks. Store contains sparse
+#              index with the first id of each block and optional Bloom filter of all ids, so a row is found
+#              by binary search in the index and one block read. Store is memory mapped, opening it does
+#              not read the rows.
+
+import argparse
+import json  # metadata of store
+import mmap  # memory mapped store
+import os  # filesystem
+import struct  # file header
+import sys  # stdout, stderr, exit, byte order
+import traceback  # for printing exceptions
+import zlib  # block compression
+from array import array  # block index and Bloom filter
+from bisect import bisect_left, bisect_right  # search in block index
+from collections import OrderedDict  # cache of decompressed blocks
+from math import ceil, log  # size of Bloom filter
+
+import compressedFiles  # compressed input files
+import externalSort  # sorting of rows which do not fit into memory
+import parseJson2  # entity id encoding
+
+try:
+    import zstandard  # zstd block compression
+except ImportError:
+    zstandard = None  # zlib is used instead
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# magic bytes at the beginning of the store
+MAGIC = b"WDKBSST1"
+# header: magic, byte order (b/l), compression, padding, number of rows, number of blocks,
+#         offset of block index, number of bits of Bloom filter, number of Bloom hash functions,
+#         offset of Bloom filter, offset and length of metadata
+HEADER = struct.Struct("=8scc6xQQQQQQQQ")
+# block compression codes stored in header
+COMPRESSIONS = {"none": b"n", "zlib": b"z", "zstd": b"s"}
+# default size of uncompressed block
+DEFAULT_BLOCK_SIZE = 64 * 1024
+# default false positive rate of Bloom filter
+DEFAULT_BLOOM_ERROR_RATE = 0.01
+# number of decompressed blocks kept in memory by reader
+BLOCK_CACHE_SIZE = 16
+# lines of KB before the first row (see mkkb.sh and merge_KB/HEAD)
+HEADER_LINE_PREFIXES = ("VERSION=", "<")
+# mask of 64bit arithmetic in hash function
+UINT64_MASK = (1 << 64) - 1
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Packs KB to random-access store and reads rows from it."
+    )
+    argparser.add_argument(
+        "-f",
+        "--input-file",
+        help="KB in tsv format to pack (may be compressed).",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output-file",
+        help="Output store.",
+    )
+    argparser.add_argument(
+        "--block-size",
+        help="Size of uncompressed block in bytes (default=%(default)s).",
+        type=int,
+        default=DEFAULT_BLOCK_SIZE,
+    )
+    argparser.add_argument(
+        "--compression",
+        help="Compression of blocks (default: zstd if zstandard module is available, zlib otherwise).",
+        choices=["auto"] + list(COMPRESSIONS),
+        default="auto",
+    )
+    argparser.add_argument(
+        "--bloom",
+        help="Store Bloom filter of ids (lookups of missing ids do not read any block).",
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--bloom-error-rate",
+        help="False positive rate of Bloom filter (default=%(default)s).",
+        type=float,
+        default=DEFAULT_BLOOM_ERROR_RATE,
+    )
+    argparser.add_argument(
+        "--temp-dir",
+        help="Directory for temporary files (default: directory of output file).",
+    )
+    argparser.add_argument(
+        "--run-size",
+        help="Number of rows sorted in memory at once (default=%(default)s).",
+        type=int,
+        default=externalSort.DEFAULT_RUN_SIZE,
+    )
+    argparser.add_argument(
+        "-r",
+        "--read",
+        help="Store to read, rows are printed in tsv format.",
+    )
+    argparser.add_argument(
+        "-g",
+        "--get",
+        help="Ids of entities to print (with or without type prefix, e.g. Q42 or p:Q42).",
+        nargs="+",
+        default=[],
+    )
+    argparser.add_argument(
+        "--range",
+        help="Print rows with ids from START (inclusive) to END (exclusive), '-' means unbounded.",
+        nargs=2,
+        metavar=("START", "END"),
+    )
+    return argparser.parse_args()
+
+
+def get_bare_id(entity_id):
+    """
+    Removes type prefix from entity id (e.g. p:Q42 -> Q42).
+    :param entity_id: entity id with or without prefix
+    :return: entity id without prefix
+    """
+    return entity_id.rsplit(":", 1)[-1]
+
+
+def get_row_key(entity_id):
+    """
+    Returns sort key of KB row.
+    :param entity_id: entity id with or without type prefix
+    :raise ValueError if id is not wikidata entity id
+    :return: numeric entity id
+    """
+    return parseJson2.encode_entity_id(get_bare_id(entity_id))
+
+
+def get_bloom_hashes(key, bits, hashes):
+    """
+    Computes bit positions of key in Bloom filter (double hashing of 64bit mix of key).
+    :param key: numeric entity id
+    :param bits: number of bits of filter
+    :param hashes: number of hash functions
+    :return: generator of bit positions
+    """
+    # splitmix64 finalizer
+    key = (key + 0x9E3779B97F4A7C15) & UINT64_MASK
+    key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & UINT64_MASK
+    key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & UINT64_MASK
+    key ^= key >> 31
+    first = key & 0xFFFFFFFF
+    second = (key >> 32) | 1
+    for i in range(hashes):
+        yield (first + i * second) % bits
+
+
+def get_compressor(compression):
+    """
+    Returns block compression function.
+    :param compression: none/zlib/zstd
+    :raise ValueError if zstd is requested but zstandard module is not available
+    :return: function bytes -> bytes
+    """
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Zstd compression of blocks requires zstandard module!")
+        return zstandard.ZstdCompressor(level=3).compress
+    if compression == "zlib":
+        return lambda data: zlib.compress(data, 6)
+    return bytes
+
+
+def get_decompressor(compression):
+    """
+    Returns block decompression function.
+    :param compression: none/zlib/zstd
+    :raise ValueError if zstd is used but zstandard module is not available
+    :return: function bytes -> bytes
+    """
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Zstd compressed store requires zstandard module!")
+        return zstandard.ZstdDecompressor().decompress
+    if compression == "zlib":
+        return zlib.decompress
+    return bytes
+
+
+def read_kb(file):
+    """
+    Splits KB to header (VERSION line and HEAD) and rows.
+    :param file: opened KB in tsv format
+    :raise IOError if fails to read from file
+    :return: (header lines, generator of rows), rows are (id, line) tuples in file order
+    """
+    header = []
+    line = file.readline()
+    while line and (line == "\n" or line.startswith(HEADER_LINE_PREFIXES)):
+        header.append(line.rstrip("\n"))
+        line = file.readline()
+
+    def rows(line):
+        while line:
+            line = line.rstrip("\n")
+            if line:
+                yield line.split("\t", 1)[0], line
+            line = file.readline()
+
+    return header, rows(line)
+
+
+def pack_kb(
+    file,
+    output_path,
+    block_size=DEFAULT_BLOCK_SIZE,
+    compression="auto",
+    bloom_error_rate=None,
+    run_size=externalSort.DEFAULT_RUN_SIZE,
+    temp_dir=None,
+):
+    """
+    Packs KB to store.
+    Rows with equal ids keep their order from KB and are always stored in the same block.
+    Rows with ids which are not wikidata entity ids are skipped.
+    :param file: opened KB in tsv format
+    :param output_path: path to the store
+    :param block_size: size of uncompressed block in bytes
+    :param compression: auto/none/zlib/zstd
+    :param bloom_error_rate: false positive rate of Bloom filter (None = no filter)
+    :param run_size: number of rows sorted in memory at once
+    :param temp_dir: directory for temporary files (None = directory of output file)
+    :raise IOError if fails to read or write
+    :raise ValueError if compression is not available
+    :return: (number of stored rows, number of skipped rows)
+    """
+    if compression == "auto":
+        compression = "zstd" if zstandard is not None else "zlib"
+    compress = get_compressor(compression)
+    if temp_dir is None:
+        temp_dir = os.path.dirname(os.path.abspath(output_path))
+
+    header, rows = read_kb(file)
+    skipped = 0
+
+    def records():
+        nonlocal skipped
+        for entity_id, line in rows:
+            try:
+                key = get_row_key(entity_id)
+            except ValueError:
+                skipped += 1
+                continue
+            yield str(key), line
+
+    first_keys = array("Q")
+    offsets = array("Q")
+    keys = array("Q")  # distinct ids for Bloom filter
+    count = 0
+    with open(output_path, "wb") as output:
+        output.write(b"\0" * HEADER.size)  # header is written when offsets are known
+        offset = HEADER.size
+        block = []
+        block_bytes = 0
+        previous = None
+
+        def write_block():
+            nonlocal offset, block, block_bytes
+            data = compress(("\n".join(block) + "\n").encode("utf-8"))
+            offsets.append(offset)
+            offset += output.write(data)
+            block = []
+            block_bytes = 0
+
+        for key, line in externalSort.external_sort(
+            records(),
+            key=lambda record: int(record[0]),
+            run_size=run_size,
+            temp_dir=temp_dir,
+            fields=2,
+        ):
+            key = int(key)
+            if key != previous:
+                # rows of one id are never split between blocks
+                if block_bytes >= block_size:
+                    write_block()
+                if not block:
+                    first_keys.append(key)
+                if bloom_error_rate is not None:
+                    keys.append(key)
+                previous = key
+            block.append(line)
+            block_bytes += len(line) + 1
+            count += 1
+        if block:
+            write_block()
+        offsets.append(offset)  # end of the last block
+
+        index_offset = offset
+        first_keys.tofile(output)
+        offsets.tofile(output)
+        offset += (len(first_keys) + len(offsets)) * first_keys.itemsize
+
+        bloom_bits = bloom_hashes = 0
+        bloom_offset = offset
+        if bloom_error_rate is not None and keys:
+            bloom_bits = max(
+                64, ceil(-len(keys) * log(bloom_error_rate) / (log(2) ** 2))
+            )
+            bloom_bits = (bloom_bits + 63) // 64 * 64
+            bloom_hashes = max(1, round(bloom_bits / len(keys) * log(2)))
+            bloom = bytearray(bloom_bits // 8)
+            for key in keys:
+                for bit in get_bloom_hashes(key, bloom_bits, bloom_hashes):
+                    bloom[bit >> 3] |= 1 << (bit & 7)
+            offset += output.write(bloom)
+        del keys
+
+        metadata = json.dumps(
+            {"header": header, "compression": compression, "block_size": block_size}
+        ).encode("utf-8")
+        metadata_offset = offset
+        output.write(metadata)
+
+        output.seek(0)
+        output.write(
+            HEADER.pack(
+                MAGIC,
+                b"l" if sys.byteorder == "little" else b"b",
+                COMPRESSIONS[compression],
+                count,
+                len(first_keys),
+                index_offset,
+                bloom_bits,
+                bloom_hashes,
+                bloom_offset,
+                metadata_offset,
+                len(metadata),
+            )
+        )
+    return count, skipped
+
+
+class KBStore:
+    """
+    Read-only KB store with access to rows by entity id.
+    """
+
+    def __init__(self, path, cache_size=BLOCK_CACHE_SIZE):
+        """
+        Maps store to memory and loads its metadata.
+        :param path: path to the store
+        :param cache_size: number of decompressed blocks kept in memory
+        :raise IOError if fails to open file
+        :raise ValueError if file is not KB store, has different byte order or compression is not available
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            byte_order,
+            compression,
+            self.rows,
+            self.block_count,
+            index_offset,
+            self.bloom_bits,
+            self.bloom_hashes,
+            bloom_offset,
+            metadata_offset,
+            metadata_length,
+        ) = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not KB store!")
+        if byte_order != (b"l" if sys.byteorder == "little" else b"b"):
+            raise ValueError(f"Byte order of {path} differs from byte order of this machine!")
+
+        metadata = json.loads(
+            self.mmap[metadata_offset : metadata_offset + metadata_length].decode("utf-8")
+        )
+        self.header = metadata["header"]
+        self.compression = metadata["compression"]
+        if COMPRESSIONS.get(self.compression) != compression:
+            raise ValueError(f"Unknown compression of {path}!")
+        self.decompress = get_decompressor(self.compression)
+
+        self.view = memoryview(self.mmap)
+        offsets_start = index_offset + self.block_count * 8
+        self.first_keys = self.view[index_offset:offsets_start].cast("Q")
+        self.offsets = self.view[
+            offsets_start : offsets_start + (self.block_count + 1) * 8
+        ].cast("Q")
+        self.bloom = (
+            self.view[bloom_offset : bloom_offset + self.bloom_bits // 8]
+            if self.bloom_bits
+            else None
+        )
+        self.cache_size = cache_size
+        self.block_cache = OrderedDict()
+
+    def might_contain(self, key):
+        """
+        Tells if store might contain id (Bloom filter test).
+        :param key: numeric entity id
+        :return: False if id is certainly not in store
+        """
+        if self.bloom is None:
+            return True
+        for bit in get_bloom_hashes(key, self.bloom_bits, self.bloom_hashes):
+            if not self.bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def read_block(self, index):
+        """
+        Reads and decompresses block.
+        :param index: index of the block
+        :return: list of (numeric id, row) tuples
+        """
+        rows = self.block_cache.get(index)
+        if rows is not None:
+            self.block_cache.move_to_end(index)
+            return rows
+
+        data = self.decompress(
+            self.mmap[self.offsets[index] : self.offsets[index + 1]]
+        ).decode("utf-8")
+        rows = []
+        for line in data.split("\n")[:-1]:
+            rows.append((get_row_key(line.split("\t", 1)[0]), line))
+        self.block_cache[index] = rows
+        if len(self.block_cache) > self.cache_size:
+            self.block_cache.popitem(last=False)
+        return rows
+
+    def get_all(self, entity_id):
+        """
+        Finds all rows of entity.
+        If id contains type prefix (e.g. p:Q42), rows with different prefix are not returned.
+        :param entity_id: entity id with or without type prefix
+        :return: list of rows (tsv lines without newline)
+        """
+        try:
+            key = get_row_key(entity_id)
+        except ValueError:
+            return []
+        if not self.block_count or not self.might_contain(key):
+            return []
+        index = bisect_right(self.first_keys, key) - 1
+        if index < 0:
+            return []
+
+        rows = self.read_block(index)
+        start = bisect_left(rows, (key,))
+        prefixed = ":" in entity_id
+        result = []
+        for row_key, row in rows[start:]:
+            if row_key != key:
+                break
+            row_id = row.split("\t", 1)[0]
+            if prefixed and ":" in row_id and row_id != entity_id:
+                continue
+            result.append(row)
+        return result
+
+    def get(self, entity_id, default=None):
+        """
+        Finds row of entity (the first one if entity has more rows).
+        :param entity_id: entity id with or without type prefix
+        :param default: value returned if entity is not in store
+        :return: row (tsv line without newline) or default
+        """
+        rows = self.get_all(entity_id)
+        return rows[0] if rows else default
+
+    def get_fields(self, entity_id):
+        """
+        Finds row of entity and splits it to fields.
+        :param entity_id: entity id with or without type prefix
+        :return: list of fields, None if entity is not in store
+        """
+        row = self.get(entity_id)
+        return row.split("\t") if row is not None else None
+
+    def __contains__(self, entity_id):
+        return bool(self.get_all(entity_id))
+
+    def __len__(self):
+        return self.rows
+
+    def scan(self, start_id=None, end_id=None):
+        """
+        Iterates over rows in order of numeric entity ids.
+        :param start_id: the first id of range (inclusive, None = from the beginning)
+        :param end_id: the last id of range (exclusive, None = to the end)
+        :raise ValueError if range boundary is not wikidata entity id
+        :return: generator of rows (tsv lines without newline)
+        """
+        start_key = get_row_key(start_id) if start_id is not None else None
+        end_key = get_row_key(end_id) if end_id is not None else None
+        index = 0
+        if start_key is not None:
+            index = max(0, bisect_right(self.first_keys, start_key) - 1)
+        for index in range(index, self.block_count):
+            if end_key is not None and self.first_keys[index] >= end_key:
+                return
+            for key, row in self.read_block(index):
+                if start_key is not None and key < start_key:
+                    continue
+                if end_key is not None and key >= end_key:
+                    return
+                yield row
+
+    def __iter__(self):
+        return self.scan()
+
+    def close(self):
+        """
+        Unmaps the store.
+        """
+        self.block_cache.clear()
+        self.first_keys.release()
+        self.offsets.release()
+        if self.bloom is not None:
+            self.bloom.release()
+        self.view.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def main():
+    args = get_args()
+
+    if args.read:
+        try:
+            with KBStore(args.read) as store:
+                for entity_id in args.get:
+                    rows = store.get_all(entity_id)
+                    if not rows:
+                        sys.stderr.write(f"Entity {entity_id} is not in KB!\n")
+                    for row in rows:
+                        sys.stdout.write(row + "\n")
+                if args.range:
+                    start_id, end_id = (None if i == "-" else i for i in args.range)
+                    for row in store.scan(start_id, end_id):
+                        sys.stdout.write(row + "\n")
+        except (IOError, ValueError):
+            sys.stderr.write(
+                SCRIPT_NAME
+                + ": Failed to read KB store! Handled error:\n"
+                + str(traceback.format_exc())
+                + "\n"
+            )
+            return 1
+        return 0
+
+    if not args.input_file or not args.output_file:
+        sys.stderr.write("Input file and output file must be set for packing!\n")
+        sys.stderr.write("Use '--help' to see '-f' and '-o' options!\n")
+        return 1
+
+    try:
+        input_file = compressedFiles.open_file(args.input_file, "r")
+        count, skipped = pack_kb(
+            input_file,
+            args.output_file,
+            args.block_size,
+            args.compression,
+            args.bloom_error_rate if args.bloom else None,
+            args.run_size,
+            args.temp_dir,
+        )
+        input_file.close()
+    except (IOError, ValueError):
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to pack KB! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+    print(f"Rows in store: {count}")
+    if skipped:
+        sys.stderr.write(f"Skipped rows with invalid ids: {skipped}\n")
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: localPipeline.py
+# Project: wikidata2
+# Description: Runs whole extraction of wikidata dump on a single machine.
+#              Performs the same stages as start_extraction.sh (parsing, collection, name substitution,
+#              instance expansion and merge), but each stage is recorded in stage cache (see stageCache.py)
+#              and skipped on rerun if its inputs, tools and parameters did not change.
+
+import argparse
+import glob  # merge configuration files
+import os  # filesystem, environment
+import shutil  # concatenation of files
+import subprocess  # stage commands
+import sys  # stderr, exit, python interpreter
+import traceback  # for printing exceptions
+from concurrent.futures import ThreadPoolExecutor  # stages of parts run in parallel
+
+import compressedFiles  # compression suffixes
+import geoIndex  # path to spatial index
+import stageCache  # skipping of up to date stages
+import temporalIndex  # paths to temporal indexes, dated types
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+# folder with project scripts
+PROJECT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# modules imported by all python tools
+COMMON_TOOLS = [
+    "parseJson2.py",
+    "compressedFiles.py",
+    "nameDictionary.py",
+    "externalSort.py",
+]
+# class relations builder with its modules
+CLASS_TOOLS = ["classRelationsBuilder.py", "classGraph.py", "instanceStore.py"]
+# types which are written with ids without type prefix, as merge tools expect them (see start_parsing_parallel.sh)
+MERGED_TYPES = [
+    "person",
+    "group",
+    "person+artist",
+    "geographical",
+    "event",
+    "organization",
+    "artwork",
+]
+# size of blocks copied when files are concatenated
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Extracts KB from wikidata dump on single machine, skips stages that are up to date."
+    )
+    argparser.add_argument(
+        "-d",
+        "--dump-dir",
+        help="Directory with parts of wikidata json dump (*.part????). Its name is used as dump name.",
+        required=True,
+    )
+    argparser.add_argument(
+        "-g", "--lang", help="Language of the KB (default=%(default)s).", default="cs"
+    )
+    argparser.add_argument(
+        "-t",
+        "--tag",
+        help="Tag of outputs of this extraction (default=%(default)s).",
+        default="default",
+    )
+    argparser.add_argument(
+        "-w",
+        "--work-dir",
+        help="Directory for intermediate files (default: /tmp/$USER/DUMP/LANG/TAG/local_pipeline).",
+    )
+    argparser.add_argument(
+        "--cache-dir",
+        help="Directory with stage manifests (default: WORK_DIR/stage_cache).",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of parts processed in parallel (default=%(default)s).",
+        type=int,
+        default=6,
+    )
+    argparser.add_argument(
+        "--merge",
+        help="Merge extracted KB (with entity_kb_czech9 for czech, see merge_KB/start_merge.sh).",
+        default=False,
+        action="store_true",
+    )
+    argparser.add_argument(
+        "-f",
+        "--force",
+        help="Run all stages even if they are up to date.",
+        default=False,
+        action="store_true",
+    )
+    return argparser.parse_args()
+
+
+def load_env_variables(path=os.path.join(PROJECT_FOLDER, "env_variables.cfg")):
+    """
+    Sets variables from env_variables.cfg to environment (variables already set are kept).
+    :param path: path to the configuration file
+    :raise IOError if fails to read from file
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#") and "=" in line:
+                name, value = line.split("=", 1)
+                os.environ.setdefault(name, value)
+
+
+def get_tools(*scripts):
+    """
+    Returns paths to scripts of the stage including modules used by all tools.
+    :param scripts: names of scripts in project folder
+    :return: list of paths
+    """
+    return [os.path.join(PROJECT_FOLDER, script) for script in list(scripts) + COMMON_TOOLS]
+
+
+def python_command(script, *args):
+    """
+    Returns command running python script from project folder.
+    :param script: name of the script
+    :param args: arguments of the script
+    :return: command (list of arguments)
+    """
+    return [sys.executable, os.path.join(PROJECT_FOLDER, script)] + [str(a) for a in args]
+
+
+def concatenate_files(paths, output_path):
+    """
+    Concatenates files (concatenated gzip/zstd files are valid compressed files too).
+    :param paths: paths to files to concatenate
+    :param output_path: path to the output file
+    :raise IOError if fails to read or write
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "wb") as output:
+        for path in paths:
+            with open(path, "rb") as file:
+                shutil.copyfileobj(file, output, COPY_BUFFER_SIZE)
+
+
+class LocalPipeline:
+    """
+    Extraction of KB from wikidata dump with cached stages.
+    """
+
+    def __init__(
+        self, dump_dir, lang, tag, work_dir=None, cache_dir=None, jobs=6, force=False
+    ):
+        """
+        Initializes pipeline paths.
+        :param dump_dir: directory with parts of wikidata json dump
+        :param lang: language of the KB
+        :param tag: tag of outputs
+        :param work_dir: directory for intermediate files (None = default)
+        :param cache_dir: directory with stage manifests (None = WORK_DIR/stage_cache)
+        :param jobs: number of parts processed in parallel
+        :param force: run all stages even if they are up to date
+        :raise OSError if fails to create cache directory
+        """
+        self.dump_dir = os.path.abspath(dump_dir)
+        self.dump_name = os.path.basename(self.dump_dir.rstrip("/"))
+        self.lang = lang
+        self.tag = tag
+        self.jobs = jobs
+        self.force = force
+        self.compression = compressedFiles.get_default_compression()
+        self.suffix = compressedFiles.get_compression_suffix(self.compression)
+
+        base_dir = os.path.join(
+            "/tmp", os.environ.get("USER", "wikidata2"), self.dump_name, lang, tag
+        )
+        self.work_dir = work_dir if work_dir else os.path.join(base_dir, "local_pipeline")
+        self.cache = stageCache.StageCache(
+            cache_dir if cache_dir else os.path.join(self.work_dir, "stage_cache")
+        )
+        self.parts_dir = os.path.join(self.work_dir, "parts")
+        self.collected_dir = os.path.join(self.work_dir, "collected")
+        self.dict_path = os.path.join(self.collected_dir, "dict.bin")
+        self.classes_path = os.path.join(
+            self.collected_dir, f"classes_full.json{self.suffix}"
+        )
+        # binary class relations dump shared by expanding stages (not compressed, see classGraph.py)
+        self.class_graph_path = os.path.join(self.collected_dir, "classes_full.bin")
+        self.expanded_dir = os.path.join(self.work_dir, "expanded")
+        # the same output folders as used by shell scripts (see wikidata_lib.sh)
+        self.out_dir = os.path.join(
+            PROJECT_FOLDER, "tsv_extracted_from_wikidata", self.dump_name, lang, tag
+        )
+        self.tmp_extracted_dir = os.path.join(
+            PROJECT_FOLDER, "tmp_extracted_data", self.dump_name, lang, tag
+        )
+        self.parts = sorted(
+            name for name in os.listdir(self.dump_dir) if ".part" in name
+        )
+        # collect external identifiers (see EXTERNAL_IDS in env_variables.cfg)
+        self.external_ids = os.environ.get("EXTERNAL_IDS") == "true"
+
+    def run_stage(self, stage, inputs, outputs, action, tools=(), params=None):
+        """
+        Runs stage unless it is up to date and reports it.
+        :param stage: name of the stage
+        :param inputs: input files or directories
+        :param outputs: output files or directories
+        :param action: command or function
+        :param tools: scripts used by the stage
+        :param params: parameters of the stage
+        """
+        if self.cache.run(stage, inputs, outputs, action, tools, params, self.force):
+            print(f"Stage {stage} finished.")
+        else:
+            print(f"Stage {stage} is up to date, skipped.")
+
+    def run_parallel(self, function, items):
+        """
+        Runs function for each item in parallel.
+        :param function: function with one argument
+        :param items: arguments of function calls
+        :raise Exception raised by any of calls
+        """
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for result in [executor.submit(function, item) for item in items]:
+                result.result()
+
+    def get_part_dir(self, part):
+        return os.path.join(self.parts_dir, part)
+
+    def get_part_file(self, part, dirname_variable, file_name):
+        return os.path.join(self.get_part_dir(part), os.environ[dirname_variable], file_name)
+
+    def get_out_file(self, type_name):
+        dump_base = self.dump_name.replace("-all.json", "")
+        return os.path.join(self.out_dir, f"{dump_base}-{self.lang}-{type_name}.tsv")
+
+    def parse_part(self, part):
+        def action():
+            shutil.rmtree(self.get_part_dir(part), ignore_errors=True)
+            os.makedirs(self.get_part_dir(part))
+            subprocess.run(
+                python_command(
+                    "parseWikidataDump.py",
+                    "--language", self.lang,
+                    "-e", "-q", "--lazy-claims",
+                    "--compression", self.compression,
+                    "-f", os.path.join(self.dump_dir, part),
+                    "-t", part,
+                    "-p", self.get_part_dir(part) + "/",
+                    *(["--external-ids"] if self.external_ids else []),
+                ),
+                check=True,
+            )
+
+        self.run_stage(
+            f"parse_{part}",
+            [os.path.join(self.dump_dir, part)],
+            [self.get_part_dir(part)],
+            action,
+            get_tools("parseWikidataDump.py", "crosswalkIndex.py", *CLASS_TOOLS),
+            {
+                "lang": self.lang,
+                "compression": self.compression,
+                "external_ids": self.external_ids,
+            },
+        )
+
+    def get_types(self):
+        """
+        Returns types of entities found in parsed parts.
+        :return: sorted list of types
+        """
+        types = set()
+        for part in self.parts:
+            types_dir = os.path.join(
+                self.get_part_dir(part), os.environ["DIRNAME_TYPES_DATA"]
+            )
+            for name in os.listdir(types_dir):
+                types.add(name[: name.rfind("_" + part)])
+        return sorted(types)
+
+    def collect(self):
+        def action():
+            # other files in collected_dir are outputs of following stages
+            shutil.rmtree(os.path.join(self.collected_dir, "types_data"), ignore_errors=True)
+            shutil.rmtree(os.path.join(self.collected_dir, "classes"), ignore_errors=True)
+            for type_name in self.get_types():
+                file_name = f"{type_name}.tsv{self.suffix}"
+                concatenate_files(
+                    [
+                        self.get_part_file(
+                            part, "DIRNAME_TYPES_DATA", f"{type_name}_{part}.tsv{self.suffix}"
+                        )
+                        for part in self.parts
+                    ],
+                    os.path.join(self.collected_dir, "types_data", file_name),
+                )
+            concatenate_files(
+                [
+                    self.get_part_file(part, "DIRNAME_DICTS", f"dict_{part}.tsv{self.suffix}")
+                    for part in self.parts
+                ],
+                os.path.join(self.collected_dir, f"dict.tsv{self.suffix}"),
+            )
+            classes_dir = os.path.join(self.collected_dir, "classes")
+            os.makedirs(classes_dir)
+            for part in self.parts:
+                name = f"classes_{part}.json{self.suffix}"
+                shutil.copyfile(
+                    self.get_part_file(part, "DIRNAME_CLASSES", name),
+                    os.path.join(classes_dir, name),
+                )
+
+        self.run_stage(
+            "collect",
+            [self.get_part_dir(part) for part in self.parts],
+            [
+                os.path.join(self.collected_dir, "types_data"),
+                os.path.join(self.collected_dir, f"dict.tsv{self.suffix}"),
+                os.path.join(self.collected_dir, "classes"),
+            ],
+            action,
+        )
+
+    def compile_dictionary(self):
+        self.run_stage(
+            "dictionary",
+            [os.path.join(self.collected_dir, f"dict.tsv{self.suffix}")],
+            [self.dict_path],
+            python_command(
+                "nameDictionary.py",
+                "-f", os.path.join(self.collected_dir, f"dict.tsv{self.suffix}"),
+                "-o", self.dict_path,
+            ),
+            get_tools("nameDictionary.py"),
+        )
+
+    def substitute_type(self, type_name):
+        input_file = os.path.join(
+            self.collected_dir, "types_data", f"{type_name}.tsv{self.suffix}"
+        )
+        output_file = self.get_out_file(type_name)
+
+        id_format = "bare" if type_name in MERGED_TYPES else "prefixed"
+
+        def action():
+            os.makedirs(self.out_dir, exist_ok=True)
+            subprocess.run(
+                python_command(
+                    "substituteNames.py",
+                    "-d", self.dict_path,
+                    "-f", input_file,
+                    "-o", output_file,
+                    "--compression", "none",
+                    "--id-format", id_format,
+                    "-e", 0, 8, 9, 10, 11,
+                    "--remove-missing",
+                ),
+                check=True,
+            )
+
+        self.run_stage(
+            f"substitute_{type_name}",
+            [input_file, self.dict_path],
+            [output_file],
+            action,
+            get_tools("substituteNames.py"),
+            {"id_format": id_format},
+        )
+
+    def build_geo_index(self):
+        geographical_file = self.get_out_file("geographical")
+        self.run_stage(
+            "geo_index",
+            [geographical_file],
+            [geoIndex.get_index_path(geographical_file)],
+            python_command("geoIndex.py", "-f", geographical_file),
+            get_tools("geoIndex.py", "kbStore.py"),
+        )
+
+    def build_temporal_index(self, type_name):
+        type_file = self.get_out_file(type_name)
+        self.run_stage(
+            f"temporal_index_{type_name}",
+            [type_file],
+            [temporalIndex.get_index_path(type_file)],
+            python_command("temporalIndex.py", "-f", type_file, "--type", type_name),
+            get_tools("temporalIndex.py", "kbStore.py"),
+        )
+
+    def build_crosswalk_index(self):
+        # index is compiled directly from files of parts
+        crosswalk_files = [
+            self.get_part_file(part, "DIRNAME_DICTS", f"crosswalk_{part}.tsv{self.suffix}")
+            for part in self.parts
+        ]
+        index_path = os.path.join(
+            self.out_dir, self.dump_name.replace("-all.json", "") + "-crosswalk.idx"
+        )
+        self.run_stage(
+            "crosswalk_index",
+            crosswalk_files,
+            [index_path],
+            python_command(
+                "crosswalkIndex.py",
+                "-f", *crosswalk_files,
+                "-o", index_path,
+                "-j", str(self.jobs),
+            ),
+            get_tools("crosswalkIndex.py"),
+        )
+
+    def build_classes(self):
+        self.run_stage(
+            "classes",
+            [os.path.join(self.collected_dir, "classes")],
+            [self.classes_path, self.class_graph_path],
+            python_command(
+                "classRelationsBuilder.py",
+                "-s", "-r",
+                "-d", os.path.join(self.collected_dir, "classes"),
+                "-c", self.classes_path,
+                "-b", self.class_graph_path,
+                "-j", str(self.jobs),
+                "--compression", self.compression,
+            ),
+            get_tools(*CLASS_TOOLS),
+        )
+
+    def expand_part(self, part):
+        instances_file = self.get_part_file(
+            part, "DIRNAME_INSTANCES", f"instances_{part}.bin{self.suffix}"
+        )
+        expanded_kb_file = self.get_part_file(
+            part, "DIRNAME_EXPANDED_INSTANCES", f"expanded_instances_{part}.tsv{self.suffix}"
+        )
+        instances_output = os.path.join(self.expanded_dir, f"instances_{part}.tsv")
+        processed_output = os.path.join(
+            self.expanded_dir, f"expanded_instances_{part}.processed.tsv{self.suffix}"
+        )
+        substituted_output = os.path.join(
+            self.expanded_dir, f"expanded_instances_{part}.name_substituted.tsv"
+        )
+        os.makedirs(self.expanded_dir, exist_ok=True)
+
+        self.run_stage(
+            f"expand_instances_{part}",
+            [instances_file, self.class_graph_path],
+            [instances_output],
+            python_command(
+                "classRelationsBuilder.py",
+                "-i", instances_file,
+                "-e", instances_output,
+                "--compression", "none",
+                "-b", self.class_graph_path,
+            ),
+            get_tools(*CLASS_TOOLS),
+        )
+        self.run_stage(
+            f"expand_kb_{part}",
+            [expanded_kb_file, self.class_graph_path],
+            [processed_output],
+            python_command(
+                "classRelationsBuilder.py",
+                "-l", expanded_kb_file,
+                "-o", processed_output,
+                "--compression", self.compression,
+                "-b", self.class_graph_path,
+            ),
+            get_tools(*CLASS_TOOLS),
+        )
+        self.run_stage(
+            f"substitute_expanded_kb_{part}",
+            [processed_output, self.dict_path],
+            [substituted_output],
+            python_command(
+                "substituteNames.py",
+                "-d", self.dict_path,
+                "-f", processed_output,
+                "-o", substituted_output,
+                "--compression", "none",
+                "-e", 0, 8, 9, 10, 11,
+                "--remove-missing",
+            ),
+            get_tools("substituteNames.py"),
+        )
+
+    def finalize_instances(self):
+        instances_files = [
+            os.path.join(self.expanded_dir, f"instances_{part}.tsv") for part in self.parts
+        ]
+        instances_all = os.path.join(
+            self.tmp_extracted_dir, os.environ["DIRNAME_INSTANCES"], "instances_all.tsv"
+        )
+        expanded_kb_files = [
+            os.path.join(self.expanded_dir, f"expanded_instances_{part}.name_substituted.tsv")
+            for part in self.parts
+        ]
+        expanded_kb = os.path.join(
+            self.tmp_extracted_dir,
+            os.environ["DIRNAME_EXPANDED_INSTANCES"],
+            f"wikidata_expanded_instance_kb_{self.lang}.tsv",
+        )
+
+        def merge_instances():
+            os.makedirs(os.path.dirname(instances_all), exist_ok=True)
+            subprocess.run(
+                python_command(
+                    "classRelationsBuilder.py",
+                    "-m", *instances_files,
+                    "-e", instances_all,
+                    "--compression", "none",
+                ),
+                check=True,
+            )
+
+        self.run_stage(
+            "instances_all",
+            instances_files,
+            [instances_all],
+            merge_instances,
+            get_tools(*CLASS_TOOLS),
+        )
+        self.run_stage(
+            "expanded_kb",
+            expanded_kb_files,
+            [expanded_kb],
+            lambda: concatenate_files(expanded_kb_files, expanded_kb),
+        )
+
+    def merge(self):
+        merge_folder = os.path.join(PROJECT_FOLDER, "merge_KB")
+        inputs = [self.get_out_file(type_name) for type_name in MERGED_TYPES]
+        inputs += sorted(glob.glob(os.path.join(merge_folder, "*", "*.fields")))
+        inputs += sorted(glob.glob(os.path.join(merge_folder, "*", "*.conf")))
+        inputs.append(os.path.join(merge_folder, "HEAD"))
+        tools = sorted(glob.glob(os.path.join(merge_folder, "*.sh")))
+        tools += sorted(glob.glob(os.path.join(merge_folder, "kb_tools", "*.py")))
+        tools.append(os.path.join(PROJECT_FOLDER, "wikidata_lib.sh"))
+        output_dir = os.path.join(merge_folder, "output", self.dump_name, self.lang)
+
+        if self.lang == "cs":
+            command = [
+                "sh", os.path.join(merge_folder, "start_merge.sh"),
+                "-d", self.dump_name, "-g", self.lang, "-t", self.tag,
+            ]
+        else:  # entity_kb_czech9 has czech data only
+            command = [
+                "sh", os.path.join(merge_folder, "mkkb.sh"),
+                "-p", self.get_out_file("person"),
+                "-g", self.get_out_file("group"),
+                "-a", self.get_out_file("person+artist"),
+                "-l", self.get_out_file("geographical"),
+                "-e", self.get_out_file("event"),
+                "-o", self.get_out_file("organization"),
+                f"--artwork={self.get_out_file('artwork')}",
+                f"--dump={self.dump_name}",
+                f"--lang={self.lang}",
+            ]
+        self.run_stage("merge", inputs, [output_dir], command, tools, {"lang": self.lang})
+
+    def run(self, merge=False):
+        """
+        Runs all stages of extraction.
+        :param merge: merge extracted KB
+        :raise subprocess.CalledProcessError if any stage fails
+        :raise IOError if fails to read or write files
+        """
+        self.run_parallel(self.parse_part, self.parts)
+        self.collect()
+        self.compile_dictionary()
+        types = self.get_types()
+        self.run_parallel(self.substitute_type, types)
+        if self.external_ids:
+            self.build_crosswalk_index()
+        if "geographical" in types:
+            self.build_geo_index()
+        self.run_parallel(
+            self.build_temporal_index,
+            [type_name for type_name in types if type_name in temporalIndex.TYPE_COLUMNS],
+        )
+        self.build_classes()
+        self.run_parallel(self.expand_part, self.parts)
+        self.finalize_instances()
+        if merge:
+            self.merge()
+
+
+def main():
+    args = get_args()
+
+    try:
+        load_env_variables()
+        pipeline = LocalPipeline(
+            args.dump_dir,
+            args.lang,
+            args.tag,
+            work_dir=args.work_dir,
+            cache_dir=args.cache_dir,
+            jobs=args.jobs,
+            force=args.force,
+        )
+        pipeline.run(args.merge)
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write(f"{SCRIPT_NAME}: Command {e.cmd} failed ({e.returncode})!\n")
+        return 1
+    except Exception:
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Extraction failed! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -196,6 +196,9 @@ echo "VERSION=${lang}_wd_${dump_version}_$(date '+%Y%m%d_%H%M%S')" > "$output_fi
 cat "$project_folder"/HEAD "$person_file" "$group_file" "$artist_file" "$geographical_file" "$event_file" "$organization_file" "$artwork_file" \
 >> "$output_file"
 
+# Pack KB to store with access to rows by entity id (see kbStore.py)
+python3 "${project_folder}/../kbStore.py" -f "$output_file" -o "${output_file%.*}.sst" --bloom
+
 # Insert stats to KB and compute metrics
 output_file=$(realpath $output_file)
 output_file_stats="${output_file%.*}+stats.${output_file##*.}"
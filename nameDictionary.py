@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: nameDictionary.py
+# Project: wikidata2
+# Description: Compiles dictionary of entity names (dict.tsv) to binary file and looks names up in it.
+#              Binary dictionary contains sorted array of numeric entity ids (uint64), array of offsets
+#              into UTF-8 blob of names and the blob. File is memory mapped and searched by binary search,
+#              so all processes using the same dictionary share one copy in page cache.
+
+import argparse
+import mmap  # memory mapped dictionary
+import os  # filesystem
+import shutil  # concatenation of temporary files
+import struct  # file header
+import sys  # stderr, exit, byte order
+import tempfile  # temporary files
+import traceback  # for printing exceptions
+from array import array  # ids and offsets
+from bisect import bisect_left  # binary search
+from collections.abc import Mapping  # dictionary interface
+
+import compressedFiles  # compressed input files
+import externalSort  # sorting of large dictionaries
+import parseJson2  # entity id encoding
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# magic bytes at the beginning of binary dictionary
+MAGIC = b"WDNDICT1"
+# header: magic, byte order (b/l), padding, number of names
+HEADER = struct.Struct("=8sc7xQ")
+# number of ids/offsets written at once
+ARRAY_BATCH_SIZE = 1024 * 1024
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Compiles dictionary of entity names to binary format."
+    )
+    argparser.add_argument(
+        "-f",
+        "--input-file",
+        help="Dictionary in tsv format (entity id and name on each line, may be compressed).",
+        required=True,
+    )
+    argparser.add_argument(
+        "-o",
+        "--output-file",
+        help="Output binary dictionary.",
+        required=True,
+    )
+    argparser.add_argument(
+        "--temp-dir",
+        help="Directory for temporary files (default: directory of output file).",
+    )
+    argparser.add_argument(
+        "--run-size",
+        help="Number of names sorted in memory at once (default=%(default)s).",
+        type=int,
+        default=externalSort.DEFAULT_RUN_SIZE,
+    )
+    return argparser.parse_args()
+
+
+def is_name_dictionary(path):
+    """
+    Tells if file is binary name dictionary.
+    :param path: path to the file
+    :raise IOError if fails to read from file
+    :return: True if file starts with binary dictionary magic bytes
+    """
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def compile_dictionary(
+    dict_file, output_path, run_size=externalSort.DEFAULT_RUN_SIZE, temp_dir=None
+):
+    """
+    Compiles tsv dictionary to binary dictionary.
+    If id is listed more times, the last name is used (same as when dictionary is loaded to dict).
+    Lines with ids, which are not wikidata entity ids, are skipped.
+    :param dict_file: opened tsv dictionary (id and name on each line)
+    :param output_path: path to the binary dictionary
+    :param run_size: number of names sorted in memory at once
+    :param temp_dir: directory for temporary files (None = directory of output file)
+    :raise IOError if fails to read or write
+    :return: number of names in dictionary
+    """
+    if temp_dir is None:
+        temp_dir = os.path.dirname(os.path.abspath(output_path))
+
+    def records():
+        for line in dict_file:
+            fields = line.rstrip("\n").split("\t")
+            try:
+                number = parseJson2.encode_entity_id(fields[0])
+            except ValueError:
+                continue
+            yield str(number), fields[1] if len(fields) > 1 else ""
+
+    ids = array("Q")
+    offsets = array("Q", [0])
+    offset = 0
+    count = 0
+    previous = None
+    pending_name = None  # name of the last id, written when all its duplicates are read
+    blob = tempfile.TemporaryFile(dir=temp_dir)
+    ids_file = tempfile.TemporaryFile(dir=temp_dir)
+    offsets_file = tempfile.TemporaryFile(dir=temp_dir)
+    try:
+        for number, name in externalSort.external_sort(
+            records(),
+            key=lambda record: int(record[0]),
+            run_size=run_size,
+            temp_dir=temp_dir,
+        ):
+            number = int(number)
+            if number == previous:  # keep the last name
+                pending_name = name
+                continue
+            if pending_name is not None:
+                offset += blob.write(pending_name.encode("utf-8"))
+                offsets.append(offset)
+            ids.append(number)
+            previous = number
+            pending_name = name
+            count += 1
+            if len(ids) >= ARRAY_BATCH_SIZE:
+                ids.tofile(ids_file)
+                del ids[:]
+            if len(offsets) >= ARRAY_BATCH_SIZE:
+                offsets.tofile(offsets_file)
+                del offsets[:]
+        if pending_name is not None:
+            offset += blob.write(pending_name.encode("utf-8"))
+            offsets.append(offset)
+        ids.tofile(ids_file)
+        offsets.tofile(offsets_file)
+
+        with open(output_path, "wb") as output:
+            output.write(
+                HEADER.pack(MAGIC, b"l" if sys.byteorder == "little" else b"b", count)
+            )
+            for file in (ids_file, offsets_file, blob):
+                file.seek(0)
+                shutil.copyfileobj(file, output, compressedFiles.BUFFER_SIZE)
+    finally:
+        blob.close()
+        ids_file.close()
+        offsets_file.close()
+    return count
+
+
+class NameDictionary(Mapping):
+    """
+    Read-only dictionary entity id -> name stored in memory mapped binary file.
+    """
+
+    def __init__(self, path):
+        """
+        Maps binary dictionary to memory.
+        :param path: path to the binary dictionary
+        :raise IOError if fails to open file
+        :raise ValueError if file is not binary dictionary or has different byte order
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, self.count = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not binary name dictionary!")
+        if byte_order != (b"l" if sys.byteorder == "little" else b"b"):
+            raise ValueError(f"Byte order of {path} differs from byte order of this machine!")
+
+        self.view = memoryview(self.mmap)
+        ids_start = HEADER.size
+        offsets_start = ids_start + self.count * 8
+        self.blob_start = offsets_start + (self.count + 1) * 8
+        self.ids = self.view[ids_start:offsets_start].cast("Q")
+        self.offsets = self.view[offsets_start : self.blob_start].cast("Q")
+
+    def find(self, entity_id):
+        """
+        Finds index of entity id in dictionary.
+        :param entity_id: wikidata entity id
+        :return: index of id, None if id is not in dictionary
+        """
+        try:
+            number = parseJson2.encode_entity_id(entity_id)
+        except ValueError:
+            return None
+        index = bisect_left(self.ids, number)
+        if index < self.count and self.ids[index] == number:
+            return index
+        return None
+
+    def __getitem__(self, entity_id):
+        index = self.find(entity_id)
+        if index is None:
+            raise KeyError(entity_id)
+        return self.mmap[
+            self.blob_start + self.offsets[index] : self.blob_start + self.offsets[index + 1]
+        ].decode("utf-8")
+
+    def __contains__(self, entity_id):
+        return self.find(entity_id) is not None
+
+    def __iter__(self):
+        for number in self.ids:
+            yield parseJson2.decode_entity_id(number)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """
+        Unmaps the dictionary.
+        """
+        self.ids.release()
+        self.offsets.release()
+        self.view.release()
+        self.mmap.close()
+
+
+def main():
+    args = get_args()
+
+    try:
+        dict_file = compressedFiles.open_file(args.input_file, "r")
+        count = compile_dictionary(
+            dict_file, args.output_file, args.run_size, args.temp_dir
+        )
+        dict_file.close()
+    except IOError:
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to compile dictionary! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+    print(f"Names in dictionary: {count}")
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: nameIndex.py
+# Project: wikidata2
+# Description: Compiles names and aliases of KB entities to index of surface forms and looks them up.
+#              Index is sorted string table: array of offsets into UTF-8 blob of sorted distinct surface
+#              forms, offsets into array of posting lists and posting lists of KB row ids (uint32). Numeric
+#              entity id of each row is stored too, so queries can return entity ids without the KB.
+#              File is memory mapped and searched by binary search (exact and prefix lookups).
+#              Surface forms may be normalised (casefold, diacritics stripping), queries are normalised
+#              the same way.
+
+import argparse
+import mmap  # memory mapped index
+import os  # filesystem
+import shutil  # concatenation of temporary files
+import struct  # file header
+import sys  # stdout, stderr, exit, byte order
+import tempfile  # temporary files
+import traceback  # for printing exceptions
+import unicodedata  # diacritics stripping
+from array import array  # offsets, postings and entity ids
+
+import compressedFiles  # compressed input files
+import externalSort  # sorting of surface forms which do not fit into memory
+import kbStore  # reading of KB header, entity id keys
+import parseJson2  # entity id decoding
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# magic bytes at the beginning of the index
+MAGIC = b"WDNAMEI1"
+# header: magic, byte order (b/l), normalisation flags, padding, number of surface forms,
+#         number of postings, number of KB rows
+HEADER = struct.Struct("=8scB6xQQQ")
+# normalisation flags
+CASEFOLD = 1
+STRIP_DIACRITICS = 2
+# default columns of KB with names (see merge_KB/HEAD)
+NAME_COLUMN = 2
+ALIASES_COLUMN = 4
+# separator of values in multi-value fields
+VALUE_SEPARATOR = "|"
+# number of offsets/postings written at once
+ARRAY_BATCH_SIZE = 1024 * 1024
+# entity id of rows with ids which are not wikidata entity ids
+NO_ENTITY_ID = (1 << 64) - 1
+# byte greater than any byte of UTF-8 encoded text (upper bound of prefix search)
+PREFIX_END = b"\xff"
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Compiles names and aliases of KB entities to lookup index and queries it."
+    )
+    argparser.add_argument(
+        "-f",
+        "--input-file",
+        help="KB in tsv format (per-type file or KB.tsv, may be compressed).",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output-file",
+        help="Output index.",
+    )
+    argparser.add_argument(
+        "--name-columns",
+        help="0-based indices of columns with single names (default=%(default)s).",
+        type=int,
+        nargs="+",
+        default=[NAME_COLUMN],
+    )
+    argparser.add_argument(
+        "--alias-columns",
+        help="0-based indices of columns with '|' separated aliases (default=%(default)s).",
+        type=int,
+        nargs="*",
+        default=[ALIASES_COLUMN],
+    )
+    argparser.add_argument(
+        "--casefold",
+        help="Index case folded surface forms (case insensitive lookups).",
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--strip-diacritics",
+        help="Index surface forms without diacritics.",
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--temp-dir",
+        help="Directory for temporary files (default: directory of output file).",
+    )
+    argparser.add_argument(
+        "--run-size",
+        help="Number of surface forms sorted in memory at once (default=%(default)s).",
+        type=int,
+        default=externalSort.DEFAULT_RUN_SIZE,
+    )
+    argparser.add_argument(
+        "-r",
+        "--read",
+        help="Index to query, matching entities are printed.",
+    )
+    argparser.add_argument(
+        "-q",
+        "--query",
+        help="Surface forms to look up.",
+        nargs="+",
+        default=[],
+    )
+    argparser.add_argument(
+        "--prefix",
+        help="Look up surface forms starting with queries.",
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--limit",
+        help="Maximal number of surface forms returned by prefix lookup.",
+        type=int,
+    )
+    return argparser.parse_args()
+
+
+def normalize(text, flags):
+    """
+    Normalises surface form.
+    :param text: surface form
+    :param flags: normalisation flags (CASEFOLD, STRIP_DIACRITICS)
+    :return: normalised surface form
+    """
+    if flags & STRIP_DIACRITICS:
+        text = "".join(
+            c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)
+        )
+        text = unicodedata.normalize("NFC", text)
+    if flags & CASEFOLD:
+        text = text.casefold()
+    return text
+
+
+def compile_index(
+    file,
+    output_path,
+    flags=0,
+    name_columns=(NAME_COLUMN,),
+    alias_columns=(ALIASES_COLUMN,),
+    run_size=externalSort.DEFAULT_RUN_SIZE,
+    temp_dir=None,
+):
+    """
+    Compiles index of names and aliases of KB.
+    Row id is 0-based index of KB row (lines of KB header are not counted).
+    :param file: opened KB in tsv format
+    :param output_path: path to the index
+    :param flags: normalisation flags (CASEFOLD, STRIP_DIACRITICS)
+    :param name_columns: indices of columns with single names
+    :param alias_columns: indices of columns with '|' separated aliases
+    :param run_size: number of surface forms sorted in memory at once
+    :param temp_dir: directory for temporary files (None = directory of output file)
+    :raise IOError if fails to read or write
+    :return: (number of surface forms, number of postings, number of rows)
+    """
+    if temp_dir is None:
+        temp_dir = os.path.dirname(os.path.abspath(output_path))
+
+    _, rows = kbStore.read_kb(file)
+    entity_ids = array("Q")
+    ids_file = tempfile.TemporaryFile(dir=temp_dir)
+
+    def records():
+        for row_id, (entity_id, line) in enumerate(rows):
+            try:
+                entity_ids.append(kbStore.get_row_key(entity_id))
+            except ValueError:
+                entity_ids.append(NO_ENTITY_ID)
+            if len(entity_ids) >= ARRAY_BATCH_SIZE:
+                entity_ids.tofile(ids_file)
+                del entity_ids[:]
+
+            fields = line.split("\t")
+            forms = set()
+            for column in name_columns:
+                if column < len(fields) and fields[column]:
+                    forms.add(fields[column])
+            for column in alias_columns:
+                if column < len(fields) and fields[column]:
+                    forms.update(fields[column].split(VALUE_SEPARATOR))
+            for form in forms:
+                form = normalize(form, flags)
+                if form:
+                    yield form, str(row_id)
+
+    form_offsets = array("Q", [0])
+    posting_offsets = array("Q", [0])
+    postings = array("I")
+    form_count = posting_count = form_offset = 0
+    previous = previous_row = None
+    blob = tempfile.TemporaryFile(dir=temp_dir)
+    form_offsets_file = tempfile.TemporaryFile(dir=temp_dir)
+    posting_offsets_file = tempfile.TemporaryFile(dir=temp_dir)
+    postings_file = tempfile.TemporaryFile(dir=temp_dir)
+    try:
+        for form, row_id in externalSort.external_sort(
+            records(),
+            key=lambda record: (record[0], int(record[1])),
+            run_size=run_size,
+            temp_dir=temp_dir,
+        ):
+            row_id = int(row_id)
+            if form != previous:
+                if previous is not None:
+                    form_offsets.append(form_offset)
+                    posting_offsets.append(posting_count)
+                form_offset += blob.write(form.encode("utf-8"))
+                previous = form
+                form_count += 1
+            elif row_id == previous_row:  # form used more times by one row
+                continue
+            postings.append(row_id)
+            previous_row = row_id
+            posting_count += 1
+            for values, values_file in (
+                (form_offsets, form_offsets_file),
+                (posting_offsets, posting_offsets_file),
+                (postings, postings_file),
+            ):
+                if len(values) >= ARRAY_BATCH_SIZE:
+                    values.tofile(values_file)
+                    del values[:]
+        if previous is not None:
+            form_offsets.append(form_offset)
+            posting_offsets.append(posting_count)
+        entity_ids.tofile(ids_file)
+        row_count = ids_file.tell() // entity_ids.itemsize
+        for values, values_file in (
+            (form_offsets, form_offsets_file),
+            (posting_offsets, posting_offsets_file),
+            (postings, postings_file),
+        ):
+            values.tofile(values_file)
+        # postings are uint32, padding keeps following uint64 arrays aligned
+        postings_file.write(b"\0" * (posting_count % 2 * 4))
+
+        with open(output_path, "wb") as output:
+            output.write(
+                HEADER.pack(
+                    MAGIC,
+                    b"l" if sys.byteorder == "little" else b"b",
+                    flags,
+                    form_count,
+                    posting_count,
+                    row_count,
+                )
+            )
+            for temp_file in (
+                form_offsets_file,
+                posting_offsets_file,
+                postings_file,
+                ids_file,
+                blob,
+            ):
+                temp_file.seek(0)
+                shutil.copyfileobj(temp_file, output, compressedFiles.BUFFER_SIZE)
+    finally:
+        for temp_file in (
+            blob,
+            form_offsets_file,
+            posting_offsets_file,
+            postings_file,
+            ids_file,
+        ):
+            temp_file.close()
+    return form_count, posting_count, row_count
+
+
+class NameIndex:
+    """
+    Read-only index of surface forms stored in memory mapped file.
+    """
+
+    def __init__(self, path):
+        """
+        Maps index to memory.
+        :param path: path to the index
+        :raise IOError if fails to open file
+        :raise ValueError if file is not name index or has different byte order
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, self.flags, self.count, posting_count, self.rows = (
+            HEADER.unpack_from(self.mmap)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not name index!")
+        if byte_order != (b"l" if sys.byteorder == "little" else b"b"):
+            raise ValueError(f"Byte order of {path} differs from byte order of this machine!")
+
+        self.view = memoryview(self.mmap)
+        form_offsets_start = HEADER.size
+        posting_offsets_start = form_offsets_start + (self.count + 1) * 8
+        postings_start = posting_offsets_start + (self.count + 1) * 8
+        ids_start = postings_start + (posting_count + posting_count % 2) * 4
+        self.blob_start = ids_start + self.rows * 8
+        self.form_offsets = self.view[form_offsets_start:posting_offsets_start].cast("Q")
+        self.posting_offsets = self.view[posting_offsets_start:postings_start].cast("Q")
+        self.postings = self.view[postings_start : postings_start + posting_count * 4].cast("I")
+        self.entity_ids = self.view[ids_start : self.blob_start].cast("Q")
+
+    def get_form(self, index):
+        """
+        Returns surface form as bytes.
+        :param index: index of the surface form
+        :return: UTF-8 encoded surface form
+        """
+        return self.mmap[
+            self.blob_start + self.form_offsets[index] : self.blob_start + self.form_offsets[index + 1]
+        ]
+
+    def lower_bound(self, form):
+        """
+        Finds the first surface form which is not less than given form.
+        :param form: UTF-8 encoded surface form
+        :return: index of surface form (count of forms if all forms are less)
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_form(middle) < form:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_postings(self, index):
+        """
+        Returns row ids of surface form.
+        :param index: index of the surface form
+        :return: list of row ids
+        """
+        return self.postings[self.posting_offsets[index] : self.posting_offsets[index + 1]].tolist()
+
+    def normalize(self, text):
+        """
+        Normalises query the same way as indexed surface forms.
+        :param text: query
+        :return: normalised query
+        """
+        return normalize(text, self.flags)
+
+    def lookup(self, text):
+        """
+        Finds rows with surface form.
+        :param text: surface form (normalised automatically)
+        :return: list of row ids (sorted)
+        """
+        form = self.normalize(text).encode("utf-8")
+        index = self.lower_bound(form)
+        if index < self.count and self.get_form(index) == form:
+            return self.get_postings(index)
+        return []
+
+    def lookup_prefix(self, text, limit=None):
+        """
+        Finds surface forms starting with prefix.
+        :param text: prefix of surface forms (normalised automatically)
+        :param limit: maximal number of returned surface forms (None = all)
+        :return: list of (surface form, list of row ids) tuples in order of surface forms
+        """
+        prefix = self.normalize(text).encode("utf-8")
+        start = self.lower_bound(prefix)
+        end = self.lower_bound(prefix + PREFIX_END)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [
+            (self.get_form(index).decode("utf-8"), self.get_postings(index))
+            for index in range(start, end)
+        ]
+
+    def get_entity_id(self, row_id):
+        """
+        Returns entity id of KB row.
+        :param row_id: id of the row
+        :return: entity id (without type prefix), None if row has no wikidata entity id
+        """
+        number = self.entity_ids[row_id]
+        if number == NO_ENTITY_ID:
+            return None
+        return parseJson2.decode_entity_id(number)
+
+    def lookup_entities(self, text):
+        """
+        Finds entities with surface form.
+        :param text: surface form (normalised automatically)
+        :return: list of entity ids
+        """
+        return [self.get_entity_id(row_id) for row_id in self.lookup(text)]
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """
+        Unmaps the index.
+        """
+        for view in (self.form_offsets, self.posting_offsets, self.postings, self.entity_ids):
+            view.release()
+        self.view.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def main():
+    args = get_args()
+
+    if args.read:
+        try:
+            with NameIndex(args.read) as index:
+                for query in args.query:
+                    if args.prefix:
+                        matches = index.lookup_prefix(query, args.limit)
+                    else:
+                        matches = [(index.normalize(query), index.lookup(query))]
+                    for form, row_ids in matches:
+                        for row_id in row_ids:
+                            sys.stdout.write(
+                                f"{query}\t{form}\t{row_id}\t{index.get_entity_id(row_id) or ''}\n"
+                            )
+        except (IOError, ValueError):
+            sys.stderr.write(
+                SCRIPT_NAME
+                + ": Failed to query name index! Handled error:\n"
+                + str(traceback.format_exc())
+                + "\n"
+            )
+            return 1
+        return 0
+
+    if not args.input_file or not args.output_file:
+        sys.stderr.write("Input file and output file must be set for compilation!\n")
+        sys.stderr.write("Use '--help' to see '-f' and '-o' options!\n")
+        return 1
+
+    flags = (CASEFOLD if args.casefold else 0) | (
+        STRIP_DIACRITICS if args.strip_diacritics else 0
+    )
+    try:
+        input_file = compressedFiles.open_file(args.input_file, "r")
+        form_count, posting_count, row_count = compile_index(
+            input_file,
+            args.output_file,
+            flags,
+            args.name_columns,
+            args.alias_columns,
+            args.run_size,
+            args.temp_dir,
+        )
+        input_file.close()
+    except IOError:
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to compile name index! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+    print(f"Surface forms: {form_count}, postings: {posting_count}, rows: {row_count}")
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
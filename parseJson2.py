@@ -9,16 +9,113 @@
 
 import argparse
 import hashlib  # generate temp file name
+import io  # file types
 import json  # load data from dump
 import os  # filesystem
 import re  # find ids for substitution
 import sys  # stderr, exit, ...
 import time  # generate temp file name, timestamps
 import traceback  # for printing exceptions
+import zlib  # hash of entity ids for sharding
+from collections.abc import Mapping  # lazy claims interface
+
+import compressedFiles  # compressed output files
+import nameDictionary  # binary dictionary
 
 # get script name
 SCRIPT_NAME = os.path.basename(sys.argv[0])
 
+# size of output buffers (default buffer of open() is only 8kB)
+OUTPUT_BUFFER_SIZE = 8 * 1024 * 1024
+# minimal size of output buffers when many output files are written at once
+MIN_BUFFER_SIZE = 256 * 1024
+
+# keys following claims in wikidata json record (claims end before them)
+CLAIMS_FOLLOWING_KEYS = (',"sitelinks":', ',"lastrevid":', ',"modified":')
+
+# kinds of wikidata entity ids encoded in the highest bits of numeric ids (see encode_entity_id())
+ENTITY_ID_KINDS = ("Q", "P", "L")
+# number of bits of numeric ids used for the number of entity
+ENTITY_ID_BITS = 60
+# wikidata entity id (kind and number without leading zeros)
+ENTITY_ID_REGEXP = re.compile(r"([QPL])([1-9][0-9]*)")
+# formats of entity ids in output files (see format_entity_id())
+ID_FORMATS = ("prefixed", "bare", "both")
+# maximal number of cached rankings of parents of entity types (see ClassRelationsBuilder.get_all_parents())
+PARENTS_CACHE_SIZE = 200000
+
+
+def encode_entity_id(entity_id):
+    """
+    Converts wikidata entity id to number fitting into unsigned 64-bit integer.
+    Items keep their number (Q42 -> 42), kind of other entities is stored in the highest bits.
+    :param entity_id: wikidata id (e.g. Q42, P31, L7)
+    :raise ValueError if id is not valid wikidata entity id
+    :return: numeric id
+    """
+    match = ENTITY_ID_REGEXP.fullmatch(entity_id)
+    if not match:
+        raise ValueError(f"Invalid entity id '{entity_id}'!")
+    number = int(match.group(2))
+    if number >> ENTITY_ID_BITS:
+        raise ValueError(f"Entity id '{entity_id}' is too large!")
+    return (ENTITY_ID_KINDS.index(match.group(1)) << ENTITY_ID_BITS) | number
+
+
+def get_entity_shard(entity_id, shards):
+    """
+    Returns shard of entity, shards are the same for all outputs (types, dictionary, instances).
+    Type prefix of id (e.g. p:Q42) is ignored, so prefixed and bare ids belong to the same shard.
+    :param entity_id: wikidata id of entity
+    :param shards: number of shards
+    :return: index of shard (0 .. shards - 1)
+    """
+    if shards <= 1:
+        return 0
+    return zlib.crc32(entity_id[entity_id.find(":") + 1 :].encode("utf-8")) % shards
+
+
+def format_entity_id(entity, id_format):
+    """
+    Changes format of entity id (the first field) in output entity.
+    prefixed = id with type prefix (e.g. p:Q42), bare = id without prefix (Q42),
+    both = id without prefix in the first field and id with prefix appended as the last field.
+    Ids without prefix are kept as they are (prefix can't be restored).
+    :param entity: list of entity fields, modified in place
+    :param id_format: one of ID_FORMATS
+    :return: modified entity
+    """
+    if id_format == "prefixed":
+        return entity
+    prefixed_id = entity[0]
+    prefix_end = prefixed_id.find(":")
+    if prefix_end < 0:
+        return entity
+    entity[0] = prefixed_id[prefix_end + 1 :]
+    if id_format == "both":
+        entity.append(prefixed_id)
+    return entity
+
+
+def get_shard_directory(shard):
+    """
+    Returns name of directory of output files belonging to the shard.
+    :param shard: index of shard
+    :return: name of directory
+    """
+    return f"shard{shard:03d}"
+
+
+def decode_entity_id(number):
+    """
+    Converts numeric id created by encode_entity_id() back to wikidata entity id.
+    :param number: numeric id
+    :return: wikidata id
+    """
+    return ENTITY_ID_KINDS[number >> ENTITY_ID_BITS] + str(
+        number & ((1 << ENTITY_ID_BITS) - 1)
+    )
+
 
 def get_args():
     """
@@ -33,7 +130,7 @@ def get_args():
         "--input-file",
         help="Input file to process.",
         required=True,
-        type=argparse.FileType("r"),
+        type=compressedFiles.FileType("r"),
     )
     argparser.add_argument(
         "-o",
@@ -145,11 +242,221 @@ def get_args():
     return argparser.parse_args()
 
 
+class LazyClaims(Mapping):
+    """
+    Claims of wikidata record decoded on demand.
+    Keeps span of raw json text for each property and decodes the property
+    on first access, properties that are never read are never decoded.
+    """
+
+    # start of top level statement list of property - "P31":[{"mainsnak":
+    # (qualifiers and references never start with mainsnak)
+    property_regexp = re.compile(r'"(P\d+)":\[\{"mainsnak":')
+
+    def __init__(self, line, start, end, properties=None):
+        """
+        Indexes properties of claims object.
+        :param line: json line with whole record
+        :param start: index of opening brace of claims object in line
+        :param end: index after closing brace of claims object in line
+        :param properties: ids of properties to index (None = all properties)
+                           other properties are handled as if they are not in claims
+        :raise ValueError if claims can't be indexed (unexpected json layout)
+        """
+        self.line = line
+        self.start = start
+        self.end = end
+        self.spans = {}  # property id -> (start, end) of its json value in line
+        self.decoded = {}  # already decoded properties
+
+        matches = list(self.property_regexp.finditer(line, start, end))
+        # each statement starts with mainsnak, otherwise some of them would be missed
+        statements = line.count('"mainsnak":', start, end)
+        if statements != len(matches) + line.count('},{"mainsnak":', start, end):
+            raise ValueError("Unexpected layout of claims!")
+        for i, match in enumerate(matches):
+            if properties is not None and match.group(1) not in properties:
+                continue
+            # value ends before comma of next property or before closing brace of claims
+            value_end = matches[i + 1].start() - 1 if i + 1 < len(matches) else end - 1
+            self.spans[match.group(1)] = (match.end() - len('[{"mainsnak":'), value_end)
+
+    def __getitem__(self, property_id):
+        if property_id in self.decoded:
+            return self.decoded[property_id]
+        span = self.spans[property_id]  # raises KeyError if property is missing
+        try:
+            value = json.loads(self.line[span[0] : span[1]])
+        except json.JSONDecodeError:
+            # span was not detected correctly - decode whole claims object
+            claims = json.loads(self.line[self.start : self.end])
+            value = claims[property_id]
+        self.decoded[property_id] = value
+        return value
+
+    def __contains__(self, property_id):
+        return property_id in self.spans
+
+    def __iter__(self):
+        return iter(self.spans)
+
+    def __len__(self):
+        return len(self.spans)
+
+
+class TsvWriter:
+    """
+    Buffered writer of tsv rows.
+    Each row is serialized by single join, rows are collected in memory
+    and written to the file in large batches.
+    """
+
+    def __init__(self, file, batch_size=OUTPUT_BUFFER_SIZE):
+        """
+        Initializes writer.
+        :param file: opened text or binary file where rows will be written to
+        :param batch_size: number of characters collected in memory before they are written to the file
+        """
+        self.file = file
+        self.batch_size = batch_size
+        self.batch = []  # serialized rows waiting for write
+        self.batch_length = 0  # number of characters in batch
+        # counters
+        self.rows_written = 0
+        self.bytes_written = 0
+        # batches are encoded once and written directly to the binary file
+        if isinstance(file, io.TextIOWrapper):
+            self.raw = file.buffer
+            self.encoding = file.encoding
+            self.errors = file.errors
+        elif isinstance(file, (io.RawIOBase, io.BufferedIOBase)):
+            self.raw = file
+            self.encoding = "utf-8"
+            self.errors = "strict"
+        else:  # other file like objects (StringIO, ...)
+            self.raw = None
+            self.encoding = "utf-8"
+            self.errors = "strict"
+
+    @classmethod
+    def open(cls, path, mode="w", batch_size=OUTPUT_BUFFER_SIZE, compression=None):
+        """
+        Opens file with large buffer and returns writer for it.
+        :param path: path to the file
+        :param mode: mode how to open file (w/a)
+        :param batch_size: see __init__()
+        :param compression: compression of the file (none/gzip/zstd, None = default compression)
+        :raise IOError if fails to open file
+        :return: TsvWriter instance
+        """
+        return cls(
+            compressedFiles.open_file(path, mode + "b", compression),
+            batch_size,
+        )
+
+    @classmethod
+    def wrap(cls, file):
+        """
+        Returns writer for given file, writers are returned unchanged.
+        :param file: opened file or TsvWriter
+        :return: TsvWriter instance
+        """
+        return file if isinstance(file, cls) else cls(file)
+
+    @property
+    def name(self):
+        return self.file.name
+
+    def write_row(self, fields):
+        """
+        Adds row to the batch, writes the batch if it is full.
+        :param fields: list of fields (strings) of the row
+        """
+        self.write("\t".join(fields) + "\n")
+        self.rows_written += 1
+
+    def write(self, data):
+        """
+        Adds raw string to the batch, writes the batch if it is full.
+        :param data: string to write
+        """
+        self.batch.append(data)
+        self.batch_length += len(data)
+        if self.batch_length >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes collected rows to the file.
+        :raise IOError if fails to write to file
+        """
+        if not self.batch:
+            return
+        data = "".join(self.batch)
+        self.batch = []
+        self.batch_length = 0
+        encoded = data.encode(self.encoding, self.errors)
+        if self.raw is not None:
+            if self.raw is not self.file:
+                self.file.flush()  # keep order of data already written to text layer
+            self.raw.write(encoded)
+        else:
+            self.file.write(data)
+        self.bytes_written += len(encoded)
+
+    def close(self):
+        """
+        Writes collected rows and closes the file.
+        """
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
 class WikidataDumpManipulator:
     """
     Includes some common functions needed for manipulating wikidata dump
     """
 
+    @staticmethod
+    def load_record(line, properties=None):
+        """
+        Converts json line of dump to dictionary without decoding claims.
+        Claims are replaced by LazyClaims object, which decodes each property on demand.
+        If claims can't be located safely, record is decoded completely.
+        :param line: json record (without trailing comma and newline)
+        :param properties: ids of properties that can be read from claims (None = all properties)
+        :raise json.JSONDecodeError if record is corrupted
+        :return: record converted to dict
+        """
+        start = line.find('"claims":{')
+        if start < 0 or line.find('"claims":{', start + 1) >= 0:
+            return json.loads(line)  # claims missing or ambiguous
+        start += len('"claims":')
+
+        # claims end before next top level key or before closing brace of record
+        end = -1
+        for key in CLAIMS_FOLLOWING_KEYS:
+            position = line.find(key, start)
+            if position >= 0 and (end < 0 or position < end):
+                end = position
+        if end < 0:
+            end = line.rfind("}")
+        if end <= start or not (line.endswith("]}", start, end) or end - start == 2):
+            return json.loads(line)
+
+        record = json.loads(line[:start] + "{}" + line[end:])
+        try:
+            record["claims"] = LazyClaims(line, start, end, properties)
+        except ValueError:
+            record["claims"] = json.loads(line[start:end])
+        return record
+
     @staticmethod
     def gen_multival_field(*args):
         """
@@ -164,11 +471,12 @@ class WikidataDumpManipulator:
         """
         Writes entity to tsv file
         :param entity: entity to write
-        :param file: file where entity will be written to
+        :param file: file (or TsvWriter) where entity will be written to
         """
-        for i in range(0, len(entity) - 1):
-            file.write(entity[i] + "\t")  # add tabs between fields
-        file.write(entity[-1] + "\n")  # add eol after last field
+        if isinstance(file, TsvWriter):
+            file.write_row(entity)
+        else:
+            file.write("\t".join(entity) + "\n")
 
 
 class WikidataDumpParser(WikidataDumpManipulator):
@@ -355,6 +663,26 @@ class WikidataDumpParser(WikidataDumpManipulator):
         :return: execution status
         """
 
+        # buffered writers of output files
+        output_file = TsvWriter.wrap(self.output_file) if self.output_file else None
+        dict_file = TsvWriter.wrap(self.dict_file) if self.dict_file else None
+        try:
+            self.parse_lines(output_file, dict_file)
+        finally:
+            if output_file:
+                output_file.flush()
+            if dict_file:
+                dict_file.flush()
+
+        return 0
+
+    def parse_lines(self, output_file, dict_file):
+        """
+        Parses lines of wikidata dump file
+        :param output_file: TsvWriter of output file (None = do not write entities)
+        :param dict_file: TsvWriter of dictionary file (None = do not write dictionary)
+        """
+
         for line in self.input_file:
 
             if self.dump_line:  # dump single line
@@ -380,17 +708,17 @@ class WikidataDumpParser(WikidataDumpManipulator):
                     if entity is None:  # entity missing id
                         self.corrupted_records += 1
                     else:
-                        if self.output_file:  # write entity to output file
-                            self.write_entity_to_tsv(entity, self.output_file)
+                        if output_file:  # write entity to output file
+                            self.write_entity_to_tsv(entity, output_file)
                         if self.buffer_entities:  # add to memory list of entities
                             self.entities.append(entity)
 
                         # generate dictionary file to replace IDs for names
                         # written fields: entity[0] == id, entity[2] == name
                         if entity[2]:  # check if name is not empty
-                            if self.dict_file:  # add to dictionary file
+                            if dict_file:  # add to dictionary file
                                 self.write_entity_to_tsv(
-                                    [entity[0], entity[2]], self.dict_file
+                                    [entity[0], entity[2]], dict_file
                                 )
                             if (
                                 self.buffer_dictionary
@@ -409,8 +737,6 @@ class WikidataDumpParser(WikidataDumpManipulator):
 
             self.line_number += 1
 
-        return 0
-
 
 class WikidataNameInterchanger(WikidataDumpManipulator):
     """
@@ -427,6 +753,7 @@ class WikidataNameInterchanger(WikidataDumpManipulator):
         show_missing=False,
         exclude=(0, 8, 9, 10, 11),
         remove_missing=False,
+        id_format="prefixed",
     ):
         # files
         self.output_file = (
@@ -447,6 +774,9 @@ class WikidataNameInterchanger(WikidataDumpManipulator):
         # removes ids with missing name instead of keeping them in KB
         self.remove_missing = remove_missing
 
+        # format of entity id in output (see format_entity_id())
+        self.id_format = id_format
+
         # excluded field indexes
         self.excluded = exclude  # array or tuple of indexes of fields where names will not be substituted
         # self.excluded: useful for site urls, ids, picture/file names, etc.
@@ -480,6 +810,20 @@ class WikidataNameInterchanger(WikidataDumpManipulator):
         if not self.dictionary:  # load dictionary from file
             self.load_dict_from_file()
 
+        output_file = TsvWriter.wrap(self.output_file)
+        try:
+            self.substitute_lines(input_data, output_file)
+        finally:
+            output_file.flush()
+
+        return 0
+
+    def substitute_lines(self, input_data, output_file):
+        """
+        Substitutes ids in given entities and writes them to the output.
+        :param input_data: entities (lists of fields) or tsv file lines
+        :param output_file: TsvWriter where translated entities will be written to
+        """
         for line in input_data:
             if type(line) == str:  # if input is tsv file line, split it to list by tabs
                 line = line[:-1]  # remove newline from end of the line
@@ -509,9 +853,9 @@ class WikidataNameInterchanger(WikidataDumpManipulator):
                         if not self.remove_missing:
                             results.append(value)
                 line[i] = "|".join(results)  # join results back to line field
-            self.write_entity_to_tsv(line, self.output_file)
-
-        return 0
+            if self.id_format != "prefixed":
+                line = format_entity_id(line, self.id_format)
+            self.write_entity_to_tsv(line, output_file)
 
     def load_dict_from_file(self):
         """
@@ -546,6 +890,7 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
         self.classes = classes if classes else {}  # dictionary with class relations
         self.dump_file = dump_file  # file with dump of class relations
         self.output_file = output_file  # file where to put processed entities
+        self.parents = {}  # entity types -> ranked parents (cleared when ancestors are modified)
 
     def add_class(self, class_id):
         """
@@ -567,6 +912,8 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
             self.add_class(class_id)
         # add ancestor class to list of ancestors
         self.classes[class_id]["ancestors"].append(ancestor_id)
+        if self.parents:
+            self.parents = {}
 
     def add_successor(self, class_id, successor_id):
         """
@@ -594,6 +941,7 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
         """
         if class_id in self.classes:
             self.classes[class_id]["ancestors"] = []
+            self.parents = {}
 
     def remove_class(self, class_id):
         """
@@ -602,6 +950,7 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
         """
         if class_id in self.classes:
             self.classes.pop(class_id)
+            self.parents = {}
 
     def dump(self):
         """
@@ -619,6 +968,7 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
         :raise IOError if fails to read from file
         """
         self.classes = json.loads(dump_file.read())
+        self.parents = {}
 
     def get_path_to_class(self, current_class, closed_nodes):
         """
@@ -683,38 +1033,28 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
 
         return paths
 
-    def get_parent_classes(self, current_class, depth, closed_nodes):
+    def get_parent_depths(self, entity_type):
         """
-        Returns current class and all parent classes on the path to the the root class
-        Includes class depth for sorting
-        :param current_class: class for which parent is returned
-        :param depth: depth of current class
-        :param closed_nodes: classes that are successors of current class and will not be expanded (detects cycles)
-        :return: list of all parents of current class and their depth
+        Returns direct types of entity and all their parent classes with minimal depth (breadth-first search)
+        :param entity_type: type of entity (classes that entity is instance of)
+        :return: dictionary {class: depth}, depth of direct types is 0
         """
-
-        classes = [
-            [current_class, depth]
-        ]  # classes to return (with current class added)
-
-        # class data are not parsed / class is root class or have no ancestors
-        if (
-            current_class not in self.classes
-            or len(self.classes[current_class]["ancestors"]) <= 0
-        ):
-            return classes
-        # class is its successor with cyclic dependency to itself
-        if current_class in closed_nodes:
-            return classes
-
-        closed_nodes.append(current_class)  # append current class to closed
-
-        for ancestor in self.classes[current_class]["ancestors"]:  # add all parents
-            classes.extend(self.get_parent_classes(ancestor, depth + 1, closed_nodes))
-
-        closed_nodes.pop()  # pop current class from the list before return
-
-        return classes
+        depths = dict.fromkeys(entity_type, 0)
+        level = list(depths)
+        depth = 0
+        while level:
+            depth += 1
+            next_level = []
+            for class_id in level:
+                # class data are not parsed / class is root class or have no ancestors
+                relations = self.classes.get(class_id)
+                if relations:
+                    for ancestor in relations["ancestors"]:
+                        if ancestor not in depths:  # shorter path is known (detects cycles)
+                            depths[ancestor] = depth
+                            next_level.append(ancestor)
+            level = next_level
+        return depths
 
     def get_all_parents(self, entity_type, remove_root_class, root_class):
         """
@@ -725,50 +1065,20 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
         :param root_class: root class id
         :return: list of all types sorted according to how far is the type from entity (specificity)
         """
-
-        # list of all types
-        new_types = []
-
-        # add all parents of direct types to new types
-        for t in entity_type:
-            new_types.extend(self.get_parent_classes(t, 0, []))
-
-        # FORMAT:
-        #  [ class_name , depth_number ]
-
-        # sort according to the type name
-        new_types.sort(key=lambda x: x[0])
-
-        # NOTE:
-        #  following constructions can't use for cycles
-        #  because size of list can change during the iteration
+        key = tuple(entity_type)
+        parents = self.parents.get(key)
+        if parents is None:
+            depths = self.get_parent_depths(entity_type)
+            # sort according to the depth (from lowest to highest) and type name
+            parents = tuple(sorted(depths, key=lambda t: (depths[t], t)))
+            if len(self.parents) >= PARENTS_CACHE_SIZE:
+                self.parents = {}
+            self.parents[key] = parents
 
         # remove root class from list
         if remove_root_class and root_class:
-            i = 0
-            while i < len(new_types):
-                if new_types[i][0] == root_class:
-                    new_types.pop(i)
-                else:
-                    i += 1
-
-        # remove duplicates, keep only the those with lowes depth
-        if len(new_types) >= 2:
-            i = 1
-            while i < len(new_types):
-                if new_types[i][0] == new_types[i - 1][0]:
-                    if new_types[i][1] > new_types[i - 1][1]:
-                        new_types.pop(i)
-                    else:
-                        new_types.pop(i - 1)
-                else:
-                    i += 1
-
-        # sort according to the depth (from highest to lowest)
-        new_types.sort(key=lambda x: x[1])
-
-        # remove depth numbers before return
-        return [t[0] for t in new_types]
+            return [t for t in parents if t != root_class]
+        return list(parents)
 
     def replace_types_of_entities(
         self, entities, full_path=False, remove_root_class=False, root_class=None
@@ -782,6 +1092,7 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
         :param root_class: root class id (used only if full_paths=False)
         """
         file = False
+        output_file = TsvWriter.wrap(self.output_file) if self.output_file else None
         for entity in entities:
             if (
                 type(entity) == str
@@ -799,16 +1110,19 @@ class ClassRelationsBuilder(WikidataDumpManipulator):
             types = "|".join(types)
             entity[1] = types
             if file:
-                self.write_entity_to_tsv(entity, self.output_file)
+                self.write_entity_to_tsv(entity, output_file)
+        if output_file:
+            output_file.flush()
 
 
-def gen_temp_file(file_path, mode, tag=""):
+def gen_temp_file(file_path, mode, tag="", buffering=OUTPUT_BUFFER_SIZE):
     """
     Generates temporary file in folder given by path
     :param file_path: path to the file that will be appended before the name
     :param mode: mode how to open file (read/write/...), compatible with build-in open() command
                  makes sense only for modes that will create file, because it doesnt exists before opening
     :param tag: string that is added to the name before suffix - hash_tag.suffix
+    :param buffering: size of file buffer
     :return: opened temp file handle
     """
     if not os.path.isdir(file_path):
@@ -827,7 +1141,7 @@ def gen_temp_file(file_path, mode, tag=""):
         )
 
     # return file handle
-    return open(os.path.join(file_path, file_name), mode)
+    return open(os.path.join(file_path, file_name), mode, buffering=buffering)
 
 
 def parse_only(args):
@@ -921,7 +1235,13 @@ def substitute_names_only(args):
         return 2
     else:
         try:
-            dict_file = open(args.dict_file, "r")
+            # binary dictionary is memory mapped, tsv dictionary is loaded to memory
+            if nameDictionary.is_name_dictionary(args.dict_file):
+                dictionary = nameDictionary.NameDictionary(args.dict_file)
+                dict_file = None
+            else:
+                dictionary = None
+                dict_file = compressedFiles.open_file(args.dict_file, "r")
         except Exception:
             sys.stderr.write(
                 SCRIPT_NAME
@@ -936,6 +1256,7 @@ def substitute_names_only(args):
     name_changer = WikidataNameInterchanger(
         input_file=args.input_file,
         dict_file=dict_file,
+        dictionary=dictionary,
         output_file=args.output_file,
         show_missing=args.show_missing,
     )
@@ -970,7 +1291,10 @@ def substitute_names_only(args):
     finally:
         args.output_file.close()
         args.input_file.close()
-        dict_file.close()
+        if dict_file:
+            dict_file.close()
+        else:
+            dictionary.close()
         return return_code
 
 
@@ -986,7 +1310,7 @@ def substitute_type_only(args):
         return 2
     else:
         try:
-            class_relations_dump = open(args.class_relations_dump, "r")
+            class_relations_dump = compressedFiles.open_file(args.class_relations_dump, "r")
         except Exception:
             sys.stderr.write(
                 SCRIPT_NAME
@@ -1074,10 +1398,6 @@ def complete_parsing(args):
                 class_relations_dump.close()
             return 1
 
-    # TODO
-    #  add bigger buffers to files
-    #  (about 8MB) - (default is 8kB)
-
     # class relations
     relations_builder = ClassRelationsBuilder()
     # add dump file
@@ -12,8 +12,11 @@ import os  # filesystem
 import re  # find ids for substitution
 import sys  # stderr, exit, ...
 import traceback  # for printing exceptions
+from collections.abc import Mapping  # claims of record (dict or LazyClaims)
 
 import classRelationsBuilder  # for ClassRelationsBuilder
+import compressedFiles  # compressed input and output files
+import crosswalkIndex  # default external identifier properties
 import parseJson2  # for wikidata dump manipulator
 
 # get script name
@@ -42,7 +45,7 @@ def get_args():
         "--input-file",
         help="Input file to process.",
         required=True,
-        type=argparse.FileType("r"),
+        type=compressedFiles.FileType("r"),
     )
     argparser.add_argument(
         "-t",
@@ -62,6 +65,13 @@ def get_args():
         required=False,
         default="en",
     )
+    argparser.add_argument(
+        "--compression",
+        help="Compression of output files (default: OUTPUT_COMPRESSION from env_variables.cfg).",
+        required=False,
+        choices=sorted(compressedFiles.COMPRESSION_SUFFIXES),
+        default=None,
+    )
     argparser.add_argument(
         "-c",
         "--extract-class-relations",
@@ -78,6 +88,39 @@ def get_args():
         default=False,
         action="store_true",
     )
+    argparser.add_argument(
+        "--lazy-claims",
+        help="Decode only claims read by the parser and only when they are read"
+        " (speeds up parsing of large entities).",
+        required=False,
+        default=False,
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--shards",
+        help="Split outputs to given number of shards by hash of entity id"
+        " (shard subdirectories of each output directory, default=%(default)s = no sharding).",
+        required=False,
+        type=int,
+        default=1,
+    )
+    argparser.add_argument(
+        "--id-format",
+        help="Format of entity ids in type files: prefixed = with type prefix (e.g. p:Q42), bare = without"
+        " prefix, both = bare id and prefixed id as the last field (default=%(default)s).",
+        required=False,
+        choices=parseJson2.ID_FORMATS,
+        default="prefixed",
+    )
+    argparser.add_argument(
+        "--external-ids",
+        help="Collect external identifiers of entities to crosswalk file (see crosswalkIndex.py), optionally"
+        " only given properties (default: " + " ".join(crosswalkIndex.DEFAULT_PROPERTIES) + ").",
+        required=False,
+        nargs="*",
+        metavar="PROPERTY",
+        default=None,
+    )
     argparser.add_argument(
         "-q",
         "--quiet",
@@ -121,6 +164,7 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
         Add new method parse_nameoftype(self, record) to the parser class
         - method will be automatically called if entity with this type is detected
         - see extend_entity_data() method
+        Add ids of properties read by the new method to self.claims_projection
     """
 
     def __init__(
@@ -133,6 +177,11 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
         line=0,
         class_relations_builder=None,
         parse_expanded_instances=False,
+        lazy_claims=False,
+        compression=None,
+        shards=1,
+        id_format="prefixed",
+        external_ids=None,
     ):
         """
         Initializes parser.
@@ -144,6 +193,13 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
         :param line: line of dump to parse (dumps single line) (0 = whole dump)
         :param class_relations_builder: ClassRelationsBuilder instance for class relations processing
         :param parse_expanded_instances: Tells if expanded instance kb should be generated (True/False)
+        :param lazy_claims: Decode only claims listed in self.claims_projection on demand (True/False)
+        :param compression: compression of output files (none/gzip/zstd, None = default compression)
+        :param shards: number of shards outputs are split to by hash of entity id (1 = no sharding)
+        :param id_format: format of entity ids in type files (see parseJson2.format_entity_id())
+        :param external_ids: properties of external identifiers written to crosswalk files
+                             (None = identifiers are not collected)
+        :raise ValueError if number of shards is not positive or id format is not supported
         """
         self.lang = lang
         self.default_lang = "en"  # language for name extraction if name for selected language is missing
@@ -161,6 +217,30 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
         self.class_relations_builder = class_relations_builder
         # parse expanded instances
         self.parse_expanded_instances = parse_expanded_instances
+        # decode claims on demand
+        self.lazy_claims = lazy_claims
+        # claims read by parse_record() and type specific parse methods
+        # only these are decoded if lazy claims decoding is used
+        # (add property here when new property is parsed!)
+        self.claims_projection = {
+            # parse_record
+            "P31", "P18", "P279",
+            # person
+            "P21", "P569", "P19", "P570", "P20", "P27",
+            # group
+            "P527",
+            # artist
+            "P106", "P737", "P245",
+            # geographical
+            "P625", "P17", "P1082", "P2044", "P610", "P2046", "P421", "P474", "P473", "P1566",
+            # event
+            "P580", "P582", "P276",
+            # organization
+            "P571", "P576", "P159",
+        }
+        # properties of external identifiers collected to crosswalk files
+        self.external_ids = list(external_ids) if external_ids is not None else []
+        self.claims_projection.update(self.external_ids)
         # types definition:
         self.types = {
             "person": ["Q5", "Q15632617", "Q3658341"],
@@ -1169,18 +1249,32 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
             "artwork": "aw:",
             "general": "x:",  # this is used when entity doesn't belong to any other type
         }
+        # compression of output files
+        self.compression = (
+            compression if compression else compressedFiles.get_default_compression()
+        )
+        # number of shards of outputs (see parseJson2.get_entity_shard())
+        if shards < 1:
+            raise ValueError("Number of shards has to be positive!")
+        self.shards = shards
+        # format of entity ids in type files
+        if id_format not in parseJson2.ID_FORMATS:
+            raise ValueError(f"Unsupported id format '{id_format}'!")
+        self.id_format = id_format
         # input file
         self.input_file = input_file
-        # output files bindings
-        self.output_files = {}
-        # dictionary output file
-        self.dict_file = None
-        # class relations output file
+        # output files bindings of each shard
+        self.output_files = []
+        # dictionary output file of each shard
+        self.dict_files = []
+        # external identifiers output file of each shard
+        self.crosswalk_files = []
+        # class relations output file (class relations are not sharded)
         self.class_relations_file = None
-        # instance - class relations output file
-        self.instance_relations_file = None
-        # expanded instances output file
-        self.expanded_instances_output_file = None
+        # instance - class relations output file of each shard
+        self.instance_relations_files = []
+        # expanded instances output file of each shard
+        self.expanded_instances_output_files = []
         # call function for opening output files
         self.open_output_files(output_folder, output_files_tag)
 
@@ -1220,6 +1314,8 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
         """
         Opens output files for each type that have defined prefix in self.type_prefix
         File descriptors are stored in self.output_files, under name of type file belongs to
+        (self.output_files, self.dict_files, ... contain files of each shard, files of shards are stored
+        in shard subdirectories of output directories if outputs are sharded)
         :param output_folder: path to folder, where files will be generated
         :param output_files_tag: tag added to name of each file
         :raise IOError if fails to open output file
@@ -1227,50 +1323,124 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
         if output_folder[-1] == "/" or not os.path.isdir(output_folder):
             output_folder = os.path.dirname(output_folder)
         output_files_tag = "_" + output_files_tag if output_files_tag else ""
+        suffix = compressedFiles.get_compression_suffix(self.compression)
+        # all shards are written at once, so they share the default buffer size
+        batch_size = max(
+            parseJson2.OUTPUT_BUFFER_SIZE // self.shards, parseJson2.MIN_BUFFER_SIZE
+        )
 
-        # open output files for each type
-        for type_name in self.type_prefix.keys():
-            self.output_files[type_name] = open(
-                f'{output_folder}/{os.environ["DIRNAME_TYPES_DATA"]}/{type_name}{output_files_tag}.tsv',
-                "w",
-            )  # mode
-        # open dictionary file
-        fpath_dict = f'{output_folder}/{os.environ["DIRNAME_DICTS"]}/dict{output_files_tag}.tsv'
-        os.makedirs(os.path.dirname(fpath_dict), exist_ok=True)
-        self.dict_file = open(fpath_dict, "w")
-        # open expanded instances output file
-        if self.parse_expanded_instances:
-            fpath_expanded_instance = f'{output_folder}/{os.environ["DIRNAME_EXPANDED_INSTANCES"]}/expanded_instances{output_files_tag}.tsv'
-            os.makedirs(os.path.dirname(fpath_expanded_instance), exist_ok=True)
-            self.expanded_instances_output_file = open(
-                fpath_expanded_instance,
-                "w",
+        def get_path(dirname_variable, file_name, shard):
+            directory = f"{output_folder}/{os.environ[dirname_variable]}"
+            if self.shards > 1:
+                directory += "/" + parseJson2.get_shard_directory(shard)
+            os.makedirs(directory, exist_ok=True)
+            return f"{directory}/{file_name}"
+
+        for shard in range(self.shards):
+            # open output files for each type
+            output_files = {}
+            for type_name in self.type_prefix.keys():
+                output_files[type_name] = parseJson2.TsvWriter.open(
+                    get_path(
+                        "DIRNAME_TYPES_DATA", f"{type_name}{output_files_tag}.tsv{suffix}",
+                        shard,
+                    ),
+                    "w",
+                    batch_size=batch_size,
+                    compression=self.compression,
+                )  # mode
+            self.output_files.append(output_files)
+            # open dictionary file
+            self.dict_files.append(
+                parseJson2.TsvWriter.open(
+                    get_path(
+                        "DIRNAME_DICTS", f"dict{output_files_tag}.tsv{suffix}", shard
+                    ),
+                    "w",
+                    batch_size=batch_size,
+                    compression=self.compression,
+                )
             )
-        # open class relations builder output files
+            # open external identifiers file
+            if self.external_ids:
+                self.crosswalk_files.append(
+                    parseJson2.TsvWriter.open(
+                        get_path(
+                            "DIRNAME_DICTS", f"crosswalk{output_files_tag}.tsv{suffix}", shard
+                        ),
+                        "w",
+                        batch_size=batch_size,
+                        compression=self.compression,
+                    )
+                )
+            # open expanded instances output file
+            if self.parse_expanded_instances:
+                self.expanded_instances_output_files.append(
+                    parseJson2.TsvWriter.open(
+                        get_path(
+                            "DIRNAME_EXPANDED_INSTANCES",
+                            f"expanded_instances{output_files_tag}.tsv{suffix}",
+                            shard,
+                        ),
+                        "w",
+                        batch_size=batch_size,
+                        compression=self.compression,
+                    )
+                )
+            # open instance relations output file
+            if self.class_relations_builder:
+                self.instance_relations_files.append(
+                    compressedFiles.open_file(
+                        get_path(
+                            "DIRNAME_INSTANCES", f"instances{output_files_tag}.bin{suffix}",
+                            shard,
+                        ),
+                        "wb",
+                        self.compression,
+                    )
+                )
+        # open class relations builder output file
         if self.class_relations_builder:
-            fpath_class = f'{output_folder}/{os.environ["DIRNAME_CLASSES"]}/classes{output_files_tag}.json'
+            fpath_class = f'{output_folder}/{os.environ["DIRNAME_CLASSES"]}/classes{output_files_tag}.json{suffix}'
             os.makedirs(os.path.dirname(fpath_class), exist_ok=True)
-            self.class_relations_file = open(fpath_class, "w")
-            fpath_instance = (
-                f'{output_folder}/{os.environ["DIRNAME_INSTANCES"]}/instances{output_files_tag}.json'
+            self.class_relations_file = compressedFiles.open_file(
+                fpath_class, "w", self.compression
             )
-            os.makedirs(os.path.dirname(fpath_instance), exist_ok=True)
-            self.instance_relations_file = open(fpath_instance, "w")
 
     def close_output_files(self):
         """
         Closes output files opened by self.open_output_files() method
         """
-        for f in self.output_files.values():
+        for output_files in self.output_files:
+            for f in output_files.values():
+                f.close()
+        for f in self.dict_files:
+            f.close()
+        for f in self.crosswalk_files:
+            f.close()
+        for f in self.expanded_instances_output_files:
             f.close()
-        self.dict_file.close()
-        if self.parse_expanded_instances:
-            self.expanded_instances_output_file.close()
         if self.class_relations_builder:  # save buffers and close output
             self.class_relations_builder.save_dump(self.class_relations_file)
-            self.class_relations_builder.save_instances(self.instance_relations_file)
             self.class_relations_file.close()
-            self.instance_relations_file.close()
+            self.class_relations_builder.save_instance_shards(self.instance_relations_files)
+            for f in self.instance_relations_files:
+                f.close()
+
+    def get_written_statistics(self):
+        """
+        Returns number of rows and bytes written to tsv output files.
+        :return: tuple (rows, bytes)
+        """
+        writers = (
+            self.dict_files + self.crosswalk_files + self.expanded_instances_output_files
+        )
+        for output_files in self.output_files:
+            writers += output_files.values()
+        return (
+            sum(w.rows_written for w in writers),
+            sum(w.bytes_written for w in writers),
+        )
 
     def parse_name(self, label_field):
         """
@@ -1438,7 +1608,11 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
                         :-1
                     ]  # last record doesn't have comma, remove only newline
                 try:
-                    record = json.loads(line)  # convert to dictionary
+                    # convert to dictionary
+                    if self.lazy_claims:
+                        record = self.load_record(line, self.claims_projection)
+                    else:
+                        record = json.loads(line)
                 except json.JSONDecodeError:
                     self.corrupted_records += 1
                 else:
@@ -1449,15 +1623,26 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
                     elif not entity[2]:  # drop entities without names
                         self.corrupted_records += 1
                     else:
+                        # all outputs of entity are written to the same shard
+                        shard = parseJson2.get_entity_shard(entity[0], self.shards)
+
                         # generate dictionary file to replace IDs for names
                         # written fields: entity[0] == id, entity[2] == name / label
                         # add entity to dictionary
-                        self.write_entity_to_tsv([entity[0], entity[2]], self.dict_file)
+                        self.write_entity_to_tsv(
+                            [entity[0], entity[2]], self.dict_files[shard]
+                        )
+
+                        # write external identifiers of entity
+                        if self.external_ids:
+                            self.write_external_ids(
+                                entity[0], record, self.crosswalk_files[shard]
+                            )
 
                         # write entity to expanded instances kb
                         if self.parse_expanded_instances:
                             self.write_entity_to_tsv(
-                                entity, self.expanded_instances_output_file
+                                entity, self.expanded_instances_output_files[shard]
                             )
 
                         # modify entity type to output format
@@ -1465,9 +1650,12 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
 
                         # extend entity with type specific information
                         entity = self.extend_entity_data(entity, record)
+                        entity = parseJson2.format_entity_id(entity, self.id_format)
 
                         # write entity to output file according to the type
-                        self.write_entity_to_tsv(entity, self.output_files[entity[1]])
+                        self.write_entity_to_tsv(
+                            entity, self.output_files[shard][entity[1]]
+                        )
 
                         self.processed_records += 1
 
@@ -1483,6 +1671,32 @@ class SimpleWikidataDumpParser(parseJson2.WikidataDumpManipulator):
 
         return 0
 
+    def write_external_ids(self, entity_id, record, output_file):
+        """
+        Writes external identifiers of entity to crosswalk file.
+        Written fields: property id, external identifier, entity id (deprecated statements are skipped).
+        :param entity_id: id of the entity
+        :param record: record of the entity
+        :param output_file: crosswalk output file
+        """
+        claims = record.get("claims")
+        if not isinstance(claims, Mapping):  # no claims (empty claims are written as [])
+            return
+        for property_id in self.external_ids:
+            try:
+                statements = claims[property_id]
+            except KeyError:
+                continue
+            for statement in statements:
+                if statement.get("rank") == "deprecated":
+                    continue
+                try:
+                    value = statement["mainsnak"]["datavalue"]["value"]
+                except KeyError:  # no value / unknown value
+                    continue
+                if isinstance(value, str) and "\t" not in value and "\n" not in value:
+                    self.write_entity_to_tsv([property_id, value, entity_id], output_file)
+
     def extend_entity_data(self, entity, record):
         """
         Extends entity by adding type specific information.
@@ -2011,6 +2225,15 @@ def main():
             class_relations_builder=class_relations_builder,
             parse_expanded_instances=args.parse_expanded_instances,
             lang=args.language,
+            lazy_claims=args.lazy_claims,
+            compression=args.compression,
+            shards=args.shards,
+            id_format=args.id_format,
+            external_ids=(
+                (args.external_ids or list(crosswalkIndex.DEFAULT_PROPERTIES))
+                if args.external_ids is not None
+                else None
+            ),
         )
     except Exception:
         sys.stderr.write(
@@ -2048,6 +2271,10 @@ def main():
     finally:
         args.input_file.close()
         parser.close_output_files()
+        if not args.quiet and not exit_code:
+            rows_written, bytes_written = parser.get_written_statistics()
+            print("Written rows: " + str(rows_written))
+            print("Written bytes: " + str(bytes_written))
         return exit_code
 
 
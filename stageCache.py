@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: stageCache.py
+# Project: wikidata2
+# Description: Records inputs, tools and parameters of pipeline stages and skips stages which are up to date.
+#              Manifest of each stage contains key computed from content hashes of input files, hashes
+#              of tools (scripts) used by the stage and stage parameters, and content hashes of stage outputs.
+#              Stage is up to date if its key did not change and its outputs were not modified.
+#              Content hashes are cached by path, size and modification time, so unchanged files are not
+#              read again.
+
+import argparse
+import hashlib  # content hashes
+import json  # manifests
+import os  # filesystem
+import subprocess  # commands of stages
+import sys  # stderr, exit
+import tempfile  # atomic writes of manifests
+import threading  # stages run in parallel threads
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# version of manifest format, manifests of other versions are ignored
+MANIFEST_VERSION = 1
+# file with cached content hashes in cache directory
+HASH_CACHE_FILE = "hashes.json"
+# size of blocks read when hashing files
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Checks if pipeline stage is up to date and records finished stages."
+    )
+    argparser.add_argument(
+        "action",
+        help="check = exit with 0 if stage is up to date (1 otherwise),"
+        " record = record finished stage, run = run command given after '--' unless stage is up to date.",
+        choices=["check", "record", "run"],
+    )
+    argparser.add_argument(
+        "-c", "--cache-dir", help="Directory with stage manifests.", required=True
+    )
+    argparser.add_argument("-s", "--stage", help="Name of the stage.", required=True)
+    argparser.add_argument(
+        "-i",
+        "--inputs",
+        help="Input files or directories of the stage.",
+        nargs="*",
+        default=[],
+    )
+    argparser.add_argument(
+        "-o",
+        "--outputs",
+        help="Output files or directories of the stage.",
+        nargs="*",
+        default=[],
+    )
+    argparser.add_argument(
+        "-t",
+        "--tools",
+        help="Scripts used by the stage (their content is part of the stage version).",
+        nargs="*",
+        default=[],
+    )
+    argparser.add_argument(
+        "-p",
+        "--params",
+        help="Parameters of the stage (name=value).",
+        nargs="*",
+        default=[],
+    )
+    # command of the stage follows '--' and is not parsed
+    argv = sys.argv[1:]
+    separator = argv.index("--") if "--" in argv else len(argv)
+    args = argparser.parse_args(argv[:separator])
+    args.command = argv[separator + 1 :]
+    return args
+
+
+class StageCache:
+    """
+    Cache of pipeline stage manifests.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Opens cache directory.
+        :param cache_dir: directory where manifests and cached hashes are stored
+        :raise OSError if fails to create directory
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hash_cache_path = os.path.join(cache_dir, HASH_CACHE_FILE)
+        try:
+            with open(self.hash_cache_path, "r", encoding="utf-8") as file:
+                self.hash_cache = json.load(file)
+        except (IOError, ValueError):
+            self.hash_cache = {}
+        self.hash_cache_changed = False
+        self.lock = threading.Lock()  # guards cached hashes
+
+    def get_file_hash(self, path):
+        """
+        Returns content hash of file (cached by path, size and modification time).
+        :param path: path to the file
+        :raise IOError if fails to read from file
+        :return: sha256 hex digest
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.hash_cache.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        digest = digest.hexdigest()
+        with self.lock:
+            self.hash_cache[path] = [stat.st_size, stat.st_mtime_ns, digest]
+            self.hash_cache_changed = True
+        return digest
+
+    def get_hash(self, path):
+        """
+        Returns content hash of file or directory (directory hash covers names and content of all its files).
+        :param path: path to the file or directory
+        :raise IOError if fails to read
+        :return: sha256 hex digest, None if path does not exist
+        """
+        if not os.path.exists(path):
+            return None
+        if not os.path.isdir(path):
+            return self.get_file_hash(path)
+
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode("utf-8") + b"\0")
+                digest.update(self.get_file_hash(file_path).encode("ascii"))
+        return digest.hexdigest()
+
+    def get_stage_key(self, inputs, tools=(), params=None):
+        """
+        Computes key of stage from its inputs, tools and parameters.
+        :param inputs: paths to input files or directories
+        :param tools: paths to scripts used by the stage
+        :param params: dictionary with parameters of the stage (json serializable)
+        :raise IOError if fails to read input
+        :raise ValueError if input or tool does not exist
+        :return: sha256 hex digest
+        """
+        description = {"inputs": [], "tools": [], "params": params if params else {}}
+        for kind, paths in (("inputs", inputs), ("tools", tools)):
+            for path in paths:
+                path_hash = self.get_hash(path)
+                if path_hash is None:
+                    raise ValueError(f"Stage {kind[:-1]} '{path}' does not exist!")
+                description[kind].append([os.path.abspath(path), path_hash])
+        return hashlib.sha256(
+            json.dumps(description, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get_manifest_path(self, stage):
+        """
+        Returns path to the manifest of stage.
+        :param stage: name of the stage
+        :return: path to the manifest
+        """
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in stage)
+        return os.path.join(self.cache_dir, "stage_" + name + ".json")
+
+    def load_manifest(self, stage):
+        """
+        Loads manifest of stage.
+        :param stage: name of the stage
+        :return: manifest dictionary, None if stage was not recorded
+        """
+        try:
+            with open(self.get_manifest_path(stage), "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (IOError, ValueError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("stage") != stage:
+            return None
+        return manifest
+
+    def is_up_to_date(self, stage, key, outputs):
+        """
+        Tells if stage with given key was recorded and its outputs were not changed since.
+        :param stage: name of the stage
+        :param key: key of the stage (see get_stage_key())
+        :param outputs: paths to output files or directories
+        :raise IOError if fails to read output
+        :return: True if stage can be skipped
+        """
+        manifest = self.load_manifest(stage)
+        if manifest is None or manifest["key"] != key:
+            return False
+        recorded = dict(manifest["outputs"])
+        for path in outputs:
+            path = os.path.abspath(path)
+            if path not in recorded or self.get_hash(path) != recorded[path]:
+                return False
+        return True
+
+    def record(self, stage, key, outputs):
+        """
+        Records finished stage.
+        :param stage: name of the stage
+        :param key: key of the stage (see get_stage_key())
+        :param outputs: paths to output files or directories
+        :raise IOError if fails to read output or write manifest
+        :raise ValueError if output does not exist
+        """
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "stage": stage,
+            "key": key,
+            "outputs": [],
+        }
+        for path in outputs:
+            path_hash = self.get_hash(path)
+            if path_hash is None:
+                raise ValueError(f"Stage output '{path}' does not exist!")
+            manifest["outputs"].append([os.path.abspath(path), path_hash])
+        self.write_json(self.get_manifest_path(stage), manifest)
+        self.save()
+
+    def invalidate(self, stage):
+        """
+        Removes manifest of stage, so the stage is not up to date anymore.
+        :param stage: name of the stage
+        """
+        path = self.get_manifest_path(stage)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def run(self, stage, inputs, outputs, action, tools=(), params=None, force=False):
+        """
+        Runs stage unless it is up to date.
+        :param stage: name of the stage
+        :param inputs: paths to input files or directories
+        :param outputs: paths to output files or directories created by the stage
+        :param action: command (list of arguments) or function without arguments
+        :param tools: paths to scripts used by the stage
+        :param params: dictionary with parameters of the stage (json serializable)
+        :param force: run stage even if it is up to date
+        :raise subprocess.CalledProcessError if command fails
+        :raise IOError if fails to read inputs or outputs
+        :raise ValueError if input, tool or output does not exist
+        :return: True if stage was run, False if it was skipped
+        """
+        key = self.get_stage_key(inputs, tools, params)
+        if not force and self.is_up_to_date(stage, key, outputs):
+            return False
+
+        self.invalidate(stage)  # outputs are overwritten
+        if callable(action):
+            action()
+        else:
+            subprocess.run(action, check=True)
+        self.record(stage, key, outputs)
+        return True
+
+    def save(self):
+        """
+        Saves cached content hashes.
+        :raise IOError if fails to write to file
+        """
+        with self.lock:
+            if not self.hash_cache_changed:
+                return
+            hash_cache = dict(self.hash_cache)
+            self.hash_cache_changed = False
+        self.write_json(self.hash_cache_path, hash_cache)
+
+    def write_json(self, path, data):
+        """
+        Writes json file atomically (concurrent readers never see partial file).
+        :param path: path to the file
+        :param data: data to write
+        :raise IOError if fails to write to file
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with open(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file, indent=4, sort_keys=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def parse_params(params):
+    """
+    Converts name=value parameters from command line to dictionary.
+    :param params: list of name=value strings
+    :raise ValueError if parameter does not contain '='
+    :return: dictionary with parameters
+    """
+    result = {}
+    for param in params:
+        if "=" not in param:
+            raise ValueError(f"Parameter '{param}' is not in name=value format!")
+        name, value = param.split("=", 1)
+        result[name] = value
+    return result
+
+
+def main():
+    args = get_args()
+
+    if args.action == "run" and not args.command:
+        sys.stderr.write("Command of the stage is not set!\n")
+        return 2
+
+    try:
+        cache = StageCache(args.cache_dir)
+        params = parse_params(args.params)
+        if args.action == "run":
+            if not cache.run(
+                args.stage, args.inputs, args.outputs, args.command, args.tools, params
+            ):
+                print(f"Stage {args.stage} is up to date, skipped.")
+            return 0
+        key = cache.get_stage_key(args.inputs, args.tools, params)
+        if args.action == "check":
+            up_to_date = cache.is_up_to_date(args.stage, key, args.outputs)
+            cache.save()
+            return 0 if up_to_date else 1
+        cache.record(args.stage, key, args.outputs)
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write(f"{SCRIPT_NAME}: Stage {args.stage} failed ({e.returncode})!\n")
+        return e.returncode
+    except (IOError, OSError, ValueError) as e:
+        sys.stderr.write(f"{SCRIPT_NAME}: {e}\n")
+        return 2
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -158,21 +158,73 @@ fi
 ip -4 addr | grep -PA1 "^[0-9]+:\se[nt]" | grep -oP "(?<=inet\s)\d+(\.\d+){3}" > "${project_folder}/${FILE_MASTER_IPS}"
 ip -6 addr | grep -PA1 "^[0-9]+:\se[nt]" | grep -oP "(?<=inet6\s)[0-9a-f]+(\:+[0-9a-f]+)+" >> "${project_folder}/${FILE_MASTER_IPS}"
 
-# start dump extraction
-sh "$dump_parser" "$dump_name" "$lang" "${tag}"
-parser_error_code=$?
+# stages are skipped if their inputs, scripts and parameters did not change (see stageCache.py)
+stage_cache="python3 ${project_folder}/stageCache.py"
+stage_cache_dir="`getProjectTempBaseDir "${dump_name}" "${lang}" "${tag}" "${project_folder}"`/stage_cache"
+# folder with dump parts (see start_parsing_parallel.sh)
+dump_src="/mnt/data/wikidata/${dump_name}"
 
-if [ $parser_error_code -ne 0 ]; then
-  echo "Dump extraction failed!" >&2
-  exit $parser_error_code
+# scripts run by extraction (see start_parsing_parallel.sh and expand_instances.sh)
+extraction_tools=""
+for tool in start_parsing_parallel.sh expand_instances.sh wikidata_lib.sh timestamp.sh \
+            parseWikidataDump.py parseJson2.py compressedFiles.py nameDictionary.py externalSort.py \
+            crosswalkIndex.py classRelationsBuilder.py classGraph.py instanceStore.py substituteNames.py \
+            columnarKB.py geoIndex.py temporalIndex.py kbStore.py \
+            env_variables.cfg config/hosts.list; do
+  extraction_tools="${extraction_tools} ${project_folder}/${tool}"
+done
+
+extraction_stage_args="-c ${stage_cache_dir} -s extraction -i ${dump_src} \
+  -t ${extraction_tools} \
+  -p lang=${lang} -o ${out_dir}"
+
+if $stage_cache check $extraction_stage_args; then
+  echo "Extraction of dump is up to date, skipped."
+else
+  # start dump extraction
+  sh "$dump_parser" "$dump_name" "$lang" "${tag}"
+  parser_error_code=$?
+
+  if [ $parser_error_code -ne 0 ]; then
+    echo "Dump extraction failed!" >&2
+    exit $parser_error_code
+  fi
+
+  # spatial index of places is stored next to the geographical KB (see geoIndex.py)
+  python3 "${project_folder}/geoIndex.py" -f "${geographical_file}"
+  geo_index_error_code=$?
+
+  if [ $geo_index_error_code -ne 0 ]; then
+    echo "Building of spatial index failed!" >&2
+    exit $geo_index_error_code
+  fi
+
+  # temporal indexes of dated KBs are stored next to them (see temporalIndex.py)
+  python3 "${project_folder}/temporalIndex.py" -f "${persons_file}" --type person &&
+  python3 "${project_folder}/temporalIndex.py" -f "${artist_file}" --type person+artist &&
+  python3 "${project_folder}/temporalIndex.py" -f "${event_file}" --type event &&
+  python3 "${project_folder}/temporalIndex.py" -f "${organization_file}" --type organization
+  temporal_index_error_code=$?
+
+  if [ $temporal_index_error_code -ne 0 ]; then
+    echo "Building of temporal indexes failed!" >&2
+    exit $temporal_index_error_code
+  fi
+
+  if ! $stage_cache record $extraction_stage_args; then
+    echo "Warning: Extraction stage was not recorded, it will be repeated next time"'!' >&2
+  fi
 fi
 
-for file in ${persons_file} ${group_file} ${artist_file} ${geographical_file} ${event_file} ${organization_file} ${artwork_file}
-do
-  sed -i "s/^[^\t]*://" "${file}"
-done
+merge_stage_args="-c ${stage_cache_dir} -s merge \
+  -i ${persons_file} ${group_file} ${artist_file} ${geographical_file} ${event_file} ${organization_file} ${artwork_file} \
+     ${project_folder}/merge_KB/HEAD ${project_folder}/merge_KB/*/*.fields ${project_folder}/merge_KB/*/*.conf \
+  -t ${project_folder}/merge_KB/*.sh ${project_folder}/merge_KB/kb_tools ${project_folder}/wikidata_lib.sh \
+  -p lang=${lang} -o ${project_folder}/merge_KB/output/${dump_name}/${lang}"
 
-if [ "$lang" = 'cs' ]; then
+if $stage_cache check $merge_stage_args; then
+  echo "Merged KB is up to date, skipped."
+elif [ "$lang" = 'cs' ]; then
   # merge dump with entity_kb_czech9
   sh "$merge_script" -d "$dump_name" -g "$lang"
   merge_error_code=$?
@@ -201,6 +253,9 @@ else
     exit $mkkb_error_code
   fi
 fi
+if ! $stage_cache record $merge_stage_args; then
+  echo "Warning: Merge stage was not recorded, it will be repeated next time"'!' >&2
+fi
 
 # Extraction complete
 echo "Extraction and merging complete!"
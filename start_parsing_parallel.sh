@@ -84,6 +84,14 @@ export master_classes_dir=`getMasterClassesDir "${dump_name}" "${lang}" "${tag}"
 export proj_tmp_dicts_dir=`getProjectTempDictsDir "${dump_name}" "${lang}" "${tag}" "${project_folder}"`
 export proj_tmp_types_data_dir=`getProjectTempTypesDataDir "${dump_name}" "${lang}" "${tag}" "${project_folder}"`
 export out_dir=`getProjectOutBaseDir "${dump_name}" "${lang}" "${tag}" "${project_folder}"`
+# suffix of compressed intermediate files (see OUTPUT_COMPRESSION in env_variables.cfg)
+export compression_suffix=`getCompressionSuffix`
+# collection of external identifiers for crosswalk index (see EXTERNAL_IDS in env_variables.cfg)
+if [ "${EXTERNAL_IDS}" = "true" ]; then
+  external_ids_option="--external-ids"
+else
+  external_ids_option=""
+fi
 
 # parse json dump
 echo "Parsing started"
@@ -98,7 +106,7 @@ err_file=${local_processing_dir}/err_parsing_`hostname`.err; \
 if test \"`ls -1 ${dump_src} | wc -l`\" == 0 ; then >&2 echo \"No input files found.\"; exit 1; fi; \
 find . -name '*.part????' -printf '%f\n' | \
 parallel -j 6 \
-\"${project_folder}/parseWikidataDump.py\" --language \"$lang\" -e -q -f {} -t \"`echo "{}" | awk -F'.' '{ print $NF }'`\" -p \"${local_processing_dir}\""
+\"${project_folder}/parseWikidataDump.py\" --language \"$lang\" -e -q --lazy-claims --compression \"${OUTPUT_COMPRESSION}\" -f {} -t \"`echo "{}" | awk -F'.' '{ print $NF }'`\" -p \"${local_processing_dir}\" ${external_ids_option}"
 if test "$?" -gt 0
 then
   >&2 echo "Some error(s) occured while parsing wikidata dump."
@@ -122,14 +130,15 @@ cat "${project_folder}/config/hosts.list" | while read host; do
   ssh -4 "$host" bash -s "${local_types_data_dir}" "${proj_tmp_types_data_dir}" \
          "${local_dicts_dir}" "${proj_tmp_dicts_dir}" \
          "${local_classes_dir}" "${master_classes_dir}" \
-         "$(cat /etc/hostname)" $(cat ${project_folder}/${FILE_MASTER_IPS}) << 'END'
+         "${compression_suffix}" "$(cat /etc/hostname)" $(cat ${project_folder}/${FILE_MASTER_IPS}) << 'END'
   local_types_data_dir="${1}"
   proj_tmp_types_data_dir="${2}"
   local_dicts_dir="${3}"
   proj_tmp_dicts_dir="${4}"
   local_classes_dir="${5}"
   master_classes_dir="${6}"
-  master_destinations=("${@:7}")
+  compression_suffix="${7}"
+  master_destinations=("${@:8}")
   if [ ! -d "${local_types_data_dir}" ] || [ ! -x "${local_types_data_dir}" ]; then
     echo "Parsed dump (${local_types_data_dir}) not found on $(cat /etc/hostname)"'!' >&2
     if [ ! -d "${local_types_data_dir}" ]
@@ -149,10 +158,11 @@ cat "${project_folder}/config/hosts.list" | while read host; do
   fi
 
   # download all types data files
+  # (concatenated gzip/zstd files are valid compressed files too)
   cd "${local_types_data_dir}"
   file_prefix="`ls | awk -F'.' '{ if($3~"part[0-9][0-9][0-9][0-9]" && $4=="tsv") print $1 }' | awk '{ if(!seen[$0]++) print $0 }' | grep -v -e instances`"
   echo "$file_prefix" | while read fp; do
-    cat "$fp"* >> "${proj_tmp_types_data_dir}/`echo "$fp" | awk -F'_' '{ print $1 }'`.tsv"
+    cat "$fp"* >> "${proj_tmp_types_data_dir}/`echo "$fp" | awk -F'_' '{ print $1 }'`.tsv${compression_suffix}"
   done
 
 
@@ -160,7 +170,7 @@ cat "${project_folder}/config/hosts.list" | while read host; do
   cd "${local_dicts_dir}"
   file_prefix="`ls | awk -F'.' '{ if($3~"part[0-9][0-9][0-9][0-9]" && $4=="tsv") print $1 }' | awk '{ if(!seen[$0]++) print $0 }' | grep -v -e instances`"
   echo "$file_prefix" | while read fp; do
-    cat "$fp"* >> "${proj_tmp_dicts_dir}/`echo "$fp" | awk -F'_' '{ print $1 }'`.tsv"
+    cat "$fp"* >> "${proj_tmp_dicts_dir}/`echo "$fp" | awk -F'_' '{ print $1 }'`.tsv${compression_suffix}"
   done
 
   # download all class dump files
@@ -201,23 +211,66 @@ if [ ! -d "${out_dir}" ] || [ ! -w "${out_dir}" ]; then
   exit 30
 fi
 
+# compile crosswalk index of external identifiers (see EXTERNAL_IDS in env_variables.cfg)
+if [ "${EXTERNAL_IDS}" = "true" ]; then
+  echo "Compiling crosswalk index"
+  python3 "$project_folder"/crosswalkIndex.py -f "${proj_tmp_dicts_dir}/crosswalk.tsv${compression_suffix}" \
+    -o "${out_dir}/`echo "$dump_name" | sed 's/-all.json//'`-crosswalk.idx"
+  if [ $? -ne 0 ]; then
+    echo "Failed to compile crosswalk index!" >&2
+    exit 32
+  fi
+fi
+
+# compile binary dictionary shared by all substitution processes
+echo "Compiling dictionary"
+python3 "$project_folder"/nameDictionary.py -f "${proj_tmp_dicts_dir}/dict.tsv${compression_suffix}" \
+  -o "${proj_tmp_dicts_dir}/dict.bin"
+if [ $? -ne 0 ]; then
+  echo "Failed to compile dictionary!" >&2
+  exit 31
+fi
+
 # parallel name substitution (on localhost only)
+# (final KB files are not compressed, they are processed by merge tools)
+# (ids of merged types are written without type prefix, as merge tools expect them)
+merged_types="person group person+artist geographical event organization artwork"
 echo "Starting name substitution"
 substitution_start=`timestamp`
-ls "${proj_tmp_types_data_dir}" | parallel \
+ls "${proj_tmp_types_data_dir}" | sed 's/\.tsv.*$//' | parallel \
 eval "
-if [ \"{}\" != \"dict.tsv\" ] ; then
-  echo \"Substituting names of {.} entities\"; \
+if [ \"{}\" != \"dict\" ] ; then
+  case \" ${merged_types} \" in
+    *\" {} \"*) id_format=bare ;;
+    *) id_format=prefixed ;;
+  esac
+  echo \"Substituting names of {} entities\"; \
   \"$project_folder\"/substituteNames.py \
-  -d \"${proj_tmp_dicts_dir}\"/dict.tsv \
-  -f \"${proj_tmp_types_data_dir}\"/\"{}\" \
-  -o \"${out_dir}\"/\"`echo "$dump_name" | sed 's/-all.json//'`\"-\"$lang\"-\"{.}\".tsv \
+  -d \"${proj_tmp_dicts_dir}\"/dict.bin \
+  -f \"${proj_tmp_types_data_dir}\"/\"{}\".tsv${compression_suffix} \
+  -o \"${out_dir}\"/\"`echo "$dump_name" | sed 's/-all.json//'`\"-\"$lang\"-\"{}\".tsv \
+  --compression none \
+  --id-format \$id_format \
   -e 0 8 9 10 11 \
   --remove-missing
 fi
 "
 substitution_end=`timestamp`
 
+# optional columnar copy of final KB files (see COLUMNAR_OUTPUT in env_variables.cfg)
+if [ "${COLUMNAR_OUTPUT}" = "true" ]; then
+  echo "Converting KB files to columnar format"
+  ls "${proj_tmp_types_data_dir}" | sed 's/\.tsv.*$//' | parallel \
+  eval "
+  if [ \"{}\" != \"dict\" ] ; then
+    \"$project_folder\"/columnarKB.py \
+    -f \"${out_dir}\"/\"`echo "$dump_name" | sed 's/-all.json//'`\"-\"$lang\"-\"{}\".tsv \
+    --head \"$project_folder\"/merge_KB/HEAD --type \"{}\" \
+    -o \"${out_dir}\"/\"`echo "$dump_name" | sed 's/-all.json//'`\"-\"$lang\"-\"{}\".columnar
+  fi
+  "
+fi
+
 # TODO
 # call scripts for downloading images etc.
 
@@ -11,6 +11,8 @@ import os  # filesystem
 import sys  # stderr, exit, ...
 import traceback  # for printing exceptions
 
+import compressedFiles  # compressed input and output files
+import nameDictionary  # binary dictionary
 import parseJson2  # for wikidata dump manipulator, WikidataNameInterchanger
 
 # get script name
@@ -22,24 +24,39 @@ def get_args():
     argparser.add_argument(
         "-d",
         "--dict-file",
-        help="Dictionary file with names and ids relations.",
-        type=argparse.FileType("r"),
+        help="Dictionary file with names and ids relations"
+        " (tsv or binary dictionary compiled by nameDictionary.py).",
         required=True,
     )
     argparser.add_argument(
         "-f",
         "--input-file",
         help="File with parsed KB where to substitute names.",
-        type=argparse.FileType("r"),
+        type=compressedFiles.FileType("r"),
         required=True,
     )
     argparser.add_argument(
         "-o",
         "--output-file",
         help="Output file with resulting KB.",
-        type=argparse.FileType("w"),
         required=True,
     )
+    argparser.add_argument(
+        "--compression",
+        help="Compression of output file (default: OUTPUT_COMPRESSION from env_variables.cfg)."
+        " Compressed input files are detected automatically.",
+        required=False,
+        choices=sorted(compressedFiles.COMPRESSION_SUFFIXES),
+        default=None,
+    )
+    argparser.add_argument(
+        "--id-format",
+        help="Format of entity ids (the first field) in output: prefixed = kept as in input (e.g. p:Q42),"
+        " bare = without type prefix, both = bare id and prefixed id as the last field (default=%(default)s).",
+        required=False,
+        choices=parseJson2.ID_FORMATS,
+        default="prefixed",
+    )
     argparser.add_argument(
         "--show-missing",
         help="Display ids with missing translation.",
@@ -90,13 +107,33 @@ def main():
     args = get_args()
 
     return_code = 0
+    try:
+        # binary dictionary is memory mapped, tsv dictionary is loaded to memory
+        if nameDictionary.is_name_dictionary(args.dict_file):
+            dictionary = nameDictionary.NameDictionary(args.dict_file)
+            dict_file = None
+        else:
+            dictionary = None
+            dict_file = compressedFiles.open_file(args.dict_file, "r")
+    except (IOError, ValueError) as e:
+        sys.stderr.write(f"{SCRIPT_NAME}: Failed to open dictionary! ({e})\n")
+        return 1
+    try:
+        output_file = parseJson2.TsvWriter.open(
+            args.output_file, "w", compression=args.compression
+        )
+    except (IOError, ValueError) as e:
+        sys.stderr.write(f"{SCRIPT_NAME}: Failed to open output file! ({e})\n")
+        return 1
     name_changer = parseJson2.WikidataNameInterchanger(
         input_file=args.input_file,
-        dict_file=args.dict_file,
-        output_file=args.output_file,
+        dict_file=dict_file,
+        dictionary=dictionary,
+        output_file=output_file,
         show_missing=args.show_missing,
         exclude=args.exclude,
         remove_missing=args.remove_missing,
+        id_format=args.id_format,
     )
     try:
         name_changer.substitute_names()
@@ -121,6 +158,8 @@ def main():
             + "\n"
         )
         return_code = 1
+    finally:
+        output_file.close()
 
     return return_code
 
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# encoding UTF-8
+
+# File: temporalIndex.py
+# Project: wikidata2
+# Description: Builds temporal index over dated KB (DATE OF BIRTH and DATE OF DEATH of persons, START DATE
+#              and END DATE of events, FOUNDED and CANCELLED of organizations) and queries it.
+#              Dates (+YYYY-MM-DD, zero month or day for year or month precision) are converted to intervals
+#              of day numbers (int64, days since 1970-01-01 in proleptic Gregorian calendar) with precision.
+#              Intervals are sorted by start and augmented by maximal end of implicit binary search tree
+#              stored in the same array (as in cgranges), so overlap query visits only O(log n + k) intervals.
+#              Index is stored next to the tsv file and memory mapped, queries return KB row ids
+#              (0-based index of row, lines of KB header are not counted).
+
+import argparse
+import mmap  # memory mapped index
+import os  # filesystem
+import re  # date parsing
+import struct  # file header
+import sys  # stdout, stderr, exit, byte order
+import traceback  # for printing exceptions
+from array import array  # day numbers, precisions and row ids
+
+import compressedFiles  # compressed input files
+import kbStore  # reading of KB header
+
+# get script name
+SCRIPT_NAME = os.path.basename(sys.argv[0])
+
+# magic bytes at the beginning of the index
+MAGIC = b"WDTIMEI1"
+# header: magic, byte order (b/l), padding, number of KB rows, number of intervals, level of root of the tree
+HEADER = struct.Struct("=8sc7xQQq")
+# suffix of index file (index of persons.tsv is persons.tsv.timeidx)
+INDEX_SUFFIX = ".timeidx"
+# default columns with start and end date of each type (see merge_KB/HEAD)
+TYPE_COLUMNS = {
+    "person": (13, 15),
+    "person+artist": (13, 15),
+    "event": (12, 13),
+    "organization": (12, 13),
+}
+# precisions of dates (the same values as used by wikidata)
+PRECISION_UNKNOWN = 0  # open end of interval
+PRECISION_YEAR = 9
+PRECISION_MONTH = 10
+PRECISION_DAY = 11
+# day numbers of open ends of intervals
+MIN_DAY = -(1 << 63)
+MAX_DAY = (1 << 63) - 1
+# subtrees of this level and lower are scanned linearly
+SCAN_LEVEL = 3
+# mean length of year in days
+YEAR_DAYS = 365.2425
+# date in KB format (+1732-02-22, +2001-00-00) or query format (1732-02-22, 2001)
+DATE_REGEXP = re.compile(r"([+-]?)([0-9]+)(?:-([0-9]{1,2})(?:-([0-9]{1,2}))?)?")
+
+
+def get_args():
+    argparser = argparse.ArgumentParser(
+        "Builds temporal index over dated KB and queries it."
+    )
+    argparser.add_argument(
+        "-f",
+        "--input-file",
+        help="KB of dated type in tsv format (may be compressed).",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output-file",
+        help=f"Output index (default: input file with {INDEX_SUFFIX} suffix).",
+    )
+    argparser.add_argument(
+        "--type",
+        help="Type of entities in KB, selects default columns (default=%(default)s).",
+        choices=list(TYPE_COLUMNS),
+        default="person",
+    )
+    argparser.add_argument(
+        "--start-column",
+        help="0-based index of column with start date (default: by type).",
+        type=int,
+    )
+    argparser.add_argument(
+        "--end-column",
+        help="0-based index of column with end date (default: by type).",
+        type=int,
+    )
+    argparser.add_argument(
+        "--max-open-years",
+        help="Intervals without end date end this number of years after start (default: never end).",
+        type=float,
+    )
+    argparser.add_argument(
+        "-r",
+        "--read",
+        help="Index to query, matching row ids are printed.",
+    )
+    argparser.add_argument(
+        "--at",
+        help="Print rows active at date (YYYY, YYYY-MM or YYYY-MM-DD, year or month covers whole range).",
+    )
+    argparser.add_argument(
+        "--during",
+        help="Print rows overlapping range of dates.",
+        nargs=2,
+        metavar=("START", "END"),
+    )
+    return argparser.parse_args()
+
+
+def get_index_path(tsv_path):
+    """
+    Returns path to the index of tsv file.
+    :param tsv_path: path to the KB (compression suffix is ignored)
+    :return: path to the index
+    """
+    for suffix in compressedFiles.COMPRESSION_SUFFIXES.values():
+        if suffix and tsv_path.endswith(suffix):
+            tsv_path = tsv_path[: -len(suffix)]
+    return tsv_path + INDEX_SUFFIX
+
+
+def days_from_civil(year, month, day):
+    """
+    Converts date of proleptic Gregorian calendar to day number.
+    :param year: year (astronomical numbering, 0 = 1 BC)
+    :param month: month (1-12)
+    :param day: day of month (1-31)
+    :return: number of days since 1970-01-01
+    """
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def civil_from_days(days):
+    """
+    Converts day number to date of proleptic Gregorian calendar.
+    :param days: number of days since 1970-01-01
+    :return: (year, month, day) tuple
+    """
+    days += 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (
+        day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096
+    ) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = month_index + (3 if month_index < 10 else -9)
+    return year_of_era + era * 400 + (month <= 2), month, day
+
+
+def parse_date(value):
+    """
+    Converts date to range of days it covers.
+    :param value: date in KB format (+1732-02-22, zero month or day for year or month precision)
+                  or without sign and missing parts (1732, 1732-02)
+    :return: (first day, last day, precision) tuple, None if date is missing or invalid
+    """
+    match = DATE_REGEXP.fullmatch(value.strip())
+    if match is None:
+        return None
+    year = int(match.group(2))
+    if match.group(1) == "-":
+        year = -year
+    month = int(match.group(3) or 0)
+    day = int(match.group(4) or 0)
+    if month > 12 or day > 31:
+        return None
+    if not month:
+        return days_from_civil(year, 1, 1), days_from_civil(year + 1, 1, 1) - 1, PRECISION_YEAR
+    next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    last_day = days_from_civil(*next_month, 1) - 1
+    if not day:
+        return days_from_civil(year, month, 1), last_day, PRECISION_MONTH
+    first_day = days_from_civil(year, month, day)
+    if first_day > last_day:  # day out of month
+        return None
+    return first_day, first_day, PRECISION_DAY
+
+
+def format_day(days, precision=PRECISION_DAY):
+    """
+    Converts day number to date in KB format.
+    :param days: number of days since 1970-01-01
+    :param precision: precision of date
+    :return: date string, empty string for open end of interval
+    """
+    if precision == PRECISION_UNKNOWN:
+        return ""
+    year, month, day = civil_from_days(days)
+    if precision <= PRECISION_YEAR:
+        month = 0
+    if precision <= PRECISION_MONTH:
+        day = 0
+    return f"{'-' if year < 0 else '+'}{abs(year):04d}-{month:02d}-{day:02d}"
+
+
+def index_intervals(starts, ends):
+    """
+    Computes maximal ends of implicit binary search tree over intervals sorted by start.
+    Leaves are even positions, node at position x of level k has children x - 2^(k-1) and x + 2^(k-1).
+    :param starts: sorted first days of intervals
+    :param ends: last days of intervals
+    :return: (maximal ends, level of root) tuple, level is -1 for empty tree
+    """
+    count = len(starts)
+    max_ends = array("q", ends)
+    if not count:
+        return max_ends, -1
+    last_index = last = 0
+    for i in range(0, count, 2):
+        last_index, last = i, ends[i]
+    level = 1
+    while 1 << level <= count:
+        half = 1 << (level - 1)
+        for i in range((half << 1) - 1, count, half << 2):
+            right = max_ends[i + half] if i + half < count else last
+            max_ends[i] = max(ends[i], max_ends[i - half], right)
+        # last_index becomes parent of the last node of previous level
+        last_index = last_index - half if (last_index >> level) & 1 else last_index + half
+        if last_index < count and max_ends[last_index] > last:
+            last = max_ends[last_index]
+        level += 1
+    return max_ends, level - 1
+
+
+def build_index(
+    file,
+    output_path,
+    start_column=TYPE_COLUMNS["person"][0],
+    end_column=TYPE_COLUMNS["person"][1],
+    max_open_years=None,
+):
+    """
+    Builds temporal index of KB.
+    Rows without valid start and end date are not indexed, missing start or end is open end of interval.
+    :param file: opened KB in tsv format
+    :param output_path: path to the index
+    :param start_column: index of column with start date
+    :param end_column: index of column with end date
+    :param max_open_years: intervals without end end this number of years after start (None = never end)
+    :raise IOError if fails to read or write
+    :return: (number of rows, number of indexed intervals)
+    """
+    _, rows = kbStore.read_kb(file)
+    intervals = []
+    row_count = 0
+    for row_id, (_, line) in enumerate(rows):
+        row_count += 1
+        fields = line.split("\t")
+        start = parse_date(fields[start_column]) if start_column < len(fields) else None
+        end = parse_date(fields[end_column]) if end_column < len(fields) else None
+        if start is None and end is None:
+            continue
+        first_day, _, start_precision = start if start else (MIN_DAY, None, PRECISION_UNKNOWN)
+        if end:
+            _, last_day, end_precision = end
+        elif max_open_years is not None and start:
+            last_day = first_day + round(max_open_years * YEAR_DAYS)
+            end_precision = PRECISION_UNKNOWN
+        else:
+            last_day, end_precision = MAX_DAY, PRECISION_UNKNOWN
+        if last_day < first_day:  # end before start, keep both dates
+            first_day, last_day = last_day, first_day
+        intervals.append((first_day, last_day, row_id, start_precision, end_precision))
+    intervals.sort()
+
+    starts = array("q", (interval[0] for interval in intervals))
+    ends = array("q", (interval[1] for interval in intervals))
+    max_ends, root_level = index_intervals(starts, ends)
+    with open(output_path, "wb") as output:
+        output.write(
+            HEADER.pack(
+                MAGIC,
+                b"l" if sys.byteorder == "little" else b"b",
+                row_count,
+                len(intervals),
+                root_level,
+            )
+        )
+        starts.tofile(output)
+        ends.tofile(output)
+        max_ends.tofile(output)
+        array("I", (interval[2] for interval in intervals)).tofile(output)
+        array("B", (interval[3] for interval in intervals)).tofile(output)
+        array("B", (interval[4] for interval in intervals)).tofile(output)
+    return row_count, len(intervals)
+
+
+class TemporalIndex:
+    """
+    Read-only temporal index stored in memory mapped file.
+    """
+
+    def __init__(self, path):
+        """
+        Maps index to memory.
+        :param path: path to the index
+        :raise IOError if fails to open file
+        :raise ValueError if file is not temporal index or has different byte order
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, self.rows, self.count, self.root_level = HEADER.unpack_from(
+            self.mmap
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not temporal index!")
+        if byte_order != (b"l" if sys.byteorder == "little" else b"b"):
+            raise ValueError(f"Byte order of {path} differs from byte order of this machine!")
+
+        self.view = memoryview(self.mmap)
+        start, end = HEADER.size, HEADER.size + self.count * 8
+        self.starts = self.view[start:end].cast("q")
+        start, end = end, end + self.count * 8
+        self.ends = self.view[start:end].cast("q")
+        start, end = end, end + self.count * 8
+        self.max_ends = self.view[start:end].cast("q")
+        start, end = end, end + self.count * 4
+        self.row_ids = self.view[start:end].cast("I")
+        start, end = end, end + self.count
+        self.start_precisions = self.view[start:end]
+        start, end = end, end + self.count
+        self.end_precisions = self.view[start:end]
+
+    def get_interval(self, interval):
+        """
+        :param interval: index of interval
+        :return: (row id, start date, end date) tuple, dates are in KB format (empty for open end)
+        """
+        return (
+            self.row_ids[interval],
+            format_day(self.starts[interval], self.start_precisions[interval]),
+            format_day(self.ends[interval], self.end_precisions[interval]),
+        )
+
+    def get_overlapping_intervals(self, first_day, last_day):
+        """
+        Finds intervals overlapping range of days.
+        :param first_day: first day of range
+        :param last_day: last day of range
+        :return: list of indices of intervals (sorted by start)
+        """
+        count = self.count
+        starts, ends, max_ends = self.starts, self.ends, self.max_ends
+        found = []
+        # stack of (level, node, left subtree visited) tuples
+        stack = [(self.root_level, (1 << self.root_level) - 1, False)] if count else []
+        while stack:
+            level, node, left_visited = stack.pop()
+            if level <= SCAN_LEVEL:  # small subtree, linear scan
+                i = node >> level << level
+                end = min(count, i + (1 << (level + 1)) - 1)
+                while i < end and starts[i] <= last_day:
+                    if ends[i] >= first_day:
+                        found.append(i)
+                    i += 1
+            elif not left_visited:
+                stack.append((level, node, True))
+                child = node - (1 << (level - 1))
+                # node may be out of range, its left subtree is not
+                if child >= count or max_ends[child] >= first_day:
+                    stack.append((level - 1, child, False))
+            elif node < count and starts[node] <= last_day:
+                if ends[node] >= first_day:
+                    found.append(node)
+                stack.append((level - 1, node + (1 << (level - 1)), False))
+        return found
+
+    def overlapping(self, first_day, last_day):
+        """
+        Finds rows with intervals overlapping range of days.
+        :param first_day: first day of range (see days_from_civil())
+        :param last_day: last day of range
+        :return: list of row ids (sorted by start of interval)
+        """
+        return [
+            self.row_ids[i] for i in self.get_overlapping_intervals(first_day, last_day)
+        ]
+
+    def at(self, date):
+        """
+        Finds rows active at date (e.g. persons alive at date).
+        :param date: date (see parse_date()), year or month precision covers whole year or month
+        :raise ValueError if date is invalid
+        :return: list of row ids (sorted by start of interval)
+        """
+        return self.during(date, date)
+
+    def during(self, start_date, end_date):
+        """
+        Finds rows overlapping range of dates (e.g. events in range).
+        :param start_date: first date of range (see parse_date())
+        :param end_date: last date of range
+        :raise ValueError if date is invalid
+        :return: list of row ids (sorted by start of interval)
+        """
+        start = parse_date(start_date)
+        end = parse_date(end_date)
+        if start is None or end is None:
+            raise ValueError(f"Invalid date range '{start_date}' - '{end_date}'!")
+        return self.overlapping(start[0], end[1])
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """
+        Unmaps the index.
+        """
+        for view in (
+            self.starts,
+            self.ends,
+            self.max_ends,
+            self.row_ids,
+            self.start_precisions,
+            self.end_precisions,
+        ):
+            view.release()
+        self.view.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def main():
+    args = get_args()
+
+    if args.read:
+        try:
+            with TemporalIndex(args.read) as index:
+                if args.at:
+                    for row_id in index.at(args.at):
+                        sys.stdout.write(f"{row_id}\n")
+                if args.during:
+                    for row_id in index.during(*args.during):
+                        sys.stdout.write(f"{row_id}\n")
+        except (IOError, ValueError):
+            sys.stderr.write(
+                SCRIPT_NAME
+                + ": Failed to query temporal index! Handled error:\n"
+                + str(traceback.format_exc())
+                + "\n"
+            )
+            return 1
+        return 0
+
+    if not args.input_file:
+        sys.stderr.write("Input file must be set for building of index!\n")
+        sys.stderr.write("Use '--help' to see '-f' option!\n")
+        return 1
+
+    start_column, end_column = TYPE_COLUMNS[args.type]
+    try:
+        input_file = compressedFiles.open_file(args.input_file, "r")
+        row_count, interval_count = build_index(
+            input_file,
+            args.output_file or get_index_path(args.input_file),
+            start_column if args.start_column is None else args.start_column,
+            end_column if args.end_column is None else args.end_column,
+            args.max_open_years,
+        )
+        input_file.close()
+    except IOError:
+        sys.stderr.write(
+            SCRIPT_NAME
+            + ": Failed to build temporal index! Handled error:\n"
+            + str(traceback.format_exc())
+            + "\n"
+        )
+        return 1
+    print(f"Rows: {row_count}, indexed intervals: {interval_count}")
+    return 0
+
+
+# name guard for calling main function
+if __name__ == "__main__":
+    sys.exit(main())
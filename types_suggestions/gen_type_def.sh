@@ -11,6 +11,8 @@
 help() {
   echo "Usage:"
   echo "  sh gen_type_def.sh top_class path/to/wikidata/id/dictionary [ path/to/wikidata/subclass/list ] [ path/to/wikidata/transitive/closure ] [ path/to/project/folder ]"
+  echo "Subclass list of top level classes only can be generated by:"
+  echo "  python3 classRelationsBuilder.py -c path/to/class/relations -a subclass_list.tsv --top-classes types_suggestions/top_level_classes"
 }
 
 # default values
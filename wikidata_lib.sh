@@ -152,6 +152,21 @@ getWikidataFilePathForType() {
   echo -n "${basedir}/`echo "${dump_name}" | sed 's/-all.json//'`-${lang}-${type}.tsv"
 }
 
+# prints suffix of intermediate files compressed by OUTPUT_COMPRESSION (none/gzip/zstd)
+getCompressionSuffix() {
+  case "${OUTPUT_COMPRESSION}" in
+    gzip )
+      echo -n ".gz"
+      ;;
+    zstd )
+      echo -n ".zst"
+      ;;
+    * )
+      echo -n ""
+      ;;
+  esac
+}
+
 # $1 = dir to recreate
 recreate_dir() {
   if test -d "${1}"